@@ -0,0 +1,73 @@
+"""Сравнение RecordCodec с pickle: время сериализации и чтения, размер данных
+
+Замеряются отдельные сущности каждого типа (как записи журнала и строки SQLite) и таблица целиком (как снимок).
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Individual_RZD import RecordCodec, Train, TrainBrigade, TrainTimetable, TicketSalesSheet, WorkerRZD  # noqa: E402
+
+
+def make_worker(i):
+    return WorkerRZD('Иванов', 'Иван{0}'.format(i), 'Иванович', 1980, 2005, 18, 'проводник', 'м',
+                     'ул. Ленина, {0}'.format(i), 'Москва', '+7900{0:07d}'.format(i))
+
+
+def make_train(i):
+    return Train(i, 2010, 12, 'скоростной')
+
+
+def make_timetable(i):
+    return TrainTimetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь', 'Москва - Тверь',
+                          1500, i, 2010, 12, 'скоростной')
+
+
+def make_brigade(i):
+    return TrainBrigade(str(i), 'Петров', 'Пётр{0}'.format(i), 'машинист', i % 100)
+
+
+def make_sheet(i):
+    return TicketSalesSheet(i % 100, '2023-05-01 10:00:00', 'Петров Пётр Петрович', '4510 {0:06d}'.format(i),
+                            1, 'нет', 1500, sale_id=i)
+
+
+def timed(function, items):
+    """Возвращает время обработки всех элементов в микросекундах на элемент и результаты"""
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return (time.perf_counter() - start) / len(items) * 1e6, results
+
+
+def compare(items):
+    """Возвращает для pickle и RecordCodec: запись, чтение (мкс на элемент) и размер (байт на элемент)"""
+    rows = []
+    for name, dumps, loads in (('pickle', pickle.dumps, pickle.loads),
+                               ('codec', RecordCodec.encode, RecordCodec.decode)):
+        encode_time, encoded = timed(dumps, items)
+        decode_time, decoded = timed(loads, encoded)
+        rows.append((name, encode_time, decode_time, sum(map(len, encoded)) / len(items)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=20000, help='кол-во объектов каждого типа')
+    args = parser.parse_args()
+    print('{0:<18}{1:<8}{2:>14}{3:>14}{4:>12}'.format('Данные', 'Формат', 'запись, мкс', 'чтение, мкс', 'размер, Б'))
+    report = []
+    for name, factory in (('WorkerRZD', make_worker), ('Train', make_train), ('TrainTimetable', make_timetable),
+                          ('TrainBrigade', make_brigade), ('TicketSalesSheet', make_sheet)):
+        report.append((name, compare([factory(i) for i in range(args.count)])))
+    report.append(('таблица продаж', compare([{i: make_sheet(i) for i in range(args.count)}])))
+    for name, rows in report:
+        for fmt, encode_time, decode_time, size in rows:
+            print('{0:<18}{1:<8}{2:>14.2f}{3:>14.2f}{4:>12.0f}'.format(name, fmt, encode_time, decode_time, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Нагрузочный замер операций RzdDatabase на синтетических данных растущего объёма
+
+Для каждого объёма база заполняется в отдельном процессе (чтобы пиковая память процесса относилась
+только к нему), после чего замеряются задержки отдельных операций, сохранение и открытие базы.
+Результаты выводятся в формате JSON.
+
+Пример: python benchmarks/bench_database.py --sizes 1000 10000 100000 --mode journal --segmented --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # на Windows пиковая память процесса не замеряется
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Individual_RZD import RzdDatabase, SqliteStorage  # noqa: E402
+
+CITIES = ('Москва', 'Тверь', 'Клин', 'Бологое', 'Вышний Волочёк', 'Санкт-Петербург')
+POSITIONS = ('машинист', 'проводник', 'кассир', 'диспетчер', 'ремонтник путей')
+SURNAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов')
+TYPES_OF_TRAIN = ('общий', 'скоростной', 'высокоскоростной')
+
+
+class SyntheticStation:
+    """Генератор синтетических данных вокзала с фиксированным зерном"""
+
+    def __init__(self, size, seed):
+        """Инициализирует атрибуты size(кол-во ведомостей продаж) и rng(генератор случайных чисел)"""
+        self.size = size
+        self.rng = random.Random(seed)
+        self.trains = max(1, size // 100)
+        self.workers = max(1, size // 10)
+        self.timetables = max(1, size // 10)
+
+    def worker(self, i):
+        rng = self.rng
+        return (rng.choice(SURNAMES), 'работник{0}'.format(i), 'Иванович', rng.randint(1960, 2000),
+                rng.randint(2000, 2023), rng.randint(0, 30), rng.choice(POSITIONS), rng.choice('мж'),
+                'ул. Вокзальная, {0}'.format(i), rng.choice(CITIES), '+7900{0:07d}'.format(i))
+
+    def train(self, i):
+        return i, self.rng.randint(1990, 2023), self.rng.randint(4, 20), self.rng.choice(TYPES_OF_TRAIN)
+
+    def timetable(self, i):
+        rng = self.rng
+        day = '2023-{0:02d}-{1:02d}'.format(rng.randint(1, 12), rng.randint(1, 28))
+        departure, arrival = rng.sample(CITIES, 2)
+        return (day, '{0:02d}:{1:02d}'.format(rng.randint(0, 23), rng.randint(0, 59)), departure, day,
+                '{0:02d}:{1:02d}'.format(rng.randint(0, 23), rng.randint(0, 59)), arrival,
+                '{0} - {1}'.format(departure, arrival), rng.randint(500, 5000), i % self.trains)
+
+    def brigade(self, i):
+        rng = self.rng
+        return str(i), rng.choice(SURNAMES), 'бригадир{0}'.format(i), rng.choice(POSITIONS), i % self.trains
+
+    def sale(self, i):
+        rng = self.rng
+        return (rng.randrange(self.trains), 'Пассажир {0}'.format(i), '45{0:08d}'.format(i), rng.randint(1, 4),
+                rng.choice(('нет', 'нет', 'нет', 'да')), rng.randint(500, 5000), None,
+                '2023-{0:02d}-{1:02d} 10:00'.format(rng.randint(1, 12), rng.randint(1, 28)))
+
+
+def percentiles(samples):
+    """Возвращает перцентили задержки (в секундах) по замерам в наносекундах"""
+    ordered = sorted(samples)
+    result = {}
+    for percentile in (50, 95, 99):
+        result['p{0}'.format(percentile)] = ordered[min(len(ordered) - 1, len(ordered) * percentile // 100)] / 1e9
+    return result
+
+
+def measure(function, arguments):
+    """Замеряет каждый вызов отдельно; возвращает пропускную способность и перцентили задержки"""
+    samples = []
+    for args in arguments:
+        start = time.perf_counter_ns()
+        function(*args)
+        samples.append(time.perf_counter_ns() - start)
+    stats = {'calls': len(samples), 'throughput': len(samples) / (sum(samples) / 1e9 or 1e-9)}
+    stats.update(percentiles(samples))
+    return stats
+
+
+def files_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(directory) for name in names)
+
+
+def run_size(size, seed, samples, mode, segmented):
+    """Заполняет базу заданного объёма и замеряет операции; выполняется в отдельном процессе"""
+    station = SyntheticStation(size, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'rzd.pkl')
+        storage = SqliteStorage(os.path.join(directory, 'rzd.sqlite')) if mode == 'sqlite' else None
+        db = RzdDatabase(filename, journal=(mode == 'journal'), segmented=segmented, storage=storage)
+        result = {'size': size, 'mode': mode, 'segmented': segmented, 'seed': seed, 'operations': {}}
+        operations = result['operations']
+
+        start = time.perf_counter()
+        with db.batch():
+            for i in range(station.trains):
+                db.add_train(*station.train(i))
+            for i in range(station.workers):
+                db.add_worker(*station.worker(i))
+            for i in range(station.timetables):
+                db.add_train_timetable(*station.timetable(i))
+            for i in range(station.trains):
+                db.add_train_brigade(*station.brigade(i))
+            for i in range(size):
+                db.add_ticket_sales_sheet(*station.sale(i))
+        elapsed = time.perf_counter() - start
+        records = station.trains * 2 + station.workers + station.timetables + size
+        operations['bulk_load'] = {'records': records, 'seconds': elapsed, 'throughput': records / elapsed}
+
+        rng = station.rng
+        worker_names = [worker.name for worker in db.database['workers'].values()]
+        timetable_numbers = list(db.database['train_timetables'])
+        sale_ids = list(db.database['ticket_sales_sheets'])
+        operations['add_ticket_sales_sheet'] = measure(
+            db.add_ticket_sales_sheet, [station.sale(size + i) for i in range(samples)])
+        operations['add_train_timetable'] = measure(
+            db.add_train_timetable, [station.timetable(station.timetables + i) for i in range(samples)])
+        operations['get_worker_by_name'] = measure(
+            db.get_worker_by_name, [(rng.choice(worker_names),) for _ in range(samples)])
+        operations['get_train_timetable_by_number'] = measure(
+            db.get_train_timetable_by_number, [(rng.choice(timetable_numbers),) for _ in range(samples)])
+        operations['get_ticket_sales_sheet_by_id'] = measure(
+            db.get_ticket_sales_sheet_by_id, [(rng.choice(sale_ids),) for _ in range(samples)])
+        operations['find_workers_by_city'] = measure(
+            lambda city: db.find('workers', city=city), [(rng.choice(CITIES),) for _ in range(samples)])
+        operations['save_database'] = measure(db.save_database, [()] * 3)
+        operations['open_database'] = measure(db.open_database, [()] * 3)
+        db.close()
+
+        result['file_size'] = files_size(directory)
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='кол-во ведомостей продаж (остальные таблицы пропорциональны)')
+    parser.add_argument('--seed', type=int, default=17, help='зерно генератора данных')
+    parser.add_argument('--samples', type=int, default=100, help='кол-во замеров каждой операции')
+    parser.add_argument('--mode', choices=('snapshot', 'journal', 'sqlite'), default='snapshot',
+                        help='режим хранения базы (sqlite - хранилище SqliteStorage)')
+    parser.add_argument('--segmented', action='store_true',
+                        help='сегментная раскладка: таблицы и дни продаж в отдельных файлах')
+    parser.add_argument('--output', help='файл для результатов JSON (по умолчанию - стандартный вывод)')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in args.sizes:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_size, (size, args.seed, args.samples, args.mode, args.segmented)))
+        print('размер {0}: готово'.format(size), file=sys.stderr)
+    report = {'python': sys.version.split()[0], 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Замер памяти, занимаемой сущностями на слотах, в сравнении с прежним хранением в словаре экземпляра"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Individual_RZD import Train, TrainTimetable, TicketSalesSheet, WorkerRZD  # noqa: E402
+
+
+def make_worker(i):
+    return WorkerRZD('Иванов', 'Иван{0}'.format(i), 'Иванович', 1980, 2005, 18, 'проводник', 'м',
+                     'ул. Ленина, {0}'.format(i), 'Москва', '+7900{0:07d}'.format(i))
+
+
+def make_train(i):
+    return Train(i, 2010, 12, 'скоростной')
+
+
+def make_timetable(i):
+    return TrainTimetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь', 'Москва - Тверь',
+                          1500, i, 2010, 12, 'скоростной')
+
+
+def make_sheet(i):
+    return TicketSalesSheet(i % 100, '2023-05-01 10:00:00', 'Петров Пётр Петрович', '4510 {0:06d}'.format(i),
+                            1, 'нет', 1500, sale_id=i)
+
+
+class LegacyEntity:
+    """Объект с прежней раскладкой: словарь экземпляра и отдельный список очереди транзакций"""
+
+
+def legacy_copy(obj):
+    """Создаёт объект с тем же состоянием в прежней раскладке (атрибуты в __dict__, пустая очередь)"""
+    legacy = LegacyEntity()
+    legacy.__dict__.update(obj.__getstate__())
+    legacy.__dict__['_{0}__queue'.format(type(obj).__name__)] = []
+    return legacy
+
+
+def measure(factory, count):
+    """Возвращает среднее число байт на объект"""
+    tracemalloc.start()
+    objects = [factory(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000, help='кол-во объектов каждого типа')
+    args = parser.parse_args()
+    print('{0:<18}{1:>14}{2:>14}{3:>10}'.format('Сущность', 'словарь, Б', 'слоты, Б', 'экономия'))
+    rows = []
+    for name, factory in (('WorkerRZD', make_worker), ('Train', make_train),
+                          ('TrainTimetable', make_timetable), ('TicketSalesSheet', make_sheet)):
+        slotted = measure(factory, args.count)
+        legacy = measure(lambda i: legacy_copy(factory(i)), args.count)
+        rows.append((name, legacy, slotted))
+    for name, legacy, slotted in rows:
+        print('{0:<18}{1:>14.0f}{2:>14.0f}{3:>9.0%}'.format(name, legacy, slotted, 1 - slotted / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,246 @@
 """Создание программы на объектно-ориентированном языке Python для железнодорожного вокзала"""
+import abc
+import array
+import asyncio
+import atexit
+import bisect
+import builtins
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import operator
+import os
 import pickle
+import sqlite3
+import struct
+import sys
+import threading
 import time
-from datetime import datetime
+import types
+import zlib
+from datetime import date, datetime, time as time_of_day, timedelta
+from decimal import Decimal
+
+try:
+    import numpy
+except ImportError:
+    # без NumPy колоночные агрегаты считаются циклом по массивам array
+    numpy = None
+
+try:
+    import fcntl
+except ImportError:
+    # на Windows блокировок файлов нет: совместная работа нескольких процессов недоступна
+    fcntl = None
+
+# Сообщения сущностей (деструкторы, ошибки проверки значений, действия) пишутся в журнал logging
+# и по умолчанию никуда не выводятся; set_verbose() возвращает их вывод в консоль
+logger = logging.getLogger(__name__)
+# уровень WARNING не пропускает сообщения сущностей и к обработчикам корневого журнала приложения
+logger.setLevel(logging.WARNING)
+_verbose_handler = None
+# Признак отсутствующей записи в журнале отката транзакции
+_MISSING = object()
+# Форматы, в которых в расписание вводятся даты и время
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d.%m.%y', '%d/%m/%Y')
+TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%H.%M')
+
+
+def parse_datetime(date_value, time_value=None):
+    """Преобразует дату (и время) в datetime; возвращает None, если формат не распознан"""
+    if isinstance(date_value, datetime):
+        return date_value
+    if isinstance(date_value, date):
+        result = datetime(date_value.year, date_value.month, date_value.day)
+    elif isinstance(date_value, str):
+        try:
+            # дата ISO, в том числе со временем, например ключ ведомости продаж '2023-05-01 12:30:00'
+            result = datetime.fromisoformat(date_value.strip())
+        except ValueError:
+            result = _parse_with_formats(date_value.strip(), DATE_FORMATS)
+            if result is None:
+                return None
+    else:
+        return None
+    if time_value is None:
+        return result
+    if not isinstance(time_value, str):
+        return None
+    try:
+        # время ISO ('10:05', '10:05:30') разбирается без strptime
+        moment = time_of_day.fromisoformat(time_value.strip())
+    except ValueError:
+        moment = _parse_with_formats(time_value.strip(), TIME_FORMATS)
+        if moment is None:
+            return None
+    return result.replace(hour=moment.hour, minute=moment.minute, second=moment.second)
+
+
+def set_verbose(enabled=True, stream=None):
+    """Включает или выключает вывод сообщений сущностей в консоль (по умолчанию в sys.stdout)"""
+    global _verbose_handler
+    if _verbose_handler is not None:
+        logger.removeHandler(_verbose_handler)
+        _verbose_handler = None
+    if enabled:
+        _verbose_handler = logging.StreamHandler(stream or sys.stdout)
+        _verbose_handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(_verbose_handler)
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.WARNING)
+
+
+def _parse_with_formats(value, formats):
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
 
 
 class RzdDatabase:
     """Класс контейнер использующий сериализацию и для хранения основных сущностей, применяющий словарь"""
 
-    def __init__(self):
-        self.filename = 'rzd.pkl'
+    # Заголовок снимка: сигнатура, длина и контрольная сумма данных
+    SNAPSHOT_HEADER = struct.Struct('<4sII')
+    SNAPSHOT_MAGIC = b'RZD1'
+    # Сигнатура сжатого архива дня продаж
+    ARCHIVE_MAGIC = b'RZDZ'
+    # Первый байт файла pickle старого формата без заголовка (протокол 2 и выше)
+    PICKLE_PREFIX = b'\x80'
+    # Заголовок записи журнала: длина и контрольная сумма полезной нагрузки
+    JOURNAL_RECORD_HEADER = struct.Struct('<II')
+    # Минимальный размер журнала (в байтах), после которого запускается сжатие
+    COMPACT_MIN_BYTES = 1 << 20
+    TABLES = ('workers', 'train_timetables', 'trains', 'train_brigades', 'ticket_sales_sheets', 'seat_maps')
+    SEGMENT_SUFFIX = '.seg'
+    # Вторичные индексы: таблица -> {имя индекса: функция получения значения из записи}
+    INDEXES = {
+        'workers': {
+            'city': operator.attrgetter('city'),
+            'position': operator.attrgetter('position'),
+            'name': operator.attrgetter('name'),
+        },
+        'train_timetables': {
+            'place_of_departure': operator.attrgetter('place_of_departure'),
+            'place_of_arrival': operator.attrgetter('place_of_arrival'),
+            'route': operator.attrgetter('route'),
+            'date_of_departure': operator.attrgetter('date_of_departure'),
+        },
+        'trains': {
+            'type_of_train': operator.attrgetter('type_of_train'),
+        },
+        'train_brigades': {
+            'number_of_train': operator.attrgetter('number_of_train'),
+            'brigade_number': operator.attrgetter('brigade_number'),
+        },
+        'ticket_sales_sheets': {
+            'number_of_train': operator.attrgetter('number_of_train'),
+            'date': lambda sheet: str(sheet.sale_datetime)[:10],
+        },
+        'seat_maps': {
+            'number_of_train': operator.attrgetter('number_of_train'),
+        },
+    }
+    # Таблицы с суррогатными ключами записей: таблица -> атрибут записи, хранящий её ключ
+    RECORD_IDS = {'workers': 'worker_id', 'train_brigades': 'brigade_id'}
+    # Упорядоченные индексы для запросов по диапазону времени
+    SORTED_INDEXES = {
+        'train_timetables': {
+            'departure': lambda timetable: parse_datetime(timetable.date_of_departure, timetable.time_of_departure),
+        },
+        'ticket_sales_sheets': {
+            'sale_datetime': lambda sheet: parse_datetime(sheet.sale_datetime),
+        },
+    }
+
+    def __init__(self, filename='rzd.pkl', journal=False, sync=True, node=None, columnar=False, segmented=False,
+                 shared=False, storage=None, legacy=False, recover=False):
+        """Открывает базу; при journal=True изменения дописываются в журнал, а не пересохраняют весь файл;
+        node - номер кассы, различающий номера продаж разных процессов (по умолчанию 0, а в совместном режиме -
+        первый свободный; занятый другим процессом номер отклоняется);
+        columnar=True включает колоночное представление ведомостей для отчётов;
+        segmented=True хранит каждую таблицу в своём сегменте, а продажи - по дням, и читает их при первом обращении;
+        изменения в этом режиме всегда пишутся в журнал: перезапись нескольких сегментов не атомарна, и после сбоя
+        посреди неё сегменты дописываются повторным применением журнала;
+        shared=True позволяет нескольким процессам работать с одной базой через общий журнал;
+        storage - подключаемое хранилище таблиц (например, SqliteStorage) вместо файлов pickle;
+        legacy=True однократно переводит в формат RecordCodec данные, сохранённые прежними версиями через pickle.
+        Без него такие данные не читаются: pickle при чтении может выполнить произвольный код;
+        recover=True читает вместо повреждённых файлов их предыдущие поколения (.prev). Изменения, сохранённые
+        после предыдущего поколения, при этом теряются, а журнал, записанный поверх повреждённого снимка,
+        не применяется и откладывается в файлы .unapplied. Без него повреждённый файл - ошибка DatabaseCorruptedError"""
+        if shared and fcntl is None:
+            raise ValueError('shared mode is not supported on this platform')
+        if storage is not None and (journal or segmented or shared):
+            raise ValueError('storage backend cannot be combined with journal, segmented or shared mode')
+        self.filename = filename
+        self.storage = storage  # Подключаемое хранилище таблиц или None для файлов pickle
+        self.journal = journal or shared or segmented  # Режим журналирования изменений
+        self.shared = shared  # Совместная работа нескольких процессов
+        self.sync = sync  # Сбрасывать ли записи журнала на диск (fsync) сразу
+        self.segmented = segmented  # Сегментная раскладка базы на диске
+        self.legacy = legacy  # Читать ли данные pickle прежних версий (до их перевода в RecordCodec)
+        self.recover = recover  # Читать ли предыдущие поколения вместо повреждённых файлов
+        self._recovered = False  # Прочитано ли при открытии предыдущее поколение повреждённого файла
+        self.journal_filename = os.path.splitext(filename)[0] + '.journal'
+        self.segments_dirname = os.path.splitext(filename)[0] + '.d'
+        self.archive_dirname = os.path.splitext(filename)[0] + '.archive'
+        self.nodes_dirname = os.path.splitext(filename)[0] + '.nodes'
         self.database = {
             'workers': {},
             'train_timetables': {},
             'trains': {},
             'train_brigades': {},
-            'ticket_sales_sheets': {}
+            'ticket_sales_sheets': PartitionedTable(),
+            'seat_maps': {}
         }
         self.index = 0
-        try:
-            self.open_database()
-        except:
-            self.save_database()
+        self._dirty = {}  # Изменённые записи (таблица, ключ), ещё не сохранённые
+        self._undo = None  # Журнал отката открытой транзакции
+        self._transaction_depth = 0
+        self._indexes = {table: {name: HashIndex(getter) for name, getter in indexes.items()}
+                         for table, indexes in self.INDEXES.items()}
+        for table, indexes in self.SORTED_INDEXES.items():
+            for name, getter in indexes.items():
+                self._indexes[table][name] = SortedIndex(getter)
+        if columnar:
+            self._indexes["ticket_sales_sheets"]["columns"] = SalesColumns()
+        # переезды для поиска маршрутов с пересадками - индекс расписаний
+        self._indexes["train_timetables"]["connections"] = ConnectionIndex()
+        self._indexed = set()  # Таблицы, индексы которых уже построены
+        self._unindexed = {}  # Записи (таблица, ключ), изъятые из индексов до окончания изменения
+        self._unsaved_segments = {}  # Сегменты, изменённые после последнего снимка (режим журнала)
+        self._node_file = None  # Заблокированный файл занятого номера кассы (совместный режим)
+        self.node = self._claim_node(node) if shared else node if node is not None else 0  # Номер кассы
+        self.sale_ids = SaleIdGenerator(self.node)  # Генератор номеров продаж
+        self.record_ids = RecordIdAllocator(self.node)  # Генератор ключей работников и бригад
+        self.seats = SeatInventory(self._seat_capacity)  # Учёт мест рейсов по таблице seat_maps и брони
+        self._journal_file = None
+        self._journal_size = 0
+        self._snapshot_size = 0
+        self._compactor = None  # Фоновый поток сжатия журнала
+        self._lock_file = open(os.path.splitext(filename)[0] + '.lock', 'ab') if shared else None
+        self._lock_mode = None  # Удерживаемая блокировка файлов базы
+        with self._locked(exclusive=True):
+            try:
+                self.open_database()
+            except FileNotFoundError:
+                # базы ещё нет: создаём пустую; повреждённый файл не перезаписывается
+                self.save_database()
 
     def __iter__(self):
-        for item in self.database:
-            yield self.database[item]
+        for table in self.TABLES:
+            yield self.database[table]
 
     def next(self):
         if self.index == len(self.database):
@@ -39,81 +255,1021 @@ class RzdDatabase:
         return self.database[self.index]
 
     def open_database(self):
-        with open(self.filename, 'rb') as f:
-            self.database = pickle.load(f)
+        """Открывает базу; в сегментной раскладке таблицы и дни продаж читаются при первом обращении к ним"""
+        self._unsaved_segments.clear()
+        self._recovered = False
+        if self.storage is not None:
+            # записи читаются из хранилища по ключу при обращении к ним
+            self.database = self.storage.tables(self.TABLES)
+            self.database["ticket_sales_sheets"].on_load = self._bind_ticket_sales_sheets
+            self.database["train_timetables"].on_load = self._bind_trains
+            self.database["train_brigades"].on_load = self._bind_trains
+            for table in self.database.values():
+                table.legacy = self.legacy
+            migrate = False
+        elif self.segmented and os.path.isdir(self.segments_dirname):
+            self.database = SegmentedTables(self._load_segment)
+            migrate = False
+        else:
+            try:
+                self.database = self._read_snapshot()
+            except FileNotFoundError:
+                if not self.journal:
+                    raise
+                # в режиме журнала снимка может ещё не быть: состояние восстанавливается по журналу
+            self._bind_trains(self.database["train_timetables"].values())
+            self._bind_trains(self.database["train_brigades"].values())
+            if not isinstance(self.database["ticket_sales_sheets"], PartitionedTable):
+                # в снимке прежнего формата продажи хранились одним словарём
+                self.database["ticket_sales_sheets"] = PartitionedTable(self.database["ticket_sales_sheets"])
+            # в снимке прежнего формата карт мест ещё не было
+            self.database.setdefault("seat_maps", {})
+            # база из одного файла при первом открытии в сегментном режиме раскладывается по сегментам
+            migrate = self.segmented
+        if self.journal:
+            # журнал, оставшийся от незавершённого сжатия, применяется первым
+            journals = [self._read_journal(self.journal_filename + '.old'), self._read_journal(self.journal_filename)]
+            if self.recover:
+                # сегменты, которые изменяет журнал, читаются до него: их повреждение тоже видно заранее
+                self._load_segments_of(record for records, size in journals for record in records)
+            if self._recovered:
+                self._set_aside_journals()
+                self._journal_size = 0
+            else:
+                for records, size in journals:
+                    for changes in records:
+                        self._apply_changes(changes)
+                self._journal_size = journals[1][1]
+            if self._journal_file is not None:
+                self._journal_file.close()
+            self._journal_file = open(self.journal_filename, 'ab')
+        changes = self._assign_record_ids()
+        if changes and self.storage is not None:
+            self.storage.write(changes)
+        sales = self.database["ticket_sales_sheets"]
+        if self._bind_ticket_sales_sheets(sales.loaded_values()) or migrate or changes or self._recovered:
+            # ведомости старого формата хранили копию расписания: сохраняем их уже без неё;
+            # восстановленное предыдущее поколение записывается на место повреждённого файла
+            self.save_database()
+        if self.legacy:
+            self._migrate_legacy()
+        self._build_indexes()
+        # номера новых продаж продолжают уже выданные, даже если часы были переведены назад
+        self.sale_ids.observe(sales.newest_key())
+        if not len(self.database["seat_maps"]) and sales.days():
+            self._build_seat_maps()
+
+    def _migrate_legacy(self):
+        """Перезаписывает в формате RecordCodec все данные базы и архива; после этого pickle больше не читается"""
+        if self.storage is not None:
+            self.storage.write([(table, key, True, value) for table in self.TABLES
+                                for key, value in self.database[table].items()])
+        else:
+            if self.segmented:
+                # сегменты и дни продаж, ещё не прочитанные с диска, тоже могут быть в формате pickle
+                for table in self.TABLES:
+                    data = self.database[table]
+                    if table == "ticket_sales_sheets":
+                        for day in data.days():
+                            data.partition(day)
+            self.save_database()
+        for day in self.archived_days():
+            filename = os.path.join(self.archive_dirname, day + self.SEGMENT_SUFFIX)
+            partition = self._read_file(filename)[0]
+            self._bind_ticket_sales_sheets(partition.values())
+            self._write_file(filename, zlib.compress(RecordCodec.encode(partition), 9), self.ARCHIVE_MAGIC)
+        self.legacy = False
+        if self.storage is not None:
+            for table in self.database.values():
+                table.legacy = False
 
     def save_database(self):
-        with open(self.filename, 'wb') as f:
-            pickle.dump(self.database, f)
+        if self.storage is not None:
+            # хранилище записывает изменения при сохранении каждой операции
+            return
+        with self._locked(exclusive=True):
+            if self.shared and self._journal_file is not None:
+                # снимок должен включать изменения, уже записанные другими процессами
+                self._synchronize()
+            self._save_database()
+
+    def _save_database(self):
+        if self.journal:
+            self._wait_compactor()
+        if self.segmented:
+            # незагруженные таблицы и дни продаж на диске не менялись
+            self._unsaved_segments.clear()
+            self._write_payloads(self._dump_segments(self._loaded_segments()))
+        else:
+            self._write_payloads([(self.filename, RecordCodec.encode(self.database))])
+        if not self.journal:
+            return
+        # полный снимок в режиме журнала заменяет сам журнал; новый файл другие процессы отличат от прежнего
+        if self._journal_file is not None:
+            self._journal_file.close()
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+        self._journal_file = open(self.journal_filename, 'ab')
+        self._journal_size = 0
+        if os.path.exists(self.journal_filename + '.old'):
+            os.remove(self.journal_filename + '.old')
+
+    def close(self):
+        """Дожидается фонового сжатия и закрывает файлы журнала и блокировки или хранилище"""
+        self._wait_compactor()
+        if self.storage is not None:
+            self.storage.close()
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self._node_file is not None:
+            self._node_file.close()
+            self._node_file = None
+
+    def refresh(self):
+        """Применяет изменения, записанные другими процессами; до вызова чтение видит неизменный снимок базы"""
+        if self.storage is not None:
+            # записи, изменённые через другие подключения к хранилищу, перечитываются при обращении к ним
+            self.open_database()
+            return
+        if not self.shared:
+            return
+        with self._locked():
+            self._synchronize()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Откладывает сохранение до конца блока with; при исключении откатывает изменения блока"""
+        if self._undo is None:
+            self._undo = []
+        savepoint = len(self._undo), len(self._dirty)
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._rollback(*savepoint)
+            raise
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                # если сохранить не удалось, _commit откатывает изменения всей транзакции
+                self._commit()
+
+    batch = transaction
+
+    def find(self, table, **criteria):
+        """Возвращает записи таблицы, у которых индексированные атрибуты равны заданным значениям"""
+        declared = {**self.INDEXES.get(table, {}), **self.SORTED_INDEXES.get(table, {})}
+        if any(name not in declared for name in criteria):
+            raise ValueError('index does not exist')
+        if not criteria:
+            return list(self.database[table].values())
+        return [self.database[table][key] for key in self._find_keys(table, criteria)]
+
+    def _find_keys(self, table, criteria):
+        """Возвращает ключи записей таблицы, у которых индексированные атрибуты равны заданным значениям"""
+        if self.storage is not None:
+            # выборку делает хранилище по своим индексам, не читая таблицу целиком
+            return self.database[table].find(criteria)
+        indexes = self._ensure_indexes(table)
+        # перебираем самую короткую выборку и проверяем вхождение ключей в остальные
+        buckets = sorted((indexes[name].lookup(value) for name, value in criteria.items()), key=len)
+        return [key for key in buckets[0] if all(key in bucket for bucket in buckets[1:])]
+
+    @property
+    def sales_columns(self):
+        """Колоночное представление ведомостей продаж или None, если оно не включено"""
+        columns = self._indexes["ticket_sales_sheets"].get("columns")
+        if columns is not None:
+            self._ensure_indexes("ticket_sales_sheets")
+        return columns
+
+    def enable_sales_columns(self):
+        """Включает колоночное представление ведомостей продаж и строит его по текущей таблице"""
+        if "columns" not in self._indexes["ticket_sales_sheets"]:
+            columns = SalesColumns()
+            if "ticket_sales_sheets" in self._indexed:
+                self._reindex()
+                for key, ticket_sales_sheet in self.database["ticket_sales_sheets"].items():
+                    columns.add(key, ticket_sales_sheet)
+            self._indexes["ticket_sales_sheets"]["columns"] = columns
+        return self.sales_columns
+
+    def available_seats(self, number_of_train, departure=None):
+        """Возвращает кол-во свободных мест рейса или None, если кол-во вагонов поезда неизвестно;
+        departure - отправление рейса, по умолчанию - по расписанию поезда"""
+        return self.seats.available(self._seat_map(number_of_train, departure))
+
+    def hold_seats(self, number_of_train, number_of_tickets, carriage=None, departure=None):
+        """Временно бронирует места рейса (все или ни одного); они передаются в add_ticket_sales_sheet(seats=...)
+        или освобождаются release_seats. Брони не сохраняются в базе и не видны другим процессам"""
+        return self.seats.hold(self._seat_map(number_of_train, departure), number_of_tickets, carriage)
+
+    def release_seats(self, number_of_train, seats, departure=None):
+        """Снимает временную бронь с мест рейса"""
+        self.seats.release(self._seat_map(number_of_train, departure), seats)
+
+    def _departure(self, number_of_train, departure=None):
+        """Возвращает отправление рейса строкой 'ГГГГ-ММ-ДД ЧЧ:ММ:СС': заданное или по расписанию поезда;
+        None, если оно неизвестно"""
+        if departure is not None:
+            moment = parse_datetime(departure)
+            if moment is None:
+                raise ValueError('invalid date')
+            return str(moment)
+        train_timetable = self.database["train_timetables"].get(number_of_train)
+        if train_timetable is None:
+            return None
+        moment = parse_datetime(train_timetable.date_of_departure, train_timetable.time_of_departure)
+        return str(moment) if moment is not None else None
+
+    def _seat_map(self, number_of_train, departure=None):
+        """Возвращает карту мест рейса; карта рейса без продаж создаётся пустой и в базу не записывается"""
+        departure = self._departure(number_of_train, departure)
+        seat_map = self.database["seat_maps"].get(SeatMap.key_of(number_of_train, departure))
+        return seat_map if seat_map is not None else SeatMap(number_of_train, departure)
+
+    def _change_seats(self, seat_map):
+        """Отмечает карту мест рейса как изменённую; новая карта добавляется в таблицу seat_maps"""
+        self._touch("seat_maps", seat_map.key)
+        self.database["seat_maps"][seat_map.key] = seat_map
+
+    def _occupy_seats(self, seat_map, number_of_tickets, seats=None):
+        """Занимает места ведомости в карте мест рейса и возвращает их; если вместимость поезда неизвестна,
+        места не назначаются и карта не записывается"""
+        if self.seats.capacity(seat_map.number_of_train) is None:
+            return seats
+        self._change_seats(seat_map)
+        return self.seats.occupy(seat_map, number_of_tickets, seats)
+
+    def _rebase_seats(self, key, foreign):
+        """Переносит места, занятые и освобождённые здесь в карте key, на её версию foreign, записанную другим
+        процессом; возвращает False, если оба процесса заняли одно и то же место"""
+        seat_map = self.database["seat_maps"].get(key)
+        entries = [position for position, (table, item, value) in enumerate(self._undo)
+                   if table == "seat_maps" and item == key]
+        if seat_map is None or foreign is None or not entries:
+            return False
+        original = self._undo[entries[0]][2]
+        base = ()
+        if original is not _MISSING:
+            base = next(value['_SeatMap__maps'] for table, item, value in self._undo
+                        if table is None and item is original)
+        maps = SeatInventory.rebase(seat_map.maps, base, foreign.maps)
+        if maps is None:
+            return False
+        # откат транзакции должен вернуть карту к версии другого процесса, а не к прежней
+        for position, (table, item, value) in enumerate(self._undo):
+            if table is None and (item is seat_map or item is original):
+                state = dict(value)
+                state['_SeatMap__maps'] = SeatInventory.rebase(value['_SeatMap__maps'], base, foreign.maps, True)
+                self._undo[position] = (table, item, state)
+        if original is _MISSING:
+            self._undo[entries[0]] = ("seat_maps", key, foreign)
+        seat_map.maps = maps
+        return True
+
+    def _vacate_seats(self, ticket_sales_sheet):
+        """Освобождает места удаляемой ведомости в карте мест её рейса"""
+        if not ticket_sales_sheet.seats:
+            return
+        seat_map = self.database["seat_maps"].get(
+            SeatMap.key_of(ticket_sales_sheet.number_of_train, ticket_sales_sheet.departure))
+        if seat_map is not None:
+            self._change_seats(seat_map)
+            self.seats.vacate(seat_map, ticket_sales_sheet.seats)
+
+    def _build_seat_maps(self):
+        """Однократно строит карты мест рейсов по ведомостям, сохранённым до появления таблицы seat_maps"""
+        with self.transaction():
+            for key, ticket_sales_sheet in list(self.database["ticket_sales_sheets"].items()):
+                departure = ticket_sales_sheet.departure
+                if departure is None:
+                    # рейсом ведомости прежнего формата считается отправление её поезда по расписанию
+                    departure = self._departure(ticket_sales_sheet.number_of_train)
+                seat_map = self._seat_map(ticket_sales_sheet.number_of_train, departure)
+                seats = self._occupy_seats(seat_map, ticket_sales_sheet.number_of_tickets, ticket_sales_sheet.seats)
+                if departure != ticket_sales_sheet.departure or seats != ticket_sales_sheet.seats:
+                    self._touch("ticket_sales_sheets", key)
+                    ticket_sales_sheet.departure = departure
+                    ticket_sales_sheet.seats = seats
+
+    def _seat_capacity(self, number_of_train):
+        """Возвращает (кол-во вагонов, мест в вагоне) поезда или None, если кол-во вагонов неизвестно"""
+        train = self.database["trains"].get(number_of_train)
+        if train is None:
+            train_timetable = self.database["train_timetables"].get(number_of_train)
+            train = train_timetable.train if train_timetable is not None else None
+        if train is None or not isinstance(train.number_of_carriages, int):
+            return None
+        return train.number_of_carriages, SeatInventory.SEATS_PER_CARRIAGE.get(
+            train.type_of_train, SeatInventory.DEFAULT_SEATS_PER_CARRIAGE)
+
+    def sales_between(self, start=None, stop=None):
+        """Лениво перебирает ведомости, проданные в интервале [start, stop), в порядке времени продажи"""
+        start, stop = parse_datetime(start), parse_datetime(stop)
+        sales = self.database["ticket_sales_sheets"]
+        if "ticket_sales_sheets" in self._indexed:
+            index = self._ensure_indexes("ticket_sales_sheets")["sale_datetime"]
+            for key in index.range(start, stop):
+                yield sales[key]
+            return
+        if self.storage is not None:
+            for key in sales.range("sale_datetime", start, stop):
+                yield sales[key]
+            return
+        # без индекса читаются и сортируются только дни продаж, попадающие в интервал
+        for day in sales.days():
+            if self._day_in_range(day, start, stop):
+                yield from self._sorted_sales(sales.partition(day).values(), start, stop)
+
+    @staticmethod
+    def _day_in_range(day, start, stop):
+        """Проверяет, может ли день продаж 'ГГГГ-ММ-ДД' пересекаться с интервалом [start, stop)"""
+        return (start is None or day >= str(start.date())) and (stop is None or day <= str(stop.date()))
+
+    def _sorted_sales(self, ticket_sales_sheets, start, stop):
+        """Отбирает ведомости, проданные в интервале [start, stop), и упорядочивает их по времени продажи"""
+        getter = self.SORTED_INDEXES["ticket_sales_sheets"]["sale_datetime"]
+        moments = ((getter(sheet), sheet) for sheet in ticket_sales_sheets)
+        selected = [(moment, sheet) for moment, sheet in moments if moment is not None
+                    and (start is None or moment >= start) and (stop is None or moment < stop)]
+        return [sheet for moment, sheet in sorted(selected, key=operator.itemgetter(0))]
+
+    def departures_between(self, start=None, stop=None, place_of_departure=None):
+        """Лениво перебирает расписания с отправлением в интервале [start, stop) в порядке отправления"""
+        timetables = self.database["train_timetables"]
+        start, stop = parse_datetime(start), parse_datetime(stop)
+        if self.storage is not None:
+            keys = timetables.range("departure", start, stop)
+        else:
+            keys = self._ensure_indexes("train_timetables")["departure"].range(start, stop)
+        for key in keys:
+            train_timetable = timetables[key]
+            if place_of_departure is None or train_timetable.place_of_departure == place_of_departure:
+                yield train_timetable
+
+    def plan_journey(self, place_of_departure, place_of_arrival, departure=None, arrive_by=None, transfer_minutes=0):
+        """Возвращает расписания маршрута (с пересадками) с самым ранним прибытием в place_of_arrival
+        при отправлении не раньше departure; None, если доехать нельзя или не успеть к arrive_by"""
+        departure = parse_datetime(departure) if departure is not None else datetime.min
+        if departure is None:
+            raise ValueError('invalid date')
+        arrive_by = parse_datetime(arrive_by)
+        timetables = self.database["train_timetables"]
+        keys = self._ensure_indexes("train_timetables")["connections"].earliest_arrival(
+            place_of_departure, place_of_arrival, departure, timedelta(minutes=transfer_minutes))
+        if keys is None:
+            return None
+        journey = [timetables[key] for key in keys]
+        if journey and arrive_by is not None and \
+                parse_datetime(journey[-1].date_of_arrival, journey[-1].time_of_arrival) > arrive_by:
+            return None
+        return journey
+
+    def export_mapped(self, filename=None):
+        """Записывает расписания, поезда и продажи в двоичный снимок для MappedDatabase; возвращает имя файла"""
+        if filename is None:
+            filename = os.path.splitext(self.filename)[0] + MappedDatabase.SUFFIX
+        if self.shared:
+            self.refresh()
+        # читатели, уже отобразившие прежний снимок, продолжают работать с ним до повторного открытия
+        self._write_file(filename, MappedDatabase.dump(self.database), MappedDatabase.MAGIC)
+        return filename
+
+    def _bind_ticket_sales_sheets(self, ticket_sales_sheets):
+        """Привязывает ведомости к таблице расписаний; возвращает True, если какие-то из них изменились"""
+        timetables = self.database["train_timetables"]
+        changed = False
+        for ticket_sales_sheet in ticket_sales_sheets:
+            changed = ticket_sales_sheet.bind_timetables(timetables) or changed
+        return changed
+
+    def _bind_trains(self, items):
+        """Привязывает расписания или бригады к таблице trains: поезд разрешается по номеру при каждом обращении,
+        поэтому каждому номеру соответствует один поезд базы, а в записях хранится только номер"""
+        trains = self.database["trains"]
+        for item in items:
+            item.bind_trains(trains)
+
+    def _train_records(self, number):
+        """Возвращает расписание и бригады поезда парами (таблица, ключ)"""
+        records = [("train_brigades", train_brigade.brigade_id)
+                   for train_brigade in self.find("train_brigades", number_of_train=number)]
+        if number in self.database["train_timetables"]:
+            records.insert(0, ("train_timetables", number))
+        return records
+
+    def _assign_record_ids(self):
+        """Переводит работников и бригады, хранившиеся под именем или номером бригады, на суррогатные ключи;
+        возвращает изменения записей (таблица, ключ, есть ли запись, значение)"""
+        legacy = {}
+        for table in self.RECORD_IDS:
+            keys = list(self.database[table])
+            # новые ключи продолжают уже выданные
+            self.record_ids.observe(max((key for key in keys if isinstance(key, int)), default=0))
+            legacy[table] = [key for key in keys if not isinstance(key, int)]
+        changes = []
+        for table, keys in legacy.items():
+            records = self.database[table]
+            for key in keys:
+                record = records[key]
+                record_id = self.record_ids.next_id()
+                setattr(record, self.RECORD_IDS[table], record_id)
+                del records[key]
+                records[record_id] = record
+                changes += [(table, key, False, None), (table, record_id, True, record)]
+        return changes
+
+    def _build_indexes(self):
+        """Сбрасывает вторичные индексы: каждая таблица индексируется при первом запросе к ней"""
+        self._unindexed.clear()
+        self._indexed.clear()
+        for indexes in self._indexes.values():
+            for index in indexes.values():
+                index.clear()
+
+    def _ensure_indexes(self, table):
+        """Возвращает индексы таблицы, при первом обращении строя их по её записям"""
+        self._reindex()
+        if table not in self._indexed:
+            for index in self._indexes[table].values():
+                index.clear()
+                for key, item in self.database[table].items():
+                    index.add(key, item)
+            self._indexed.add(table)
+        return self._indexes[table]
+
+    def _reindex(self):
+        """Возвращает в индексы записи, изменение которых завершено"""
+        for table, key in self._unindexed:
+            item = self.database[table].get(key, _MISSING)
+            if item is not _MISSING:
+                for index in self._indexes[table].values():
+                    index.add(key, item)
+        self._unindexed.clear()
+
+    def _touch(self, table, *keys):
+        """Отмечает записи таблицы как изменённые и запоминает их прежние значения для отката"""
+        if self._undo is None:
+            # изменение откатывается, если его не удалось сохранить или в совместном режиме случился конфликт
+            self._undo = []
+        for key in keys:
+            if self.storage is not None:
+                self.database[table].pin(key)
+            self._dirty[(table, key)] = None
+            if table in self._indexed and (table, key) not in self._unindexed:
+                for index in self._indexes[table].values():
+                    index.discard(key)
+                self._unindexed[(table, key)] = None
+            value = self.database[table].get(key, _MISSING)
+            self._undo.append((table, key, value))
+            if value is not _MISSING:
+                self._remember(value)
+
+    def _remember(self, obj):
+        """Запоминает для отката состояние объекта, который будет изменён на месте"""
+        self._undo.append((None, obj, obj.__getstate__()))
+
+    def _rollback(self, undo_savepoint, dirty_savepoint):
+        """Возвращает базу к состоянию точки сохранения транзакции"""
+        while len(self._undo) > undo_savepoint:
+            table, key, value = self._undo.pop()
+            if table is None:
+                # восстанавливаем объект, изменённый на месте
+                key.__setstate__(value)
+            else:
+                if table in self._indexed:
+                    for index in self._indexes[table].values():
+                        index.discard(key)
+                    self._unindexed[(table, key)] = None
+                if value is _MISSING:
+                    self.database[table].pop(key, None)
+                else:
+                    self.database[table][key] = value
+        # записи, впервые изменённые после точки сохранения, больше не нужно сохранять
+        for item in list(self._dirty)[dirty_savepoint:]:
+            del self._dirty[item]
+
+    def _commit(self):
+        """Сохраняет изменённые записи: целиком в файл, в затронутые сегменты или одной записью в журнал.
+        Если сохранить не удалось, изменения откатываются и в памяти"""
+        self._reindex()
+        if self._transaction_depth:
+            # внутри транзакции сохранение выполняется один раз при выходе из неё
+            return
+        try:
+            if self._dirty:
+                self._write_changes()
+        except BaseException:
+            # несохранённые изменения, оставшись в памяти, попали бы в следующее сохранение
+            if self._undo is not None:
+                self._rollback(0, 0)
+            raise
+        finally:
+            self._undo = None
+        if self.journal:
+            self._compact_journal()
+
+    def _write_changes(self):
+        """Записывает изменённые записи; отметки об изменении снимаются только после успешной записи"""
+        if self.storage is not None:
+            # в хранилище записываются только изменённые записи, одной его транзакцией
+            self.storage.write(self._changes())
+            self._dirty.clear()
+            return
+        if not self.journal:
+            self.save_database()
+            self._dirty.clear()
+            return
+        segments = dict.fromkeys(self._segment_of(table, key) for table, key in self._dirty) if self.segmented else {}
+        changes = self._changes()
+        if self.shared:
+            self._write_journal(changes, conflicts=self._dirty)
+        else:
+            self._append_journal(changes)
+        self._dirty.clear()
+        # сегменты, изменённые записями журнала, перезаписываются при его сжатии
+        self._unsaved_segments.update(segments)
+
+    def _changes(self):
+        """Возвращает изменённые записи: (таблица, ключ, есть ли запись, новое значение)"""
+        changes = []
+        for table, key in self._dirty:
+            if key in self.database[table]:
+                changes.append((table, key, True, self.database[table][key]))
+            else:
+                changes.append((table, key, False, None))
+        return changes
+
+    def _claim_node(self, node=None):
+        """Занимает номер кассы до close() блокировкой его файла: заданный или первый свободный"""
+        if node is not None:
+            if not isinstance(node, int):
+                raise InvalidTypeError(node)
+            if not 0 <= node < 1 << SaleIdGenerator.NODE_BITS:
+                raise InvalidValueError(node)
+        os.makedirs(self.nodes_dirname, exist_ok=True)
+        for candidate in range(1 << SaleIdGenerator.NODE_BITS) if node is None else (node,):
+            node_file = open(os.path.join(self.nodes_dirname, str(candidate)), 'ab')
+            try:
+                # блокировка снимается с закрытием файла, в том числе при аварийном завершении процесса
+                fcntl.flock(node_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                node_file.close()
+                continue
+            self._node_file = node_file
+            return candidate
+        raise ValueError('node is already in use' if node is not None else 'no free node')
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive=False):
+        """В совместном режиме блокирует файлы базы от других процессов на время блока with"""
+        if self._lock_file is None or self._lock_mode == fcntl.LOCK_EX or (
+                self._lock_mode == fcntl.LOCK_SH and not exclusive):
+            # блокировки нет или уже удерживается достаточная
+            yield
+            return
+        previous = self._lock_mode
+        self._lock_mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        fcntl.flock(self._lock_file.fileno(), self._lock_mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN if previous is None else previous)
+            self._lock_mode = previous
+
+    def _write_journal(self, changes, conflicts=()):
+        """Дописывает запись в общий журнал под блокировкой, предварительно применив записи других процессов"""
+        with self._locked(exclusive=True):
+            self._synchronize(conflicts)
+            self._append_journal(changes)
+
+    def _synchronize(self, conflicts=()):
+        """Применяет записи журнала, дописанные другими процессами. Если они затронули записи из conflicts,
+        изменённые здесь, эти изменения откатываются и вызывается ConflictError"""
+        if self._journal_replaced():
+            # другой процесс сжал журнал: прочитанная часть журнала больше не существует
+            conflict = next((key for table, key in conflicts), _MISSING)
+            if conflict is not _MISSING:
+                # проверить изменения, вошедшие в новый снимок, нельзя: считаем их конфликтом
+                self._rollback(0, 0)
+            self.open_database()
+            if conflict is not _MISSING:
+                raise ConflictError(conflict)
+            return
+        records, self._journal_size = self._read_journal(self.journal_filename, self._journal_size)
+        foreign = [change for record in records for change in record]
+        # карта мест рейса, изменённая обоими процессами, - конфликт, только если они заняли одни и те же места
+        seat_maps = {key: value for table, key, present, value in foreign if table == "seat_maps"}
+        rebased = {key for table, key in conflicts if table == "seat_maps" and key in seat_maps and
+                   self._rebase_seats(key, seat_maps[key])}
+        foreign = [change for change in foreign if change[0] != "seat_maps" or change[1] not in rebased]
+        changed = {(table, key) for table, key, present, value in foreign if present is not None}
+        dropped = {(table, key) for table, key, present, value in foreign if present is None}
+        conflict = next((key for table, key in conflicts if (table, key) in changed or (
+            table == "ticket_sales_sheets" and (table, PartitionedTable.partition_of(key)) in dropped)), _MISSING)
+        if conflict is not _MISSING:
+            self._rollback(0, 0)
+        self._apply_changes(foreign)
+        self._reindex()
+        if conflict is not _MISSING:
+            raise ConflictError(conflict)
+
+    def _journal_replaced(self):
+        """Проверяет, заменён ли файл журнала другим процессом после того, как этот процесс его открыл"""
+        try:
+            stat = os.stat(self.journal_filename)
+        except FileNotFoundError:
+            return True
+        return stat.st_ino != os.fstat(self._journal_file.fileno()).st_ino or stat.st_size < self._journal_size
+
+    def _append_journal(self, changes):
+        """Дописывает в журнал запись с новыми значениями изменённых ключей"""
+        payload = RecordCodec.encode(changes)
+        record = self.JOURNAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        try:
+            self._journal_file.write(record)
+            self._journal_file.flush()
+            if self.sync:
+                os.fsync(self._journal_file.fileno())
+        except BaseException:
+            # недописанная запись отрезается, иначе следующие записи оказались бы за ней и не читались
+            self._journal_file.truncate(self._journal_size)
+            raise
+        self._journal_size += len(record)
+
+    def _compact_journal(self):
+        """Сжимает журнал, если он перерос снимок; вызывается, когда записи журнала уже сохранены"""
+        if self._journal_size <= max(self.COMPACT_MIN_BYTES, self._snapshot_size):
+            return
+        if not self.shared:
+            self._start_compaction()
+            return
+        # другие процессы читают снимок и журнал под блокировкой, поэтому сжатие не фоновое
+        with self._locked(exclusive=True):
+            self._synchronize()
+            if self._journal_size > max(self.COMPACT_MIN_BYTES, self._snapshot_size):
+                self._start_compaction()
+                self._wait_compactor()
+
+    def _load_segments_of(self, records):
+        """Читает таблицы и дни продаж, которые изменяют записи журнала"""
+        for changes in records:
+            for table, key, present, value in changes:
+                if present is None:
+                    continue
+                data = self.database[table]  # обращение к таблице читает её сегмент
+                if table == "ticket_sales_sheets":
+                    data.partition(PartitionedTable.partition_of(key))
+
+    def _set_aside_journals(self):
+        """Откладывает журналы, записанные поверх повреждённого снимка: к предыдущему поколению они не подходят"""
+        for filename in (self.journal_filename + '.old', self.journal_filename):
+            if os.path.exists(filename):
+                os.replace(filename, filename + '.unapplied')
+                logger.warning("Журнал '%s' не применён: он записан поверх повреждённого снимка, "
+                               "сохранён как '%s'", filename, filename + '.unapplied')
+
+    def _read_journal(self, filename, offset=0):
+        """Читает целые записи журнала, начиная со смещения, и отрезает недописанный хвост;
+        возвращает записи и смещение конца последней из них"""
+        if not os.path.exists(filename):
+            return [], 0
+        header = self.JOURNAL_RECORD_HEADER
+        records = []
+        with open(filename, 'r+b') as f:
+            f.seek(offset)
+            data = f.read()
+            position = 0
+            while position + header.size <= len(data):
+                length, crc = header.unpack_from(data, position)
+                payload = data[position + header.size:position + header.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records.append(self._loads(payload, filename, self.legacy))
+                position += header.size + length
+            if position < len(data):
+                # запись, оборванная сбоем, отрезается, чтобы новые записи шли за целыми
+                f.truncate(offset + position)
+                os.fsync(f.fileno())
+        return records, offset + position
+
+    def _apply_changes(self, changes):
+        """Применяет изменения из записи журнала, поддерживая построенные индексы"""
+        bound = []
+        for table, key, present, value in changes:
+            if present is None:
+                # удаление целого дня продаж: ключом записи служит сам день
+                self.database[table].drop(key)
+                self._indexed.discard(table)
+                if self.segmented:
+                    self._unsaved_segments.pop((table, key), None)
+                    self._remove_segment((table, key))
+                continue
+            if table in self._indexed and (table, key) not in self._unindexed:
+                for index in self._indexes[table].values():
+                    index.discard(key)
+                self._unindexed[(table, key)] = None
+            current = self.database[table].get(key) if present and table == "trains" else None
+            if current is not None:
+                # поезд общий для расписаний и бригад: новое состояние переносится в него самого
+                current.__setstate__(value.__getstate__())
+            elif present:
+                self.database[table][key] = value
+                if table == "ticket_sales_sheets":
+                    value.bind_timetables(self.database["train_timetables"])
+                elif table in ("train_timetables", "train_brigades"):
+                    bound.append(value)
+            else:
+                self.database[table].pop(key, None)
+            if self.segmented:
+                self._unsaved_segments[self._segment_of(table, key)] = None
+        self._bind_trains(bound)
+
+    def _load_segment(self, table):
+        """Читает таблицу из её сегмента; дни продаж читаются позже, при обращении к ним"""
+        if table not in self.TABLES:
+            raise KeyError(table)
+        filename = os.path.join(self.segments_dirname, table)
+        if table == "ticket_sales_sheets":
+            # после сбоя посреди перезаписи от дня может остаться только предыдущее поколение
+            names = os.listdir(filename) if os.path.isdir(filename) else ()
+            days = {name.split(self.SEGMENT_SUFFIX)[0] for name in names
+                    if name.endswith((self.SEGMENT_SUFFIX, self.SEGMENT_SUFFIX + '.prev'))}
+            return PartitionedTable(loader=self._load_partition, days=days)
+        try:
+            records = self._read_file(filename + self.SEGMENT_SUFFIX)[0]
+        except FileNotFoundError:
+            return {}
+        if table in ("train_timetables", "train_brigades"):
+            self._bind_trains(records.values())
+        return records
+
+    def _load_partition(self, day):
+        """Читает ведомости, проданные за день, и привязывает их к таблице расписаний"""
+        partition = self._read_file(self._segment_filename(("ticket_sales_sheets", day)))[0]
+        self._bind_ticket_sales_sheets(partition.values())
+        return partition
+
+    def _segment_of(self, table, key):
+        """Возвращает сегмент, в котором хранится запись: (таблица, день продажи или None)"""
+        if table == "ticket_sales_sheets":
+            return table, PartitionedTable.partition_of(key)
+        return table, None
+
+    def _segment_filename(self, segment):
+        table, day = segment
+        if day is None:
+            return os.path.join(self.segments_dirname, table + self.SEGMENT_SUFFIX)
+        return os.path.join(self.segments_dirname, table, day + self.SEGMENT_SUFFIX)
+
+    def _remove_segment(self, segment):
+        """Удаляет файлы сегмента вместе с предыдущим поколением"""
+        filename = self._segment_filename(segment)
+        removed = False
+        for generation in (filename, filename + '.prev'):
+            if os.path.exists(generation):
+                os.remove(generation)
+                removed = True
+        if removed:
+            self._fsync_directory(filename)
+
+    def _loaded_segments(self):
+        """Перечисляет сегменты, прочитанные с диска или созданные в этом процессе"""
+        for table in self.TABLES:
+            # проверка через dict не читает незагруженную таблицу
+            if dict.__contains__(self.database, table):
+                if table == "ticket_sales_sheets":
+                    for day in self.database[table].partitions:
+                        yield table, day
+                else:
+                    yield table, None
+
+    def _dump_segments(self, segments):
+        """Сериализует сегменты; возвращает пары (имя файла, данные)"""
+        payloads = []
+        for table, day in segments:
+            data = self.database[table]
+            if day is not None:
+                data = data.partition(day) or {}
+            payloads.append((self._segment_filename((table, day)), RecordCodec.encode(data)))
+        return payloads
+
+    def _read_snapshot(self):
+        """Читает снимок базы из одного файла"""
+        database, self._snapshot_size = self._read_file(self.filename)
+        return database
+
+    def _read_file(self, filename):
+        """Читает файл с заголовком; если его нет (сбой между переименованиями при записи), берёт предыдущее
+        поколение. Повреждённый файл заменяется предыдущим поколением только при recover=True, с предупреждением.
+        Возвращает данные и их размер"""
+        missing = 0
+        corrupted = False
+        for generation in (filename, filename + '.prev'):
+            try:
+                with open(generation, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                missing += 1
+                continue
+            value = self._decode_snapshot(data, generation)
+            if value is not None:
+                if corrupted:
+                    logger.warning("Файл '%s' повреждён, прочитано предыдущее поколение '%s'", filename, generation)
+                    self._recovered = True
+                return value, len(data)
+            corrupted = True
+            if not self.recover:
+                break
+        if missing == 2:
+            raise FileNotFoundError(filename)
+        raise DatabaseCorruptedError(filename)
+
+    def _decode_snapshot(self, data, filename):
+        """Проверяет заголовок и контрольную сумму снимка; возвращает None для повреждённых данных.
+        Данные с верной контрольной суммой, которые не удаётся прочитать (например, схема новой версии), -
+        ошибка, а не повреждение: предыдущее поколение в этом случае не читается"""
+        header = self.SNAPSHOT_HEADER
+        magic = data[:len(self.SNAPSHOT_MAGIC)]
+        if magic in (self.SNAPSHOT_MAGIC, self.ARCHIVE_MAGIC):
+            magic, length, crc = header.unpack_from(data)
+            payload = data[header.size:]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                return None
+            if magic == self.ARCHIVE_MAGIC:
+                payload = zlib.decompress(payload)
+            return self._loads(payload, filename, self.legacy)
+        if data[:1] != self.PICKLE_PREFIX:
+            return None
+        # файл старого формата: чистый pickle без заголовка
+        if not self.legacy:
+            raise LegacyFormatError(filename)
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # у файла без заголовка нет контрольной суммы: повреждение видно только по ошибке чтения
+            return None
+
+    @staticmethod
+    def _loads(data, source, legacy=False):
+        """Восстанавливает данные в формате RecordCodec; данные, сохранённые прежними версиями через pickle,
+        читаются только при переводе базы в новый формат (legacy=True)"""
+        if data[:len(RecordCodec.MAGIC)] == RecordCodec.MAGIC:
+            return RecordCodec.decode(data)
+        if not legacy:
+            raise LegacyFormatError(source)
+        return pickle.loads(data)
+
+    def _write_payloads(self, payloads):
+        """Записывает снимок или сегменты, переданные парами (имя файла, данные)"""
+        size = 0
+        for filename, data in payloads:
+            self._write_file(filename, data)
+            size += len(data)
+        self._snapshot_size = size
+
+    def _write_file(self, filename, data, magic=SNAPSHOT_MAGIC):
+        """Атомарно записывает файл: временный файл, fsync, переименование; старый файл остаётся в .prev"""
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(self.SNAPSHOT_HEADER.pack(magic, len(data), zlib.crc32(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            os.replace(filename, filename + '.prev')
+        os.replace(tmp_filename, filename)
+        self._fsync_directory(filename)
+
+    def _fsync_directory(self, filename):
+        """Сбрасывает на диск каталог файла, чтобы переименования пережили сбой питания"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _start_compaction(self):
+        """Переводит журнал в .old и в фоне записывает снимок (или изменённые сегменты), после чего .old удаляется"""
+        self._wait_compactor()
+        if self.segmented:
+            payloads = self._dump_segments(self._unsaved_segments)
+            self._unsaved_segments.clear()
+        else:
+            payloads = [(self.filename, RecordCodec.encode(self.database))]
+        self._journal_file.close()
+        os.replace(self.journal_filename, self.journal_filename + '.old')
+        # только дозапись: запись другого процесса не должна затираться со старой позиции файла
+        self._journal_file = open(self.journal_filename, 'ab')
+        self._journal_size = 0
+        self._snapshot_size = sum(len(data) for filename, data in payloads)
+        self._compactor = threading.Thread(target=self._compact, args=(payloads,), daemon=True)
+        self._compactor.start()
+
+    def _compact(self, payloads):
+        self._write_payloads(payloads)
+        os.remove(self.journal_filename + '.old')
+
+    def _wait_compactor(self):
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
 
     def add_worker(self, surname, name, patronymic, year_of_birth, year_of_employment,
                    seniority, position, gender, address, city, phone):
+        # работник хранится по суррогатному ключу, имя - индексированный атрибут, тёзки допустимы
         worker = WorkerRZD(surname, name, patronymic, year_of_birth, year_of_employment,
-                           seniority, position, gender, address, city, phone)
-        if worker.name in self.database["workers"]:
-            while worker.name in self.database["workers"]:
-                worker.name = worker.name + "1"
-        self.database["workers"][worker.name] = worker
-        self.save_database()
+                           seniority, position, gender, address, city, phone, worker_id=self.record_ids.next_id())
+        self._touch("workers", worker.worker_id)
+        self.database["workers"][worker.worker_id] = worker
+        self._commit()
         return worker
 
-    def delete_worker(self, name):
-        del self.database["workers"][name]
-        self.save_database()
-
-    def get_worker_by_name(self, name):
-        if name not in self.database["workers"]:
+    def delete_worker(self, name=None, worker_id=None):
+        # работник задаётся именем (среди тёзок - добавленный первым) или суррогатным ключом worker_id
+        key = self._worker_key(name, worker_id)
+        if key is None:
+            raise KeyError(name)
+        self._touch("workers", key)
+        del self.database["workers"][key]
+        self._commit()
+
+    def get_worker_by_id(self, worker_id):
+        if worker_id not in self.database["workers"]:
             return None
-        return self.database["workers"][name]
+        return self.database["workers"][worker_id]
 
-    def change_worker(self, name):
-        worker = self.get_worker_by_name(name)
+    def get_worker_by_name(self, name):
+        # среди тёзок возвращается работник, добавленный первым
+        return self.get_worker_by_id(self._worker_key(name))
+
+    def _worker_key(self, name, worker_id=None):
+        """Возвращает ключ работника: worker_id, если он задан, иначе ключ первого работника с таким именем или None"""
+        if worker_id is not None:
+            return worker_id
+        return min(self._find_keys("workers", {"name": name}), default=None)
+
+    def change_worker(self, name=None, worker_id=None):
+        key = self._worker_key(name, worker_id)
+        worker = self.get_worker_by_id(key)
         if not worker:
             raise ValueError('value does not exist')
         # choose = int(input("What changes?\n1.Name\n2.Seniority\nchoose: "))
         choose = 1
         if choose == 1:
+            self._touch("workers", key)
+            # ключ работника не зависит от имени: ссылки на работника остаются верными
             worker.name = input("New name: ")
-            # меняем значение ключа на новое имя
-            self.database["workers"][worker.name] = self.database["workers"][name]
-            # удаляем старый ключ
-            del self.database["workers"][name]
         elif choose == 2:
+            self._touch("workers", key)
             worker.seniority = int(input("New seniority: "))
         else:
             raise ValueError('value does not exist')
-        self.save_database()
+        self._commit()
 
-    def change_worker_qt(self, name, new_name):
-        worker = self.get_worker_by_name(name)
+    def change_worker_qt(self, name, new_name, worker_id=None):
+        key = self._worker_key(name, worker_id)
+        worker = self.get_worker_by_id(key)
         if not worker:
             raise ValueError('value does not exist')
+        self._touch("workers", key)
+        # ключ работника не зависит от имени: ссылки на работника остаются верными
         worker.name = new_name
-        # меняем значение ключа на новое имя
-        self.database["workers"][worker.name] = self.database["workers"][name]
-        # удаляем старый ключ
-        del self.database["workers"][name]
-        self.save_database()
+        self._commit()
 
     def add_train_timetable(self, date_of_departure, time_of_departure, place_of_departure,
                             date_of_arrival, time_of_arrival, place_of_arrival, route, ticket_price,
                             number, release_year=None, number_of_carriages=None, type_of_train=None):
+        if number in self.database["train_timetables"]:
+            # если расписание с таким номером уже существует, то добавляем к нему .1
+            number = str(number) + ".1"
+        # расписание ссылается на общий поезд базы, если поезд с таким номером уже есть
         train_timetable = TrainTimetable(date_of_departure, time_of_departure, place_of_departure,
                                          date_of_arrival, time_of_arrival, place_of_arrival, route, ticket_price,
-                                         number, release_year, number_of_carriages, type_of_train)
-        if train_timetable.train.number in self.database["train_timetables"]:
-            # если расписание с таким номером уже существует, то добавляем к нему .1
-            train_timetable.train.number = str(train_timetable.train.number) + ".1"
+                                         number, release_year, number_of_carriages, type_of_train,
+                                         train=self.database["trains"].get(number))
+        self._touch("train_timetables", train_timetable.train.number)
         self.database["train_timetables"][train_timetable.train.number] = train_timetable
         if train_timetable.train.number not in self.database["trains"]:
             # если поезда с таким расписанием ещё нет в базе, то добавляем его
+            self._touch("trains", train_timetable.train.number)
             self.database["trains"][train_timetable.train.number] = train_timetable.train
-        self.save_database()
+        self._bind_trains([train_timetable])
+        self._commit()
         return train_timetable, self.database["trains"][train_timetable.train.number]
 
     def delete_train_timetable(self, number):
+        self._touch("train_timetables", number)
         del self.database["train_timetables"][number]
-        self.save_database()
+        self._commit()
 
     def get_train_timetable_by_number(self, number):
         if number not in self.database["train_timetables"]:
@@ -124,28 +1280,42 @@ class RzdDatabase:
         train_timetable = self.get_train_timetable_by_number(number)
         if not train_timetable:
             raise ValueError('value does not exist')
+        self._touch("train_timetables", number)
         train_timetable.ticket_price = int(input("New price: "))
-        self.save_database()
+        self._commit()
 
     def change_ticket_price_qt(self, number, new_price):
         train_timetable = self.get_train_timetable_by_number(number)
         if not train_timetable:
             raise ValueError('value does not exist')
+        self._touch("train_timetables", number)
         train_timetable.ticket_price = int(new_price)
-        self.save_database()
+        self._commit()
 
     def add_train(self, number, release_year, number_of_carriages, type_of_train):
         train = Train(number, release_year, number_of_carriages, type_of_train)
         if train.number in self.database["trains"]:
             # если поезд с таким номером уже существует, то добавляем к нему 1
             train.number = str(train.number) + ".1"
+        self._touch("trains", train.number)
         self.database["trains"][train.number] = train
-        self.save_database()
+        # расписание и бригады, оставшиеся от удалённого поезда с этим номером, ссылаются на новый
+        records = self._train_records(train.number)
+        for table, key in records:
+            self._touch(table, key)
+        self._bind_trains([self.database[table][key] for table, key in records])
+        self._commit()
         return train
 
     def delete_train(self, number):
+        # расписание и бригады удалённого поезда сохраняют его собственной копией
+        records = self._train_records(number)
+        for table, key in records:
+            self._touch(table, key)
+            self.database[table][key].keep_train()
+        self._touch("trains", number)
         del self.database["trains"][number]
-        self.save_database()
+        self._commit()
 
     def get_train_by_number(self, number):
         if number not in self.database["trains"]:
@@ -157,196 +1327,2247 @@ class RzdDatabase:
         if not train:
             raise ValueError('value does not exist')
         new_value = int(input("New number of carriages: "))
+        self.seats.check_resize(self.find("seat_maps", number_of_train=number), new_value)
+        self._touch("trains", number)
+        # поезд общий для расписания и бригад: изменение видно через все ссылки на него
         train.number_of_carriages = new_value
-        # меняем значение ещё и в расписании
-        try:
-            train2 = self.get_train_timetable_by_number(number)
-            train2.train.number_of_carriages = new_value
-        except:
-            pass
-        self.save_database()
+        self._commit()
 
     def change_number_of_carriages_qt(self, number, new_number_of_carriages):
         train = self.get_train_by_number(number)
         if not train:
             raise ValueError('value does not exist')
         new_value = int(new_number_of_carriages)
+        # вагоны с проданными или забронированными местами предстоящих рейсов отцепить нельзя
+        self.seats.check_resize(self.find("seat_maps", number_of_train=number), new_value)
+        self._touch("trains", number)
+        # поезд общий для расписания и бригад: изменение видно через все ссылки на него
         train.number_of_carriages = new_value
-        # меняем значение ещё и в расписании
-        if train.number in self.database["train_timetables"]:
-            train2 = self.get_train_timetable_by_number(number)
-            train2.train.number_of_carriages = new_value
-        self.save_database()
+        self._commit()
 
     def add_train_brigade(self, brigade_number, surname, name, position,
                           number_of_train, release_year=None, number_of_carriages=None, type_of_train=None,
                           patronymic=None, year_of_birth=None, year_of_employment=None,
                           seniority=None, gender=None, address=None, city=None, phone=None):
+        # бригада ссылается на общий поезд базы, если поезд с таким номером уже есть;
+        # хранится она по суррогатному ключу, номер бригады - индексированный атрибут
         train_brigade = TrainBrigade(brigade_number, surname, name, position,
                                      number_of_train, release_year, number_of_carriages, type_of_train,
                                      patronymic, year_of_birth, year_of_employment,
-                                     seniority, gender, address, city, phone)
-        if train_brigade.brigade_number in self.database["train_brigades"]:
-            # если бригада с таким номером уже существует, то добавляем к нему 1
-            train_brigade.brigade_number = str(train_brigade.brigade_number) + "1"
-        self.database["train_brigades"][train_brigade.brigade_number] = train_brigade
-        if train_brigade.rzd_workers[0].name not in self.database["workers"]:
-            # если работника с таким номером ещё нет в базе, то добавляем его
-            self.database["workers"][train_brigade.rzd_workers[0].name] = train_brigade.rzd_workers[0]
+                                     seniority, gender, address, city, phone,
+                                     train=self.database["trains"].get(number_of_train),
+                                     brigade_id=self.record_ids.next_id())
+        self._touch("train_brigades", train_brigade.brigade_id)
+        self.database["train_brigades"][train_brigade.brigade_id] = train_brigade
+        worker = self.get_worker_by_name(train_brigade.rzd_workers[0].name)
+        if worker is None:
+            # если работника с таким именем ещё нет в базе, то добавляем его
+            worker = train_brigade.rzd_workers[0]
+            worker.worker_id = self.record_ids.next_id()
+            self._touch("workers", worker.worker_id)
+            self.database["workers"][worker.worker_id] = worker
         if train_brigade.train.number not in self.database["trains"]:
             # если поезда с таким расписанием ещё нет в базе, то добавляем его
+            self._touch("trains", train_brigade.train.number)
             self.database["trains"][train_brigade.train.number] = train_brigade.train
-        self.save_database()
-        return train_brigade, self.database["workers"][train_brigade.rzd_workers[0].name], self.database["trains"][
-            train_brigade.train.number]
-
-    def delete_train_brigade(self, number):
-        del self.database["train_brigades"][number]
-        self.save_database()
+        self._bind_trains([train_brigade])
+        self._commit()
+        return train_brigade, worker, self.database["trains"][train_brigade.train.number]
+
+    def delete_train_brigade(self, number=None, brigade_id=None):
+        # бригада задаётся номером (среди бригад с одним номером - добавленная первой) или ключом brigade_id
+        key = self._brigade_key(number, brigade_id)
+        if key is None:
+            raise KeyError(number)
+        self._touch("train_brigades", key)
+        del self.database["train_brigades"][key]
+        self._commit()
+
+    def get_train_brigade_by_id(self, brigade_id):
+        if brigade_id not in self.database["train_brigades"]:
+            return None
+        return self.database["train_brigades"][brigade_id]
 
     def get_train_brigade_by_number(self, number):
-        if number not in self.database["train_brigades"]:
-            if str(number) not in self.database["train_brigades"]:
-                return None
-            else:
-                number = str(number)
-        return self.database["train_brigades"][number]
-
-    def change_brigade_number(self, number):
-        number = int(number)
-        train_brigade = self.get_train_brigade_by_number(number)
+        # среди бригад с одним номером возвращается добавленная первой
+        return self.get_train_brigade_by_id(self._brigade_number_key(number))
+
+    def _brigade_key(self, number, brigade_id=None):
+        """Возвращает ключ бригады: brigade_id, если он задан, иначе ключ первой бригады с таким номером или None"""
+        if brigade_id is not None:
+            return brigade_id
+        return self._brigade_number_key(number)
+
+    def _brigade_number_key(self, number):
+        """Возвращает ключ первой бригады с заданным номером (числом или строкой) или None"""
+        for value in (number, str(number)):
+            keys = self._find_keys("train_brigades", {"brigade_number": value})
+            if keys:
+                return min(keys)
+        return None
+
+    def change_brigade_number(self, number=None, brigade_id=None):
+        key = self._brigade_key(number, brigade_id)
+        train_brigade = self.get_train_brigade_by_id(key)
         if not train_brigade:
             raise ValueError('value does not exist')
-        train_brigade.brigade_number = int(input("New number of brigade: "))
-        # меняем значение ключа на новый номер
-        self.database["train_brigades"][train_brigade.brigade_number] = self.database["train_brigades"][number]
-        # удаляем старый ключ
-        del self.database["train_brigades"][number]
-        self.save_database()
-
-    def change_brigade_number_qt(self, number, new_number):
-        train_brigade = self.get_train_brigade_by_number(number)
+        new_number = int(input("New number of brigade: "))
+        self._touch("train_brigades", key)
+        # ключ бригады не зависит от номера: ссылки на бригаду остаются верными
+        train_brigade.brigade_number = new_number
+        self._commit()
+
+    def change_brigade_number_qt(self, number, new_number, brigade_id=None):
+        key = self._brigade_key(number, brigade_id)
+        train_brigade = self.get_train_brigade_by_id(key)
         if not train_brigade:
             raise ValueError('value does not exist')
+        self._touch("train_brigades", key)
+        # ключ бригады не зависит от номера: ссылки на бригаду остаются верными
         train_brigade.brigade_number = new_number
-        # меняем значение ключа на новый номер
-        self.database["train_brigades"][train_brigade.brigade_number] = self.database["train_brigades"][number]
-        # удаляем старый ключ
-        del self.database["train_brigades"][number]
-        self.save_database()
-
-    def add_ticket_sales_sheet(self, number_of_train, passenger_fullname, passport, number_of_tickets, benefits, price):
-        sale_datetime = str(datetime.now().replace(microsecond=0))
+        self._commit()
+
+    def add_ticket_sales_sheet(self, number_of_train, passenger_fullname, passport, number_of_tickets, benefits, price,
+                               seats=None, departure=None):
+        # места проверяются до изменения базы: продать больше, чем есть свободных на рейсе, нельзя;
+        # seats - места, забронированные hold_seats, иначе выделяются первые свободные;
+        # departure - отправление рейса, по умолчанию - по расписанию поезда
+        seat_map = self._seat_map(number_of_train, departure)
+        self.seats.check(seat_map, number_of_tickets, seats)
+        # ведомость хранится по уникальному номеру продажи, время продажи остаётся её атрибутом
+        sale_id = self.sale_ids.next_id()
+        sale_datetime = str(SaleIdGenerator.timestamp(sale_id).replace(microsecond=0))
         ticket_sales_sheet = TicketSalesSheet(number_of_train, sale_datetime, passenger_fullname, passport,
-                                              number_of_tickets, benefits, price)
-        self.database["ticket_sales_sheets"][ticket_sales_sheet.sale_datetime] = ticket_sales_sheet
-        if ticket_sales_sheet.trip_number.train.number not in self.database["train_timetables"]:
-            # если расписания с таким номером ещё нет в базе, то добавляем его
-            self.database["train_timetables"][ticket_sales_sheet.trip_number.train.number] = \
-                ticket_sales_sheet.trip_number
-        if ticket_sales_sheet.trip_number.train.number not in self.database["trains"]:
+                                              number_of_tickets, benefits, price, sale_id=sale_id,
+                                              departure=seat_map.departure)
+        self._touch("ticket_sales_sheets", sale_id)
+        self.database["ticket_sales_sheets"][sale_id] = ticket_sales_sheet
+        # продажа меняет карту мест рейса: в совместном режиме одновременная продажа тех же мест
+        # из другого процесса приводит к ConflictError, а не к продаже сверх вместимости
+        ticket_sales_sheet.seats = self._occupy_seats(seat_map, number_of_tickets, seats)
+        if ticket_sales_sheet.number_of_train not in self.database["train_timetables"]:
+            # если расписания с таким номером ещё нет в базе, то добавляем его (с общим поездом, если он есть)
+            self._touch("train_timetables", ticket_sales_sheet.number_of_train)
+            self.database["train_timetables"][ticket_sales_sheet.number_of_train] = TrainTimetable(
+                None, None, None, None, None, None, None, None, number_of_train,
+                train=self.database["trains"].get(number_of_train))
+        # ведомость ссылается на общее расписание по номеру поезда
+        ticket_sales_sheet.bind_timetables(self.database["train_timetables"])
+        if ticket_sales_sheet.number_of_train not in self.database["trains"]:
             # если поезда с таким номером ещё нет в базе, то также добавляем его
-            self.database["trains"][ticket_sales_sheet.trip_number.train.number] = ticket_sales_sheet.trip_number.train
-        self.save_database()
+            self._touch("trains", ticket_sales_sheet.number_of_train)
+            self.database["trains"][ticket_sales_sheet.number_of_train] = ticket_sales_sheet.trip_number.train
+        self._bind_trains([ticket_sales_sheet.trip_number])
+        self._commit()
+        if seats is not None:
+            # бронь перешла к сохранённой продаже; если сохранить не удалось, она остаётся для повтора
+            self.seats.release(seat_map, seats)
         return ticket_sales_sheet, self.database["train_timetables"][
-            ticket_sales_sheet.trip_number.train.number], self.database["trains"][
-            ticket_sales_sheet.trip_number.train.number]
+            ticket_sales_sheet.number_of_train], self.database["trains"][ticket_sales_sheet.number_of_train]
 
     def delete_ticket_sales_sheet(self, number):
-        del self.database["ticket_sales_sheets"][number]
-        self.save_database()
+        number = self._sale_key(number)
+        self._touch("ticket_sales_sheets", number)
+        ticket_sales_sheet = self.database["ticket_sales_sheets"].pop(number)
+        self._vacate_seats(ticket_sales_sheet)
+        self._commit()
+
+    def get_ticket_sales_sheet_by_id(self, sale_id):
+        if sale_id not in self.database["ticket_sales_sheets"]:
+            return None
+        return self.database["ticket_sales_sheets"][sale_id]
 
     def get_ticket_sales_sheets_by_datetime(self, sale_datetime):
-        if sale_datetime not in self.database["ticket_sales_sheets"]:
+        key = self._sale_key(sale_datetime)
+        if key not in self.database["ticket_sales_sheets"]:
             return None
-        return self.database["ticket_sales_sheets"][sale_datetime]
+        return self.database["ticket_sales_sheets"][key]
+
+    def _sale_key(self, sale):
+        """Возвращает ключ ведомости по её номеру или, для совместимости, по времени продажи"""
+        if sale in self.database["ticket_sales_sheets"] or not isinstance(sale, str):
+            return sale
+        moment = parse_datetime(sale)
+        if moment is None:
+            return sale
+        if "ticket_sales_sheets" in self._indexed:
+            # ведомость, проданная первой в эту секунду
+            return next(iter(self._ensure_indexes("ticket_sales_sheets")["sale_datetime"].lookup(moment)), sale)
+        if self.storage is not None:
+            return next(iter(self.database["ticket_sales_sheets"].find({"sale_datetime": moment})), sale)
+        # без индекса просматривается только день продажи
+        getter = self.SORTED_INDEXES["ticket_sales_sheets"]["sale_datetime"]
+        partition = self.database["ticket_sales_sheets"].partition(str(moment.date())) or {}
+        return next((key for key, sheet in partition.items() if getter(sheet) == moment), sale)
 
     def change_number_of_tickets(self, sale_datetime):
         ticket_sales_sheet = self.get_ticket_sales_sheets_by_datetime(sale_datetime)
         if not ticket_sales_sheet:
             raise ValueError('value does not exist')
         new_value = int(input("New number of tickets: "))
-        ticket_sales_sheet.number_of_tickets = new_value
-        self.save_database()
+        self._change_number_of_tickets(sale_datetime, ticket_sales_sheet, new_value)
 
     def change_number_of_tickets_qt(self, sale_datetime, new_number_of_tickets):
         ticket_sales_sheet = self.get_ticket_sales_sheets_by_datetime(sale_datetime)
         if not ticket_sales_sheet:
             raise ValueError('value does not exist')
         new_value = int(new_number_of_tickets)
+        self._change_number_of_tickets(sale_datetime, ticket_sales_sheet, new_value)
+
+    def _change_number_of_tickets(self, sale_datetime, ticket_sales_sheet, new_value):
+        """Меняет кол-во билетов ведомости: её места остаются за ней, недостающие выделяются из свободных мест рейса"""
+        key = self._sale_key(sale_datetime)
+        seat_map = self._seat_map(ticket_sales_sheet.number_of_train, ticket_sales_sheet.departure)
+        own = [seat for seat in ticket_sales_sheet.seats or () if SeatInventory._test(seat_map.maps, seat)]
+        self.seats.check(seat_map, new_value, own=own)
+        self._touch("ticket_sales_sheets", key)
         ticket_sales_sheet.number_of_tickets = new_value
-        self.save_database()
+        if self.seats.capacity(seat_map.number_of_train) is not None:
+            self._change_seats(seat_map)
+            self.seats.vacate(seat_map, own)
+            ticket_sales_sheet.seats = self.seats.occupy(seat_map, new_value, ticket_sales_sheet.seats)
+        self._commit()
 
     def del_sales(self):
-        """Метод очистки ведомостей"""
-        del self.database['ticket_sales_sheets'][list(self.database['ticket_sales_sheets'].keys())[0]]
-        self.save_database()
+        """Метод очистки ведомостей: удаляет самую раннюю ведомость"""
+        key = next(iter(self.database['ticket_sales_sheets']), _MISSING)
+        if key is _MISSING:
+            return
+        self._touch('ticket_sales_sheets', key)
+        self._vacate_seats(self.database['ticket_sales_sheets'].pop(key))
+        self._commit()
+
+    def drop_sales(self, day):
+        """Удаляет все ведомости, проданные за день; остальные дни не читаются и не перезаписываются.
+        Места удалённых ведомостей в картах мест рейсов не освобождаются"""
+        with self._locked(exclusive=True):
+            self._drop_sales_partition(self._sales_day(day))
+
+    def drop_sales_before(self, day):
+        """Удаляет ведомости всех дней раньше заданного"""
+        day = self._sales_day(day)
+        with self._locked(exclusive=True):
+            for old_day in self.database["ticket_sales_sheets"].days():
+                if old_day < day:
+                    self._drop_sales_partition(old_day)
+
+    def archive_sales(self, day):
+        """Переносит ведомости, проданные за день, в сжатый архив, доступный только для чтения"""
+        day = self._sales_day(day)
+        with self._locked(exclusive=True):
+            if self.shared:
+                # в архив должны попасть и продажи этого дня, сделанные другими процессами
+                self._synchronize()
+            partition = self.database["ticket_sales_sheets"].partition(day)
+            if partition is None:
+                return
+            filename = os.path.join(self.archive_dirname, day + self.SEGMENT_SUFFIX)
+            if os.path.exists(filename):
+                # день уже архивировался: дополняем прежний архив
+                partition = {**self._read_file(filename)[0], **partition}
+            # архив записывается до удаления дня, чтобы сбой между шагами не потерял продажи
+            self._write_file(filename, zlib.compress(RecordCodec.encode(partition), 9), self.ARCHIVE_MAGIC)
+            self._drop_sales_partition(day)
+
+    def archive_sales_before(self, day):
+        """Переносит в архив ведомости всех дней раньше заданного"""
+        day = self._sales_day(day)
+        for old_day in self.database["ticket_sales_sheets"].days():
+            if old_day < day:
+                self.archive_sales(old_day)
+
+    def archived_days(self):
+        """Возвращает дни продаж, перенесённые в архив, в порядке возрастания"""
+        if not os.path.isdir(self.archive_dirname):
+            return []
+        return sorted(name[:-len(self.SEGMENT_SUFFIX)] for name in os.listdir(self.archive_dirname)
+                      if name.endswith(self.SEGMENT_SUFFIX))
+
+    def archived_sales(self, day):
+        """Возвращает ведомости архивного дня только для чтения: номер продажи -> ведомость"""
+        day = self._sales_day(day)
+        try:
+            partition = self._read_file(os.path.join(self.archive_dirname, day + self.SEGMENT_SUFFIX))[0]
+        except FileNotFoundError:
+            partition = {}
+        self._bind_ticket_sales_sheets(partition.values())
+        return types.MappingProxyType(partition)
+
+    def archived_sales_between(self, start=None, stop=None):
+        """Лениво перебирает архивные ведомости, проданные в интервале [start, stop), в порядке времени продажи"""
+        start, stop = parse_datetime(start), parse_datetime(stop)
+        for day in self.archived_days():
+            if self._day_in_range(day, start, stop):
+                yield from self._sorted_sales(self.archived_sales(day).values(), start, stop)
+
+    @staticmethod
+    def _sales_day(day):
+        """Приводит день (строку, date или datetime) к имени раздела продаж 'ГГГГ-ММ-ДД'"""
+        moment = parse_datetime(day)
+        if moment is None:
+            raise ValueError('invalid date')
+        return moment.date().isoformat()
+
+    def _drop_sales_partition(self, day):
+        """Удаляет раздел продаж за день из памяти и с диска; индексы продаж перестраиваются при следующем запросе"""
+        if self._transaction_depth:
+            raise ValueError('sales cannot be dropped inside a transaction')
+        if self.shared:
+            # продажи этого дня, сделанные другими процессами, удаляются вместе с остальными
+            self._synchronize()
+        table = "ticket_sales_sheets"
+        self.database[table].drop(day)
+        self._indexed.discard(table)
+        if self.segmented:
+            self._unsaved_segments.pop((table, day), None)
+        if self.journal:
+            # фоновое сжатие могло ещё не дописать сегмент этого дня
+            self._wait_compactor()
+            self._append_journal([(table, day, None, None)])
+            self._compact_journal()
+        if self.segmented:
+            self._remove_segment((table, day))
+        elif not self.journal:
+            self.save_database()
+
+
+class SaleIdGenerator:
+    """Генератор монотонно возрастающих номеров продаж: миллисекунды, номер кассы и счётчик в одном числе"""
+
+    EPOCH_MS = 1704067200000  # Начало отсчёта миллисекунд: 2024-01-01 UTC; номера меньше 2**62 до 2093 года
+    NODE_BITS = 10  # До 1024 касс
+    SEQUENCE_BITS = 11  # До 2048 продаж на кассу в миллисекунду
+    LEGACY_ID = 1 << 62  # Номера от этого значения выданы прежним форматом: миллисекунды от 1970 года
+    LEGACY_SEQUENCE_BITS = 12  # и 12 бит счётчика
+
+    def __init__(self, node=0):
+        """Инициализирует атрибуты node(номер кассы) и состояние счётчика"""
+        if not isinstance(node, int):
+            raise InvalidTypeError(node)
+        if not 0 <= node < 1 << self.NODE_BITS:
+            raise InvalidValueError(node)
+        self.node = node
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        """Выдаёт следующий номер продажи; безопасен при вызове из нескольких потоков"""
+        with self._lock:
+            ms = time.time_ns() // 1000000 - self.EPOCH_MS
+            if ms <= self._last_ms:
+                # та же миллисекунда или часы переведены назад: продолжаем от последнего номера
+                ms = self._last_ms
+                self._sequence += 1
+                if self._sequence >> self.SEQUENCE_BITS:
+                    # счётчик миллисекунды исчерпан, занимаем следующую
+                    ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = ms
+            return (ms << (self.NODE_BITS + self.SEQUENCE_BITS)) | (self.node << self.SEQUENCE_BITS) | self._sequence
+
+    def observe(self, sale_id):
+        """Учитывает уже выданный номер, чтобы новые номера были больше него; номера прежнего формата
+        с новыми не пересекаются и не учитываются"""
+        if sale_id >= self.LEGACY_ID:
+            return
+        with self._lock:
+            ms = sale_id >> (self.NODE_BITS + self.SEQUENCE_BITS)
+            if ms >= self._last_ms:
+                self._last_ms = ms
+                self._sequence = sale_id & ((1 << self.SEQUENCE_BITS) - 1)
+
+    @classmethod
+    def timestamp(cls, sale_id):
+        """Возвращает время продажи, закодированное в номере"""
+        if sale_id >= cls.LEGACY_ID:
+            return datetime.fromtimestamp((sale_id >> (cls.NODE_BITS + cls.LEGACY_SEQUENCE_BITS)) / 1000)
+        return datetime.fromtimestamp(((sale_id >> (cls.NODE_BITS + cls.SEQUENCE_BITS)) + cls.EPOCH_MS) / 1000)
+
+
+class RecordIdAllocator:
+    """Генератор суррогатных ключей записей: счётчик и номер кассы в одном числе"""
+
+    NODE_BITS = SaleIdGenerator.NODE_BITS
+
+    def __init__(self, node=0):
+        """Инициализирует атрибуты node(номер кассы) и состояние счётчика"""
+        if not isinstance(node, int):
+            raise InvalidTypeError(node)
+        if not 0 <= node < 1 << self.NODE_BITS:
+            raise InvalidValueError(node)
+        self.node = node
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def next_id(self):
+        """Выдаёт следующий ключ; безопасен при вызове из нескольких потоков"""
+        with self._lock:
+            self._counter += 1
+            return (self._counter << self.NODE_BITS) | self.node
+
+    def observe(self, record_id):
+        """Учитывает уже выданный ключ, чтобы новые ключи были больше него"""
+        with self._lock:
+            self._counter = max(self._counter, record_id >> self.NODE_BITS)
+
+
+class SegmentedTables(dict):
+    """Словарь таблиц базы, читающий таблицу из её сегмента при первом обращении"""
+
+    def __init__(self, loader):
+        """Инициализирует атрибут loader(функция чтения таблицы по имени)"""
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, table):
+        value = self[table] = self.loader(table)
+        return value
+
+
+class PartitionedTable(collections.abc.MutableMapping):
+    """Таблица ведомостей продаж, разбитая на разделы по дням продажи; разделы с диска читаются при обращении"""
+
+    def __init__(self, items=(), loader=None, days=()):
+        """Инициализирует атрибуты partitions(прочитанные разделы), unloaded(дни, ещё не прочитанные с диска)
+        и loader(функция чтения раздела по дню)"""
+        self.partitions = {}  # День 'ГГГГ-ММ-ДД' -> словарь ведомостей за этот день
+        self.unloaded = set(days)
+        self.loader = loader
+        self.update(items)
+
+    @staticmethod
+    def partition_of(key):
+        """Возвращает день продажи по ключу: из номера продажи или из ключа старого формата (времени продажи)"""
+        if isinstance(key, int):
+            return SaleIdGenerator.timestamp(key).date().isoformat()
+        return str(key)[:10]
+
+    def partition(self, day, create=False):
+        """Возвращает раздел за день, при необходимости читая его с диска; None, если раздела нет"""
+        partition = self.partitions.get(day)
+        if partition is None:
+            if day in self.unloaded:
+                partition = self.partitions[day] = self.loader(day)
+                self.unloaded.discard(day)
+            elif create:
+                partition = self.partitions[day] = {}
+        return partition
+
+    def drop(self, day):
+        """Удаляет раздел за день целиком, не читая его с диска"""
+        self.unloaded.discard(day)
+        self.partitions.pop(day, None)
+
+    def days(self):
+        """Возвращает дни всех разделов в порядке возрастания"""
+        return sorted(self.partitions.keys() | self.unloaded)
+
+    def loaded_values(self):
+        """Перебирает ведомости только из уже прочитанных разделов"""
+        for partition in list(self.partitions.values()):
+            yield from partition.values()
+
+    def newest_key(self):
+        """Возвращает наибольший номер продажи текущего формата, просматривая разделы от последнего дня;
+        0, если таких продаж нет"""
+        for day in reversed(self.days()):
+            keys = [key for key in self.partition(day) if isinstance(key, int) and key < SaleIdGenerator.LEGACY_ID]
+            if keys:
+                return max(keys)
+        return 0
+
+    def __getitem__(self, key):
+        partition = self.partition(self.partition_of(key))
+        if partition is None:
+            raise KeyError(key)
+        return partition[key]
+
+    def __setitem__(self, key, value):
+        self.partition(self.partition_of(key), create=True)[key] = value
+
+    def __delitem__(self, key):
+        partition = self.partition(self.partition_of(key))
+        if partition is None:
+            raise KeyError(key)
+        del partition[key]
+
+    def __contains__(self, key):
+        partition = self.partition(self.partition_of(key))
+        return partition is not None and key in partition
+
+    def get(self, key, default=None):
+        partition = self.partition(self.partition_of(key))
+        if partition is None:
+            return default
+        return partition.get(key, default)
+
+    def __iter__(self):
+        for day in self.days():
+            yield from self.partition(day)
+
+    def __len__(self):
+        return sum(len(self.partition(day)) for day in self.days())
+
+    def items(self):
+        for day in self.days():
+            yield from self.partition(day).items()
+
+    def values(self):
+        for day in self.days():
+            yield from self.partition(day).values()
+
+    def __getstate__(self):
+        """Возвращает состояние для pickle: все разделы, в том числе ещё не прочитанные"""
+        return {day: self.partition(day) for day in self.days()}
+
+    def __setstate__(self, state):
+        self.partitions = state
+        self.unloaded = set()
+        self.loader = None
+
+
+class StorageBackend(abc.ABC):
+    """Интерфейс подключаемого хранилища таблиц базы. Без хранилища RzdDatabase сама хранит таблицы в своих файлах.
+
+    Таблицы хранилища - изменяемые отображения ключ -> запись с методами find(criteria) и
+    range(name, start, stop) по индексированным атрибутам (RzdDatabase.INDEXES и SORTED_INDEXES);
+    таблица продаж дополнительно поддерживает интерфейс PartitionedTable: days, partition, drop,
+    loaded_values, newest_key и атрибут on_load"""
+
+    @abc.abstractmethod
+    def tables(self, names):
+        """Возвращает словарь таблиц: имя -> таблица хранилища"""
+
+    @abc.abstractmethod
+    def write(self, changes):
+        """Атомарно записывает изменения [(таблица, ключ, есть ли запись, новое значение)]"""
+
+    @abc.abstractmethod
+    def close(self):
+        """Закрывает хранилище"""
+
+
+class SqliteStorage(StorageBackend):
+    """Хранилище таблиц базы в SQLite (режим WAL): запись в строке, индексированные атрибуты - в столбцах с индексами"""
+
+    def __init__(self, filename='rzd.sqlite', sync=True, cache_size=100000):
+        """Открывает (или создаёт) файл базы; sync=False не сбрасывает каждую транзакцию на диск;
+        cache_size - сколько прочитанных записей каждой таблицы держать в памяти"""
+        self.filename = filename
+        self.cache_size = cache_size
+        # запросы с параметрами компилируются один раз и берутся из кэша подготовленных запросов
+        # подключение может использоваться из рабочего потока RzdService; обращения к нему идут по очереди
+        self.connection = sqlite3.connect(filename, cached_statements=256, check_same_thread=False)
+        # в режиме WAL читатели из других процессов не блокируются записью
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = {0}'.format('FULL' if sync else 'NORMAL'))
+        self._tables = {}
+
+    def tables(self, names):
+        """Создаёт недостающие таблицы и индексы; возвращает таблицы с пустым кэшем"""
+        self._tables = {}
+        with self.connection:
+            for name in names:
+                columns = {**RzdDatabase.INDEXES.get(name, {}), **RzdDatabase.SORTED_INDEXES.get(name, {})}
+                table_class = SqliteSalesTable if name == "ticket_sales_sheets" else SqliteTable
+                table = self._tables[name] = table_class(self, name, columns)
+                table.create()
+        return dict(self._tables)
+
+    def write(self, changes):
+        """Записывает изменения одной транзакцией; одинаковые запросы выполняются пакетом"""
+        rows = {}
+        deleted = {}
+        for table, key, present, value in changes:
+            if present:
+                rows.setdefault(table, []).append(self._tables[table].row(key, value))
+            else:
+                deleted.setdefault(table, []).append((key,))
+        with self.connection:
+            for table, items in deleted.items():
+                self.connection.executemany(self._tables[table].statements['delete'], items)
+            for table, items in rows.items():
+                self.connection.executemany(self._tables[table].statements['insert'], items)
+        for table in self._tables.values():
+            table.flush()
+
+    def execute(self, statement, parameters=()):
+        return self.connection.execute(statement, parameters)
+
+    def close(self):
+        self.connection.close()
+
+
+class SqliteTable(collections.abc.MutableMapping):
+    """Таблица базы в SQLite: записи читаются по ключу при обращении и кэшируются,
+    изменения накапливаются в памяти до записи транзакции базы"""
+
+    EXTRA_COLUMNS = ()  # Служебные столбцы, вычисляемые по ключу записи
+    ORDER = 'rowid'  # Порядок перебора записей
+
+    def __init__(self, storage, name, columns):
+        """Инициализирует атрибуты storage(хранилище), name(имя таблицы), columns(индексируемые столбцы:
+        имя -> функция получения значения из записи), cache(прочитанные записи) и pending(незаписанные изменения)"""
+        self.storage = storage
+        self.name = name
+        self.columns = columns
+        self.cache = collections.OrderedDict()  # Ключ -> запись, в порядке последнего обращения
+        self.pending = {}  # Ключ -> новая запись или _MISSING для удалённой
+        self.on_load = None  # Функция, получающая список записей, прочитанных из базы
+        self.legacy = False  # Читать ли записи pickle прежних версий (до их перевода в RecordCodec)
+        names = ('key', 'value') + tuple(columns) + self.EXTRA_COLUMNS
+        self.statements = {
+            'insert': 'INSERT OR REPLACE INTO "{0}" ({1}) VALUES ({2})'.format(
+                name, ', '.join('"{0}"'.format(column) for column in names), ', '.join('?' * len(names))),
+            'delete': 'DELETE FROM "{0}" WHERE key = ?'.format(name),
+            'get': 'SELECT value FROM "{0}" WHERE key = ?'.format(name),
+            'exists': 'SELECT 1 FROM "{0}" WHERE key = ?'.format(name),
+            'count': 'SELECT COUNT(*) FROM "{0}"'.format(name),
+            'keys': 'SELECT key FROM "{0}" ORDER BY {1}'.format(name, self.ORDER),
+            'items': 'SELECT key, value FROM "{0}" ORDER BY {1}'.format(name, self.ORDER),
+        }
+
+    def create(self):
+        """Создаёт таблицу и индексы по её столбцам, если их ещё нет"""
+        # у ключа без объявленного типа 1 и '1' - разные ключи, как в словаре
+        columns = ''.join(', "{0}"'.format(column) for column in tuple(self.columns) + self.EXTRA_COLUMNS)
+        self.storage.execute('CREATE TABLE IF NOT EXISTS "{0}" (key PRIMARY KEY, value BLOB NOT NULL{1})'.format(
+            self.name, columns))
+        # столбцы индексов, появившихся после создания таблицы, заполняются при перезаписи строк
+        existing = {row[1] for row in self.storage.execute('PRAGMA table_info("{0}")'.format(self.name))}
+        for column in tuple(self.columns) + self.EXTRA_COLUMNS:
+            if column not in existing:
+                self.storage.execute('ALTER TABLE "{0}" ADD COLUMN "{1}"'.format(self.name, column))
+        for column in tuple(self.columns) + self.EXTRA_COLUMNS:
+            self.storage.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}")'.format(self.name, column))
+
+    @staticmethod
+    def column_value(value):
+        """Приводит значение атрибута к значению столбца: время - к сортируемой строке"""
+        if isinstance(value, datetime):
+            return str(value)
+        if value is None or isinstance(value, (int, float, str, bytes)):
+            return value
+        return str(value)
+
+    def row(self, key, value):
+        """Возвращает строку таблицы для записи: ключ, сериализованная запись и значения столбцов"""
+        return (key, RecordCodec.encode(value)) + tuple(self.column_value(getter(value)) for getter in self.columns.values())
+
+    def pin(self, key):
+        """Закрепляет прочитанную запись до записи транзакции: изменённый на месте объект не вытесняется из кэша"""
+        if key not in self.pending and key in self.cache:
+            self.pending[key] = self.cache.pop(key)
+
+    def flush(self):
+        """Переносит записанные изменения в кэш"""
+        for key, value in self.pending.items():
+            if value is _MISSING:
+                self.cache.pop(key, None)
+            else:
+                self.cache[key] = value
+        self.pending.clear()
+        self._trim()
+
+    def find(self, criteria):
+        """Возвращает ключи записей, у которых столбцы равны заданным значениям"""
+        where = ' AND '.join('"{0}" IS ?'.format(name) for name in criteria)
+        values = [self.column_value(value) for value in criteria.values()]
+        cursor = self.storage.execute('SELECT key FROM "{0}" WHERE {1} ORDER BY {2}'.format(
+            self.name, where, self.ORDER), values)
+        keys = [key for (key,) in cursor if key not in self.pending]
+        # незаписанные изменения проверяются в памяти
+        keys.extend(key for key, value in self.pending.items() if value is not _MISSING and all(
+            self.column_value(self.columns[name](value)) == expected for name, expected in zip(criteria, values)))
+        return keys
+
+    def range(self, name, start=None, stop=None):
+        """Лениво перебирает ключи записей со значением столбца из [start, stop) в порядке значений;
+        база не должна меняться при обходе"""
+        start, stop = self.column_value(start), self.column_value(stop)
+        conditions = ['"{0}" IS NOT NULL'.format(name)]
+        parameters = []
+        if start is not None:
+            conditions.append('"{0}" >= ?'.format(name))
+            parameters.append(start)
+        if stop is not None:
+            conditions.append('"{0}" < ?'.format(name))
+            parameters.append(stop)
+        cursor = self.storage.execute('SELECT "{0}", key FROM "{1}" WHERE {2} ORDER BY "{0}", rowid'.format(
+            name, self.name, ' AND '.join(conditions)), parameters)
+        stored = ((value, key) for value, key in cursor if key not in self.pending)
+        changed = []
+        for key, item in self.pending.items():
+            if item is _MISSING:
+                continue
+            value = self.column_value(self.columns[name](item))
+            if value is not None and (start is None or value >= start) and (stop is None or value < stop):
+                changed.append((value, key))
+        changed.sort(key=operator.itemgetter(0))
+        for value, key in heapq.merge(stored, changed, key=operator.itemgetter(0)):
+            yield key
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            value = self.pending[key]
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        row = self.storage.execute(self.statements['get'], (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self.cache[key] = self._load(row[0])
+        self._trim()
+        return value
+
+    def __setitem__(self, key, value):
+        self.cache.pop(key, None)
+        self.pending[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.cache.pop(key, None)
+        self.pending[key] = _MISSING
+
+    def __contains__(self, key):
+        if key in self.pending:
+            return self.pending[key] is not _MISSING
+        return key in self.cache or self._stored(key)
+
+    def __iter__(self):
+        for (key,) in self.storage.execute(self.statements['keys']):
+            if self.pending.get(key) is not _MISSING:
+                yield key
+        for key, value in list(self.pending.items()):
+            if value is not _MISSING and not self._stored(key):
+                yield key
+
+    def __len__(self):
+        count = self.storage.execute(self.statements['count']).fetchone()[0]
+        for key, value in self.pending.items():
+            count += (value is not _MISSING) - self._stored(key)
+        return count
+
+    def items(self):
+        """Перебирает записи в порядке таблицы; записи, которых нет в кэше, читаются без помещения в него"""
+        return self._select(self.statements['items'])
+
+    def values(self):
+        for key, value in self.items():
+            yield value
+
+    def _select(self, statement, parameters=(), accept=None):
+        """Перебирает пары (ключ, запись) из результата запроса, а затем ещё не записанные новые записи,
+        для которых accept(ключ) истинно"""
+        for key, data in self.storage.execute(statement, parameters):
+            if key in self.pending:
+                value = self.pending[key]
+                if value is _MISSING:
+                    continue
+            elif key in self.cache:
+                value = self.cache[key]
+            else:
+                value = self._load(data)
+            yield key, value
+        for key, value in list(self.pending.items()):
+            if value is not _MISSING and (accept is None or accept(key)) and not self._stored(key):
+                yield key, value
+
+    def _stored(self, key):
+        return self.storage.execute(self.statements['exists'], (key,)).fetchone() is not None
+
+    def _load(self, data):
+        value = RzdDatabase._loads(data, self.name, self.legacy)
+        if self.on_load is not None:
+            self.on_load([value])
+        return value
+
+    def _trim(self):
+        while len(self.cache) > self.storage.cache_size:
+            self.cache.popitem(last=False)
+
+
+class SqliteSalesTable(SqliteTable):
+    """Таблица ведомостей продаж в SQLite с интерфейсом разделов по дням, как у PartitionedTable"""
+
+    EXTRA_COLUMNS = ('day',)
+    ORDER = 'day, rowid'
+
+    def __init__(self, storage, name, columns):
+        super().__init__(storage, name, columns)
+        self.statements['partition'] = 'SELECT key, value FROM "{0}" WHERE day = ? ORDER BY rowid'.format(name)
+
+    def row(self, key, value):
+        return super().row(key, value) + (PartitionedTable.partition_of(key),)
+
+    def partition(self, day, create=False):
+        """Возвращает копию раздела за день: номер продажи -> ведомость; None, если продаж за день нет"""
+        partition = dict(self._select(self.statements['partition'], (day,),
+                                      lambda key: PartitionedTable.partition_of(key) == day))
+        return partition or ({} if create else None)
+
+    def drop(self, day):
+        """Сразу удаляет из базы все ведомости за день, не читая их"""
+        with self.storage.connection:
+            self.storage.execute('DELETE FROM "{0}" WHERE day = ?'.format(self.name), (day,))
+        for keys in (self.cache, self.pending):
+            for key in [key for key in keys if PartitionedTable.partition_of(key) == day]:
+                del keys[key]
+
+    def days(self):
+        """Возвращает дни продаж в порядке возрастания"""
+        cursor = self.storage.execute('SELECT DISTINCT day FROM "{0}"'.format(self.name))
+        days = {day for (day,) in cursor}
+        days.update(PartitionedTable.partition_of(key) for key, value in self.pending.items() if value is not _MISSING)
+        return sorted(days)
+
+    def loaded_values(self):
+        """Перебирает ведомости, уже находящиеся в памяти"""
+        yield from list(self.cache.values())
+        yield from [value for value in self.pending.values() if value is not _MISSING]
+
+    def newest_key(self):
+        """Возвращает наибольший номер продажи текущего формата; 0, если таких продаж нет"""
+        newest = self.storage.execute(
+            'SELECT MAX(key) FROM "{0}" WHERE typeof(key) = \'integer\' AND key < ?'.format(self.name),
+            (SaleIdGenerator.LEGACY_ID,)).fetchone()[0] or 0
+        return max([newest] + [key for key, value in self.pending.items()
+                               if value is not _MISSING and isinstance(key, int) and key < SaleIdGenerator.LEGACY_ID])
+
+
+def migrate_to_sqlite(source='rzd.pkl', target='rzd.sqlite', legacy=False):
+    """Однократно переносит базу из файлов (снимок, журнал или сегменты) в пустую базу SQLite;
+    legacy=True сначала переводит файлы, сохранённые прежними версиями через pickle, в формат RecordCodec.
+    Возвращает кол-во перенесённых записей"""
+    base = os.path.splitext(source)[0]
+    segmented = os.path.isdir(base + '.d')
+    if not (segmented or os.path.exists(source) or os.path.exists(source + '.prev')):
+        raise FileNotFoundError(source)
+    database = RzdDatabase(source, journal=os.path.exists(base + '.journal'), segmented=segmented, legacy=legacy)
+    storage = SqliteStorage(target)
+    try:
+        if any(table for table in storage.tables(RzdDatabase.TABLES).values()):
+            raise ValueError('target database is not empty')
+        changes = [(table, key, True, value) for table in RzdDatabase.TABLES
+                   for key, value in database.database[table].items()]
+        storage.write(changes)
+    finally:
+        storage.close()
+        database.close()
+    return len(changes)
+
+
+class MappedDatabase:
+    """Доступная только для чтения база поверх двоичного снимка (RzdDatabase.export_mapped), открытого через mmap:
+    записи читаются прямо из общего кэша страниц, без чтения всей базы в память процесса"""
+
+    MAGIC = b'RZDM'
+    VERSION = 2  # Версия 2 добавила типы bool, date, datetime, time и Decimal; снимки версии 1 читаются как прежде
+    SUFFIX = '.map'
+    # Разделы снимка в порядке оглавления: строки, таблицы и упорядоченные по времени индексы
+    SECTIONS = ('strings', 'string_data', 'trains', 'train_timetables', 'ticket_sales_sheets',
+                'departure', 'sale_datetime')
+    DIRECTORY = struct.Struct('<I' + 'QQ' * len(SECTIONS))  # Версия и (смещение, кол-во) каждого раздела
+    FIELD = struct.Struct('<Bq')  # Поле записи: тип значения и само значение (число или номер строки)
+    # Типы значений полей
+    NONE, INT, STRING, FLOAT, BOOL, DATE, DATETIME, TIME, DECIMAL = range(9)
+    OFFSET = struct.Struct('<Q')  # Смещение строки в разделе строк
+    ENTRY = struct.Struct('<qQ')  # Элемент индекса: время в микросекундах и номер записи
+    # Поля записей таблиц: ключ и пути атрибутов сущности
+    FIELDS = {
+        'trains': ('key', 'number', 'release_year', 'number_of_carriages', 'type_of_train'),
+        'train_timetables': ('key', 'date_of_departure', 'time_of_departure', 'place_of_departure',
+                             'date_of_arrival', 'time_of_arrival', 'place_of_arrival', 'route', 'ticket_price',
+                             'train.number', 'train.release_year', 'train.number_of_carriages',
+                             'train.type_of_train'),
+        'ticket_sales_sheets': ('key', 'number_of_train', 'sale_datetime', 'passenger_fullname', 'passport',
+                                'number_of_tickets', 'benefits', 'price', 'sale_id'),
+    }
+    # Упорядоченные индексы: раздел -> (таблица, функция получения времени из записи)
+    TIME_INDEXES = {
+        'departure': ('train_timetables', RzdDatabase.SORTED_INDEXES['train_timetables']['departure']),
+        'sale_datetime': ('ticket_sales_sheets', RzdDatabase.SORTED_INDEXES['ticket_sales_sheets']['sale_datetime']),
+    }
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, filename='rzd.map'):
+        """Отображает снимок в память; контрольная сумма не проверяется, чтобы не читать файл целиком"""
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # пустой файл отобразить нельзя
+                raise DatabaseCorruptedError(filename)
+        header = RzdDatabase.SNAPSHOT_HEADER
+        magic, length, crc = header.unpack_from(self._map) if len(self._map) >= header.size else (None, 0, 0)
+        if magic != self.MAGIC or length != len(self._map) - header.size:
+            self._map.close()
+            raise DatabaseCorruptedError(filename)
+        directory = self.DIRECTORY.unpack_from(self._map, header.size)
+        if directory[0] not in (1, self.VERSION):
+            self._map.close()
+            raise DatabaseCorruptedError(filename)
+        self._sections = {name: (header.size + directory[1 + 2 * i], directory[2 + 2 * i])
+                          for i, name in enumerate(self.SECTIONS)}
+        factories = {'trains': self._train, 'train_timetables': self._timetable,
+                     'ticket_sales_sheets': self._ticket_sales_sheet}
+        self.database = {table: MappedTable(self, table, *self._sections[table], factories[table])
+                         for table in self.FIELDS}
+
+    def __iter__(self):
+        for table in self.FIELDS:
+            yield self.database[table]
+
+    def close(self):
+        self._map.close()
+
+    def get_train_by_number(self, number):
+        return self.database["trains"].get(number)
+
+    def get_train_timetable_by_number(self, number):
+        return self.database["train_timetables"].get(number)
+
+    def get_ticket_sales_sheet_by_id(self, sale_id):
+        return self.database["ticket_sales_sheets"].get(sale_id)
+
+    def get_ticket_sales_sheets_by_datetime(self, sale_datetime):
+        """Возвращает ведомость по номеру или, для совместимости, первую проданную в заданную секунду"""
+        sales = self.database["ticket_sales_sheets"]
+        if sale_datetime in sales or not isinstance(sale_datetime, str):
+            return sales.get(sale_datetime)
+        moment = parse_datetime(sale_datetime)
+        if moment is None:
+            return None
+        position = next(self._range('sale_datetime', moment, moment + timedelta(microseconds=1)), None)
+        return None if position is None else sales.record(position)
+
+    def find(self, table, **criteria):
+        """Возвращает записи таблицы, у которых индексированные атрибуты равны заданным значениям"""
+        getters = {**RzdDatabase.INDEXES.get(table, {}), **RzdDatabase.SORTED_INDEXES.get(table, {})}
+        if table not in self.database or any(name not in getters for name in criteria):
+            raise ValueError('index does not exist')
+        records = self.database[table]
+        fields = {name: self.FIELDS[table].index(name) for name in criteria if name in self.FIELDS[table]}
+        result = []
+        for position in range(len(records)):
+            # сохранённые поля сравниваются прямо в снимке, сущность создаётся только для подходящих записей
+            if any(records.field(position, field) != criteria[name] for name, field in fields.items()):
+                continue
+            item = records.record(position)
+            if all(getters[name](item) == value for name, value in criteria.items() if name not in fields):
+                result.append(item)
+        return result
+
+    def sales_between(self, start=None, stop=None):
+        """Лениво перебирает ведомости, проданные в интервале [start, stop), в порядке времени продажи"""
+        sales = self.database["ticket_sales_sheets"]
+        for position in self._range('sale_datetime', parse_datetime(start), parse_datetime(stop)):
+            yield sales.record(position)
+
+    def departures_between(self, start=None, stop=None, place_of_departure=None):
+        """Лениво перебирает расписания с отправлением в интервале [start, stop) в порядке отправления"""
+        timetables = self.database["train_timetables"]
+        field = self.FIELDS['train_timetables'].index('place_of_departure')
+        for position in self._range('departure', parse_datetime(start), parse_datetime(stop)):
+            if place_of_departure is None or timetables.field(position, field) == place_of_departure:
+                yield timetables.record(position)
+
+    @classmethod
+    def dump(cls, database):
+        """Сериализует расписания, поезда и продажи базы в двоичный снимок; возвращает его данные без заголовка"""
+        strings = {}
+
+        def encode(value):
+            if value is None:
+                return cls.NONE, 0
+            if isinstance(value, bool):
+                return cls.BOOL, int(value)
+            if isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+                return cls.INT, value
+            if isinstance(value, float):
+                return cls.FLOAT, struct.unpack('<q', struct.pack('<d', value))[0]
+            if isinstance(value, datetime) and value.tzinfo is None:
+                return cls.DATETIME, cls._micros(value)
+            if isinstance(value, date) and not isinstance(value, datetime):
+                return cls.DATE, value.toordinal()
+            if isinstance(value, time_of_day) and value.tzinfo is None:
+                return cls.TIME, (value.hour * 3600 + value.minute * 60 + value.second) * 1000000 + value.microsecond
+            if isinstance(value, Decimal):
+                return cls.DECIMAL, strings.setdefault(str(value), len(strings))
+            # прочие значения сохраняются строкой
+            return cls.STRING, strings.setdefault(str(value), len(strings))
+
+        sections = {}
+        for table, fields in cls.FIELDS.items():
+            getters = [operator.attrgetter(path) for path in fields[1:]]
+            record = struct.Struct('<' + cls.FIELD.format[1:] * len(fields))
+            items = sorted(database[table].items(), key=lambda item: cls._order(item[0]))
+            sections[table] = len(items), b''.join(
+                record.pack(*encode(key), *itertools.chain.from_iterable(encode(getter(item)) for getter in getters))
+                for key, item in items)
+            for name, (indexed_table, getter) in cls.TIME_INDEXES.items():
+                if indexed_table == table:
+                    moments = sorted((cls._micros(moment), position) for position, moment in
+                                     enumerate(getter(item) for key, item in items) if moment is not None)
+                    sections[name] = len(moments), b''.join(cls.ENTRY.pack(*entry) for entry in moments)
+        data = [string.encode('utf-8') for string in strings]
+        offsets = list(itertools.accumulate((len(item) for item in data), initial=0))
+        sections['strings'] = len(data), b''.join(cls.OFFSET.pack(offset) for offset in offsets)
+        sections['string_data'] = offsets[-1], b''.join(data)
+        directory = [cls.VERSION]
+        offset = cls.DIRECTORY.size
+        for name in cls.SECTIONS:
+            count, chunk = sections[name]
+            directory += [offset, count]
+            offset += len(chunk)
+        return cls.DIRECTORY.pack(*directory) + b''.join(sections[name][1] for name in cls.SECTIONS)
+
+    @staticmethod
+    def _order(value):
+        """Ключ сортировки записей: None, затем числа, затем строки"""
+        if value is None:
+            return 0, 0
+        if isinstance(value, (int, float)):
+            return 1, value
+        return 2, str(value)
+
+    @classmethod
+    def _micros(cls, moment):
+        return (moment - cls.EPOCH) // timedelta(microseconds=1)
+
+    def _range(self, name, start=None, stop=None):
+        """Лениво перебирает номера записей со временем из [start, stop) по упорядоченному индексу"""
+        offset, count = self._sections[name]
+        moments = MappedArray(self._map, offset, count, self.ENTRY, 0)
+        low = 0 if start is None else bisect.bisect_left(moments, self._micros(start), 0, count)
+        high = count if stop is None else bisect.bisect_left(moments, self._micros(stop), 0, count)
+        for position in range(low, high):
+            yield self.ENTRY.unpack_from(self._map, offset + position * self.ENTRY.size)[1]
+
+    def decode(self, offset):
+        """Читает значение поля записи по смещению в снимке"""
+        kind, value = self.FIELD.unpack_from(self._map, offset)
+        if kind == self.NONE:
+            return None
+        if kind == self.INT:
+            return value
+        if kind == self.FLOAT:
+            return struct.unpack('<d', struct.pack('<q', value))[0]
+        if kind == self.BOOL:
+            return bool(value)
+        if kind == self.DATE:
+            return date.fromordinal(value)
+        if kind == self.DATETIME:
+            return self.EPOCH + timedelta(microseconds=value)
+        if kind == self.TIME:
+            return (datetime.min + timedelta(microseconds=value)).time()
+        strings = self._sections['strings'][0] + value * self.OFFSET.size
+        start, = self.OFFSET.unpack_from(self._map, strings)
+        stop, = self.OFFSET.unpack_from(self._map, strings + self.OFFSET.size)
+        base = self._sections['string_data'][0]
+        string = str(self._map[base + start:base + stop], 'utf-8')
+        return Decimal(string) if kind == self.DECIMAL else string
+
+    @staticmethod
+    def _train(values):
+        return Train(*values[1:])
+
+    @staticmethod
+    def _timetable(values):
+        return TrainTimetable(*values[1:])
+
+    def _ticket_sales_sheet(self, values):
+        key, number_of_train, sale_datetime, passenger_fullname, passport, number_of_tickets, benefits, price, \
+            sale_id = values
+        ticket_sales_sheet = TicketSalesSheet(number_of_train, sale_datetime, passenger_fullname, passport,
+                                              number_of_tickets, benefits, price, sale_id=sale_id)
+        ticket_sales_sheet.bind_timetables(self.database["train_timetables"])
+        return ticket_sales_sheet
+
+
+class MappedTable(collections.abc.Mapping):
+    """Таблица двоичного снимка: записи фиксированной длины, упорядоченные по ключу; сущности создаются при обращении"""
+
+    def __init__(self, snapshot, name, offset, count, factory):
+        """Инициализирует атрибуты snapshot(снимок), name(имя таблицы), offset и count(расположение записей)
+        и factory(функция создания сущности по значениям полей)"""
+        self.snapshot = snapshot
+        self.name = name
+        self.offset = offset
+        self.count = count
+        self.factory = factory
+        self.width = len(MappedDatabase.FIELDS[name])
+        self.size = self.width * MappedDatabase.FIELD.size
+
+    def field(self, position, field):
+        """Читает одно поле записи"""
+        return self.snapshot.decode(self.offset + position * self.size + field * MappedDatabase.FIELD.size)
+
+    def record(self, position):
+        """Создаёт сущность по записи"""
+        return self.factory([self.field(position, field) for field in range(self.width)])
+
+    def position(self, key):
+        """Двоичным поиском находит номер записи по ключу; None, если записи нет"""
+        order = MappedDatabase._order(key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if MappedDatabase._order(self.field(middle, 0)) < order:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and MappedDatabase._order(self.field(low, 0)) == order:
+            return low
+        return None
+
+    def __getitem__(self, key):
+        position = self.position(key)
+        if position is None:
+            raise KeyError(key)
+        return self.record(position)
+
+    def __contains__(self, key):
+        return self.position(key) is not None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.field(position, 0)
+
+    def __len__(self):
+        return self.count
+
+
+class MappedArray:
+    """Последовательность значений из массива структур в снимке, пригодная для bisect без копирования"""
+
+    def __init__(self, buffer, offset, count, item, field):
+        """Инициализирует атрибуты buffer(снимок), offset, count(расположение массива), item(структура элемента)
+        и field(номер возвращаемого поля структуры)"""
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.item = item
+        self.field = field
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return self.item.unpack_from(self.buffer, self.offset + position * self.item.size)[self.field]
+
+    def __len__(self):
+        return self.count
+
+
+class RzdService:
+    """Асинхронная служба кассы над RzdDatabase: операции базы - сопрограммы, изменения касс сохраняются
+    групповыми записями. Все обращения к базе выполняются по очереди в одном рабочем потоке"""
+
+    # Операции базы, доступные через службу: имя -> вид.
+    # 'read' - чтение и брони мест (не пишутся на диск), 'write' - изменение, сохраняемое в групповой записи,
+    # 'alone' - обслуживание вне пакета
+    OPERATIONS = {
+        'get_worker_by_name': 'read',
+        'get_worker_by_id': 'read',
+        'get_train_timetable_by_number': 'read',
+        'get_train_by_number': 'read',
+        'get_train_brigade_by_number': 'read',
+        'get_train_brigade_by_id': 'read',
+        'get_ticket_sales_sheet_by_id': 'read',
+        'get_ticket_sales_sheets_by_datetime': 'read',
+        'find': 'read',
+        'sales_between': 'read',
+        'departures_between': 'read',
+        'plan_journey': 'read',
+        'archived_days': 'read',
+        'available_seats': 'read',
+        'hold_seats': 'read',
+        'release_seats': 'read',
+        'add_worker': 'write',
+        'delete_worker': 'write',
+        'change_worker_qt': 'write',
+        'add_train_timetable': 'write',
+        'delete_train_timetable': 'write',
+        'change_ticket_price_qt': 'write',
+        'add_train': 'write',
+        'delete_train': 'write',
+        'change_number_of_carriages_qt': 'write',
+        'add_train_brigade': 'write',
+        'delete_train_brigade': 'write',
+        'change_brigade_number_qt': 'write',
+        'add_ticket_sales_sheet': 'write',
+        'delete_ticket_sales_sheet': 'write',
+        'change_number_of_tickets_qt': 'write',
+        'del_sales': 'write',
+        'drop_sales': 'alone',
+        'drop_sales_before': 'alone',
+        'archive_sales': 'alone',
+        'archive_sales_before': 'alone',
+        'save_database': 'alone',
+        'refresh': 'alone',
+    }
+    # Исключения, которые клиент по сокету получает с исходным типом
+    ERRORS = ('ValueError', 'KeyError', 'TypeError', 'InvalidTypeError', 'InvalidValueError', 'ConflictError',
+              'DatabaseCorruptedError', 'TransactionQueueOverflowError', 'SeatsUnavailableError')
+    # Заголовок кадра протокола: длина записи RecordCodec
+    FRAME_HEADER = struct.Struct('<I')
+
+    def __init__(self, db, window=0.002, max_batch=256):
+        """Инициализирует атрибуты db(база), window(сколько секунд ждать другие изменения перед групповой записью)
+        и max_batch(наибольшее кол-во изменений в одной групповой записи)"""
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self._executor = None  # Рабочий поток базы
+        self._pending = None  # Очередь изменений, ожидающих групповой записи
+        self._committer = None  # Задача, выполняющая групповые записи
+        self._servers = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __getattr__(self, name):
+        """Возвращает операцию базы в виде сопрограммы: await service.add_ticket_sales_sheet(...)"""
+        if name not in RzdService.OPERATIONS:
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    async def start(self):
+        """Запускает рабочий поток базы и задачу групповых записей"""
+        if self._committer is not None:
+            return
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='rzd-service')
+        self._pending = asyncio.Queue()
+        self._committer = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Останавливает серверы, дожидается записи принятых изменений и останавливает рабочий поток"""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        if self._committer is None:
+            return
+        await self._pending.join()
+        self._committer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._committer
+        self._committer = None
+        self._executor.shutdown()
+        self._executor = None
+
+    async def call(self, name, *args, **kwargs):
+        """Выполняет операцию базы; изменение завершается только после его записи на диск"""
+        kind = self.OPERATIONS.get(name)
+        if kind is None:
+            raise ValueError('operation does not exist')
+        if self._committer is None:
+            raise ServiceError(name)
+        if kind == 'write':
+            future = asyncio.get_running_loop().create_future()
+            self._pending.put_nowait((future, name, args, kwargs))
+            return await future
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(self._execute, name, args, kwargs))
+
+    async def serve(self, host='127.0.0.1', port=0, path=None):
+        """Принимает запросы клиентов RzdClient по TCP на локальном адресе или по сокету UNIX path"""
+        await self.start()
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def _run(self):
+        """Собирает изменения, поступившие за окно ожидания, и сохраняет их одной записью"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            if self.window and self._pending.qsize() < self.max_batch - 1:
+                # пока ждём, к записи присоединяются изменения других касс
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            try:
+                outcomes = await loop.run_in_executor(
+                    self._executor, self._apply, [item[1:] for item in batch])
+            except Exception as error:
+                outcomes = [(None, error)] * len(batch)
+            for (future, *operation), (result, error) in zip(batch, outcomes):
+                if not future.done():
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+                self._pending.task_done()
+
+    def _apply(self, operations):
+        """Выполняет изменения пакета в одной транзакции базы; ошибка одного изменения откатывает только его"""
+        outcomes = []
+        try:
+            with self.db.batch():
+                for name, args, kwargs in operations:
+                    try:
+                        with self.db.transaction():
+                            outcomes.append((self._execute(name, args, kwargs), None))
+                    except Exception as error:
+                        outcomes.append((None, error))
+        except Exception as error:
+            # групповая запись не удалась: база уже откатила весь пакет, поэтому ошибку получают все кассы,
+            # чьи изменения в него вошли, и повтор изменения не запишет его дважды
+            outcomes += [(None, error)] * (len(operations) - len(outcomes))
+            return [(None, error if failure is None else failure) for result, failure in outcomes]
+        return outcomes
+
+    def _execute(self, name, args, kwargs):
+        result = getattr(self.db, name)(*args, **kwargs)
+        if isinstance(result, collections.abc.Iterator):
+            # ленивые выборки читаются в рабочем потоке, пока база не изменилась
+            result = list(result)
+        return result
+
+    async def _handle(self, reader, writer):
+        """Обслуживает подключение клиента: запросы выполняются параллельно, ответы - по мере готовности"""
+        tasks = set()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(self.FRAME_HEADER.size)
+                    request_id, name, args, kwargs = RecordCodec.decode(
+                        await reader.readexactly(self.FRAME_HEADER.unpack(header)[0]))
+                except asyncio.IncompleteReadError:
+                    break
+                task = asyncio.get_running_loop().create_task(self._respond(writer, request_id, name, args, kwargs))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ValueError, TypeError, ConnectionError) as error:
+            # непонятный запрос: подключение закрывается
+            logger.info("Ошибка протокола службы: %s", error)
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, request_id, name, args, kwargs):
+        try:
+            response = (request_id, None, await self.call(name, *args, **kwargs))
+        except Exception as error:
+            value = getattr(error, 'value', error.args[0] if len(error.args) == 1 else str(error))
+            response = (request_id, (type(error).__name__, value if isinstance(value, (str, int)) else str(value)), None)
+        try:
+            data = RecordCodec.encode(response)
+        except TypeError as error:
+            data = RecordCodec.encode((request_id, ('TypeError', str(error)), None))
+        if not writer.is_closing():
+            writer.write(self.FRAME_HEADER.pack(len(data)) + data)
+            await writer.drain()
+
+
+class RzdClient:
+    """Клиент службы RzdService по сокету: операции базы вызываются как сопрограммы, запросы идут без ожидания
+    ответов на предыдущие"""
+
+    def __init__(self, reader, writer):
+        """Инициализирует атрибуты подключения; создаётся через RzdClient.connect"""
+        self._reader = reader
+        self._writer = writer
+        self._requests = {}  # Номер запроса -> ожидающий ответа future
+        self._next_id = 0
+        self._receiver = asyncio.get_running_loop().create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=None, path=None):
+        """Подключается к службе по TCP или по сокету UNIX path"""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __getattr__(self, name):
+        if name not in RzdService.OPERATIONS:
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    async def call(self, name, *args, **kwargs):
+        """Отправляет запрос службе и ждёт ответа; ошибка операции вызывается здесь же"""
+        if self._receiver.done():
+            raise ServiceError(name)
+        self._next_id += 1
+        future = self._requests[self._next_id] = asyncio.get_running_loop().create_future()
+        data = RecordCodec.encode((self._next_id, name, args, kwargs))
+        self._writer.write(RzdService.FRAME_HEADER.pack(len(data)) + data)
+        await self._writer.drain()
+        return await future
+
+    async def close(self):
+        self._writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self._writer.wait_closed()
+        with contextlib.suppress(asyncio.CancelledError):
+            self._receiver.cancel()
+            await self._receiver
+
+    async def _receive(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(RzdService.FRAME_HEADER.size)
+                request_id, error, result = RecordCodec.decode(
+                    await self._reader.readexactly(RzdService.FRAME_HEADER.unpack(header)[0]))
+                future = self._requests.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    name, value = error
+                    if name in RzdService.ERRORS:
+                        future.set_exception((getattr(builtins, name, None) or globals()[name])(value))
+                    else:
+                        future.set_exception(ServiceError('{0}: {1}'.format(name, value)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # служба закрыла подключение: ожидающие ответа запросы завершаются ошибкой
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(ServiceError('connection closed'))
+            self._requests.clear()
+
+
+class HashIndex:
+    """Вторичный индекс таблицы: значение атрибута -> ключи записей с этим значением"""
+
+    def __init__(self, getter):
+        """Инициализирует атрибуты getter(функция получения значения) и словари индекса"""
+        self.getter = getter
+        self.keys_by_value = {}  # Значение -> упорядоченное множество ключей (словарь без значений)
+        self.value_by_key = {}  # Ключ -> проиндексированное значение, нужно для удаления
+
+    def add(self, key, item):
+        """Добавляет запись в индекс"""
+        value = self.getter(item)
+        self.value_by_key[key] = value
+        self.keys_by_value.setdefault(value, {})[key] = None
+
+    def discard(self, key):
+        """Удаляет запись из индекса, если она в нём есть"""
+        if key not in self.value_by_key:
+            return
+        value = self.value_by_key.pop(key)
+        keys = self.keys_by_value[value]
+        del keys[key]
+        if not keys:
+            del self.keys_by_value[value]
+
+    def lookup(self, value):
+        """Возвращает ключи записей с заданным значением"""
+        return self.keys_by_value.get(value, {})
+
+    def clear(self):
+        """Очищает индекс"""
+        self.keys_by_value.clear()
+        self.value_by_key.clear()
+
+
+class SortedIndex:
+    """Упорядоченный индекс таблицы на отсортированном массиве для запросов по диапазону"""
+
+    def __init__(self, getter):
+        """Инициализирует атрибуты getter(функция получения значения) и массивы индекса"""
+        self.getter = getter
+        self.values = []  # Отсортированные значения
+        self.keys = []  # Ключи записей в порядке значений
+        self.value_by_key = {}
+
+    def add(self, key, item):
+        """Добавляет запись в индекс; записи без значения (None) не индексируются"""
+        value = self.getter(item)
+        if value is None:
+            return
+        self.value_by_key[key] = value
+        position = bisect.bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.keys.insert(position, key)
+
+    def discard(self, key):
+        """Удаляет запись из индекса, если она в нём есть"""
+        if key not in self.value_by_key:
+            return
+        value = self.value_by_key.pop(key)
+        position = bisect.bisect_left(self.values, value)
+        while self.keys[position] != key:
+            position += 1
+        del self.values[position]
+        del self.keys[position]
+
+    def range(self, start=None, stop=None):
+        """Лениво перебирает ключи записей со значениями из [start, stop); база не должна меняться при обходе"""
+        low = 0 if start is None else bisect.bisect_left(self.values, start)
+        high = len(self.values) if stop is None else bisect.bisect_left(self.values, stop)
+        for position in range(low, high):
+            yield self.keys[position]
+
+    def lookup(self, value):
+        """Возвращает ключи записей с заданным значением"""
+        low = bisect.bisect_left(self.values, value)
+        high = bisect.bisect_right(self.values, value)
+        return dict.fromkeys(self.keys[low:high])
+
+    def clear(self):
+        """Очищает индекс"""
+        self.values.clear()
+        self.keys.clear()
+        self.value_by_key.clear()
+
+
+class ConnectionIndex:
+    """Индекс расписаний для поиска маршрутов с пересадками: массив переездов (отправление -> прибытие),
+    упорядоченный по времени отправления (алгоритм сканирования переездов, Connection Scan)"""
+
+    # До скольких новых переездов они вставляются в массивы по одному; больше - массивы пересортировываются
+    INSERT_LIMIT = 64
+
+    def __init__(self):
+        """Инициализирует пустые параллельные массивы переездов"""
+        self.departures = []  # Отсортированные времена отправления
+        self.arrivals = []  # Время прибытия
+        self.origins = []  # Пункт отправления
+        self.destinations = []  # Пункт прибытия
+        self.keys = []  # Ключ расписания
+        self.departure_by_key = {}
+        self._pending = []  # Добавленные переезды, ещё не внесённые в массивы
+
+    def __len__(self):
+        return len(self.departure_by_key)
+
+    def add(self, key, timetable):
+        """Добавляет переезд расписания; расписания без времени или с прибытием раньше отправления не индексируются"""
+        departure = parse_datetime(timetable.date_of_departure, timetable.time_of_departure)
+        arrival = parse_datetime(timetable.date_of_arrival, timetable.time_of_arrival)
+        if departure is None or arrival is None or arrival < departure:
+            return
+        self.departure_by_key[key] = departure
+        # массивы упорядочиваются при следующем запросе: построение индекса не вставляет переезды по одному
+        self._pending.append((departure, arrival, timetable.place_of_departure, timetable.place_of_arrival, key))
+
+    def discard(self, key):
+        """Удаляет переезд расписания, если он есть в индексе"""
+        if key not in self.departure_by_key:
+            return
+        self._merge()
+        position = bisect.bisect_left(self.departures, self.departure_by_key.pop(key))
+        while self.keys[position] != key:
+            position += 1
+        for column in (self.departures, self.arrivals, self.origins, self.destinations, self.keys):
+            del column[position]
+
+    def clear(self):
+        """Очищает индекс"""
+        for column in (self.departures, self.arrivals, self.origins, self.destinations, self.keys):
+            column.clear()
+        self.departure_by_key.clear()
+        self._pending.clear()
+
+    def _merge(self):
+        """Вносит добавленные переезды в упорядоченные массивы"""
+        pending = self._pending
+        if not pending:
+            return
+        columns = (self.departures, self.arrivals, self.origins, self.destinations, self.keys)
+        if len(pending) <= self.INSERT_LIMIT:
+            for row in pending:
+                position = bisect.bisect_right(self.departures, row[0])
+                for column, value in zip(columns, row):
+                    column.insert(position, value)
+        else:
+            rows = sorted(itertools.chain(zip(*columns), pending), key=operator.itemgetter(0))
+            for column, values in zip(columns, zip(*rows)):
+                column[:] = values
+        pending.clear()
+
+    def earliest_arrival(self, origin, destination, departure, transfer=timedelta(0)):
+        """Возвращает ключи расписаний маршрута с самым ранним прибытием в destination при отправлении
+        из origin не раньше departure (на пересадку - не меньше transfer) или None, если маршрута нет"""
+        if origin == destination:
+            return []
+        self._merge()
+        departures, arrivals, origins, destinations = self.departures, self.arrivals, self.origins, self.destinations
+        ready = {origin: departure}  # Пункт -> самое раннее время, когда из него можно уехать
+        arrived = {}  # Пункт -> самое раннее прибытие
+        via = {}  # Пункт -> позиция переезда, которым в него приехали раньше всего
+        best = None
+        for position in range(bisect.bisect_left(departures, departure), len(departures)):
+            moment = departures[position]
+            if best is not None and moment >= best:
+                # переезды, отправляющиеся позже уже найденного прибытия, его не улучшат
+                break
+            start = ready.get(origins[position])
+            if start is None or moment < start:
+                continue
+            place, arrival = destinations[position], arrivals[position]
+            if place == origin or place in arrived and arrived[place] <= arrival:
+                continue
+            arrived[place] = arrival
+            via[place] = position
+            if place == destination:
+                best = arrival
+            else:
+                ready[place] = arrival + transfer
+        if best is None:
+            return None
+        keys = []
+        place = destination
+        while place != origin:
+            position = via[place]
+            keys.append(self.keys[position])
+            place = origins[position]
+        keys.reverse()
+        return keys
+
+
+class SalesColumns:
+    """Колоночное представление ведомостей продаж: по массиву на атрибут для быстрых агрегатов"""
+
+    # Значения поля льгот, означающие их отсутствие
+    NO_BENEFITS = ('', 'нет', 'no', '0', 'false', 'none')
+
+    def __init__(self):
+        """Инициализирует пустые колонки"""
+        self.keys = []  # Номер строки -> ключ ведомости
+        self.row_by_key = {}
+        self.price = array.array('d')  # Стоимость
+        self.tickets = array.array('q')  # Кол-во билетов
+        self.benefits = array.array('b')  # Наличие льгот (0/1)
+        self.train = array.array('q')  # Код номера поезда
+        self.day = array.array('q')  # Порядковый номер дня продажи (date.toordinal), 0 - неизвестен
+        self.train_numbers = []  # Код -> номер поезда
+        self.train_codes = {}  # Номер поезда -> код
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, sheet):
+        """Добавляет ведомость последней строкой"""
+        code = self.train_codes.get(sheet.number_of_train)
+        if code is None:
+            code = self.train_codes[sheet.number_of_train] = len(self.train_numbers)
+            self.train_numbers.append(sheet.number_of_train)
+        moment = parse_datetime(sheet.sale_datetime)
+        self.row_by_key[key] = len(self.keys)
+        self.keys.append(key)
+        self.price.append(self._to_number(sheet.price, float))
+        self.tickets.append(self._to_number(sheet.number_of_tickets, int))
+        self.benefits.append(self._has_benefits(sheet.benefits))
+        self.train.append(code)
+        self.day.append(moment.toordinal() if moment is not None else 0)
+
+    def discard(self, key):
+        """Удаляет строку ведомости, перенося на её место последнюю строку"""
+        row = self.row_by_key.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        for column in (self.keys, self.price, self.tickets, self.benefits, self.train, self.day):
+            column[row] = column[last]
+            column.pop()
+        if row != last:
+            self.row_by_key[self.keys[row]] = row
+
+    def clear(self):
+        """Очищает колонки"""
+        self.__init__()
+
+    def revenue_by_train(self):
+        """Возвращает сумму стоимости ведомостей по номерам поездов"""
+        if numpy is not None and self.keys:
+            sums = numpy.bincount(numpy.frombuffer(self.train, dtype=numpy.int64),
+                                  weights=numpy.frombuffer(self.price, dtype=numpy.float64),
+                                  minlength=len(self.train_numbers)).tolist()
+        else:
+            sums = [0.0] * len(self.train_numbers)
+            for code, price in zip(self.train, self.price):
+                sums[code] += price
+        return {number: total for number, total in zip(self.train_numbers, sums) if total}
+
+    def tickets_by_day(self):
+        """Возвращает кол-во проданных билетов по дням"""
+        totals = {}
+        if numpy is not None and self.keys:
+            days, inverse = numpy.unique(numpy.frombuffer(self.day, dtype=numpy.int64), return_inverse=True)
+            sums = numpy.bincount(inverse, weights=numpy.frombuffer(self.tickets, dtype=numpy.int64))
+            pairs = zip(days.tolist(), sums.astype(numpy.int64).tolist())
+        else:
+            for day, tickets in zip(self.day, self.tickets):
+                totals[day] = totals.get(day, 0) + tickets
+            pairs = totals.items()
+        return {date.fromordinal(day) if day else None: tickets for day, tickets in sorted(pairs)}
+
+    def benefits_share(self):
+        """Возвращает долю ведомостей с льготами"""
+        if not self.keys:
+            return 0.0
+        if numpy is not None:
+            return float(numpy.frombuffer(self.benefits, dtype=numpy.int8).mean())
+        return sum(self.benefits) / len(self.benefits)
+
+    @staticmethod
+    def _to_number(value, kind):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return kind(0)
+
+    @classmethod
+    def _has_benefits(cls, value):
+        if isinstance(value, str):
+            return value.strip().lower() not in cls.NO_BENEFITS
+        return 1 if value else 0
+
+
+class SeatInventory:
+    """Учёт мест рейсов: проданные места хранятся битовыми картами вагонов в записях SeatMap таблицы seat_maps,
+    временные брони - только в памяти процесса"""
+
+    # Мест в вагоне по типу поезда
+    SEATS_PER_CARRIAGE = {'общий': 81, 'скоростной': 68, 'высокоскоростной': 66}
+    DEFAULT_SEATS_PER_CARRIAGE = 54
+
+    def __init__(self, capacity):
+        """Инициализирует атрибуты capacity(функция: номер поезда -> (кол-во вагонов, мест в вагоне)
+        или None, если вместимость неизвестна) и пустые брони"""
+        self.capacity = capacity
+        self.held = {}  # Ключ карты мест -> битовые карты вагонов (бит места установлен, если оно забронировано)
+        self._lock = threading.Lock()  # Брони могут ставиться из других потоков
+
+    def available(self, seat_map):
+        """Возвращает кол-во свободных мест рейса или None, если вместимость поезда неизвестна"""
+        capacity = self.capacity(seat_map.number_of_train)
+        if capacity is None:
+            return None
+        taken = self._count(seat_map.maps) + self._count(self.held.get(seat_map.key, ()))
+        return max(0, capacity[0] * capacity[1] - taken)
+
+    def is_free(self, seat_map, carriage, seat):
+        """Проверяет, свободно ли место seat в вагоне carriage (нумерация с 1)"""
+        capacity = self.capacity(seat_map.number_of_train)
+        if capacity is None or not (0 < carriage <= capacity[0] and 0 < seat <= capacity[1]):
+            return False
+        return not (self._test(seat_map.maps, (carriage, seat)) or
+                    self._test(self.held.get(seat_map.key, ()), (carriage, seat)))
+
+    def check(self, seat_map, count, seats=None, own=()):
+        """Проверяет, что рейсу хватит мест на count билетов (с учётом мест own, уже занятых ведомостью)
+        и что переданные места забронированы и не проданы; иначе вызывает SeatsUnavailableError"""
+        if seats is not None:
+            held = self.held.get(seat_map.key, ())
+            if len(seats) != count or any(not self._test(held, seat) or self._test(seat_map.maps, seat)
+                                          for seat in map(tuple, seats)):
+                raise SeatsUnavailableError(seat_map.number_of_train)
+            return
+        available = self.available(seat_map)
+        if available is None or not isinstance(count, int):
+            return
+        if count > available + len(own):
+            raise SeatsUnavailableError(seat_map.number_of_train)
+
+    def check_resize(self, seat_maps, number_of_carriages):
+        """Проверяет, что в отцепляемых вагонах нет проданных или забронированных мест рейсов seat_maps;
+        рейсы, уже отправившиеся, не проверяются"""
+        now = datetime.now()
+        for seat_map in seat_maps:
+            departure = parse_datetime(seat_map.departure)
+            if departure is not None and departure < now:
+                continue
+            if any(seat_map.maps[number_of_carriages:]) or any(self.held.get(seat_map.key, ())[number_of_carriages:]):
+                raise ValueError('carriages with occupied seats cannot be removed')
+
+    def hold(self, seat_map, count, carriage=None):
+        """Бронирует count свободных мест рейса (все или ни одного), по возможности в вагоне carriage;
+        возвращает места (вагон, место)"""
+        with self._lock:
+            capacity = self.capacity(seat_map.number_of_train)
+            if capacity is None or count > self.available(seat_map):
+                raise SeatsUnavailableError(seat_map.number_of_train)
+            held = self.held.get(seat_map.key, ())
+            seats = self._allocate(self._merge(seat_map.maps, held), count, capacity, carriage)
+            self.held[seat_map.key] = self._change(held, seats, True)
+            return seats
+
+    def release(self, seat_map, seats):
+        """Снимает бронь с мест рейса; проданные места не освобождаются"""
+        with self._lock:
+            held = self._change(self.held.get(seat_map.key, ()), map(tuple, seats), False)
+            if any(held):
+                self.held[seat_map.key] = held
+            else:
+                self.held.pop(seat_map.key, None)
+
+    def occupy(self, seat_map, count, seats=None):
+        """Занимает в карте места ведомости на count билетов: непроданные места из seats (в том числе
+        забронированные) переходят к ней, недостающие выделяются из свободных. Возвращает места ведомости;
+        если вместимость поезда неизвестна, места не назначаются и возвращается seats"""
+        with self._lock:
+            capacity = self.capacity(seat_map.number_of_train)
+            if capacity is None:
+                return seats
+            count = count if isinstance(count, int) else 0
+            taken = []
+            for seat in seats or ():
+                carriage, place = seat = tuple(seat)
+                if len(taken) == count or not (0 < carriage <= capacity[0] and 0 < place <= capacity[1]) or \
+                        seat in taken or self._test(seat_map.maps, seat):
+                    continue
+                taken.append(seat)
+            maps = self._change(seat_map.maps, taken, True)
+            if len(taken) < count:
+                # ведомости, проданные сверх вместимости до появления учёта мест, получают только свободные места
+                occupied = self._merge(maps, self._change(self.held.get(seat_map.key, ()), taken, False))
+                free = capacity[0] * capacity[1] - self._count(occupied)
+                allocated = self._allocate(occupied, min(count - len(taken), free), capacity)
+                taken.extend(allocated)
+                maps = self._change(maps, allocated, True)
+            seat_map.maps = maps
+            return tuple(taken)
+
+    def vacate(self, seat_map, seats):
+        """Освобождает в карте проданные места"""
+        with self._lock:
+            seat_map.maps = self._change(seat_map.maps, map(tuple, seats or ()), False)
+
+    @staticmethod
+    def rebase(maps, base, foreign, force=False):
+        """Переносит изменения карт вагонов maps, сделанные от карт base, на карты foreign (другую версию,
+        изменённую от тех же base); возвращает новые карты или None, если обе версии заняли одно место.
+        force=True переносит изменения и при совпадении мест"""
+        rebased = []
+        for position in range(max(len(maps), len(base), len(foreign))):
+            own, old, other = (item[position] if position < len(item) else 0 for item in (maps, base, foreign))
+            if own & other & ~old and not force:
+                return None
+            rebased.append((own | other & ~old) & ~(old & ~other))
+        while rebased and not rebased[-1]:
+            rebased.pop()
+        return tuple(rebased)
+
+    @staticmethod
+    def _test(maps, seat):
+        carriage, place = seat
+        return 0 < carriage <= len(maps) and 0 < place and bool(maps[carriage - 1] >> (place - 1) & 1)
+
+    @staticmethod
+    def _count(maps):
+        return sum(bin(bits).count('1') for bits in maps)
+
+    @staticmethod
+    def _merge(first, second):
+        """Объединяет битовые карты вагонов"""
+        if len(first) < len(second):
+            first, second = second, first
+        return tuple(bits | (second[position] if position < len(second) else 0)
+                     for position, bits in enumerate(first))
+
+    @staticmethod
+    def _change(maps, seats, occupied):
+        """Возвращает копию карт вагонов, в которой места seats заняты или освобождены"""
+        maps = list(maps)
+        for carriage, place in seats:
+            if carriage > len(maps):
+                if not occupied:
+                    continue
+                maps.extend([0] * (carriage - len(maps)))
+            if occupied:
+                maps[carriage - 1] |= 1 << (place - 1)
+            else:
+                maps[carriage - 1] &= ~(1 << (place - 1))
+        while maps and not maps[-1]:
+            # пустые вагоны в конце не хранятся
+            maps.pop()
+        return tuple(maps)
+
+    @staticmethod
+    def _allocate(occupied, count, capacity, carriage=None):
+        """Выбирает первые места, не занятые в картах occupied, начиная с вагона carriage; возвращает их"""
+        carriages, places = capacity
+        full = (1 << places) - 1
+        order = range(carriages)
+        if carriage is not None and 0 < carriage <= carriages:
+            order = itertools.chain((carriage - 1,), (position for position in order if position != carriage - 1))
+        seats = []
+        for position in order:
+            if len(seats) == count:
+                break
+            free = ~(occupied[position] if position < len(occupied) else 0) & full
+            while free and len(seats) < count:
+                lowest = free & -free
+                free ^= lowest
+                seats.append((position + 1, lowest.bit_length()))
+        return tuple(seats)
+
+
+class Profiler:
+    """Сбор статистики методов в памяти: кол-во вызовов и гистограмма длительности по полному имени метода"""
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, enabled=True):
+        """Инициализирует атрибуты enabled(сбор включён), counts(вызовы) и histograms(длительности)"""
+        self.enabled = enabled
+        self.counts = {}  # Полное имя метода -> кол-во вызовов
+        self.histograms = {}  # Полное имя метода -> корзины: номер = разрядность длительности в нс
+
+    def count(self, name):
+        """Учитывает вызов метода"""
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def observe(self, name, elapsed_ns):
+        """Учитывает длительность вызова метода в гистограмме с корзинами по степеням двойки"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * 64
+        histogram[min(elapsed_ns.bit_length(), 63)] += 1
+
+    def snapshot(self):
+        """Возвращает статистику: для каждого метода кол-во вызовов и перцентили длительности в секундах"""
+        result = {}
+        for name in sorted(set(self.counts) | set(self.histograms)):
+            stats = {'calls': self.counts.get(name, 0)}
+            histogram = self.histograms.get(name)
+            if histogram is not None:
+                stats['timed_calls'] = sum(histogram)
+                for percentile in self.PERCENTILES:
+                    stats['p{0}'.format(percentile)] = self._percentile(histogram, percentile)
+            result[name] = stats
+        return result
+
+    def export(self, filename):
+        """Сохраняет снимок статистики в файл JSON"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    def reset(self):
+        """Очищает накопленную статистику"""
+        self.counts.clear()
+        self.histograms.clear()
+
+    @staticmethod
+    def _percentile(histogram, percentile):
+        """Возвращает верхнюю границу корзины, в которую попадает перцентиль, в секундах"""
+        rank = sum(histogram) * percentile / 100
+        seen = 0
+        for bucket, calls in enumerate(histogram):
+            seen += calls
+            if calls and seen >= rank:
+                return (1 << bucket) / 1e9
+        return 0.0
+
+
+# Общий сборщик статистики для декораторов Timer и Count
+profiler = Profiler()
 
 
 class Timer:
     """Декоратор - счетчик времени выполнения метода"""
 
     def __init__(self, func):
-        """Инициализирует атрибут func(функция)"""
+        """Инициализирует атрибуты func(функция) и name(полное имя метода)"""
+        functools.update_wrapper(self, func)
         self.func = func
+        self.name = func.__qualname__
 
     def __call__(self, *args, **kwargs):
-        t1 = time.perf_counter()
-        return_value = self.func(*args, **kwargs)
-        t2 = time.perf_counter()
-        print("Время выполнения метода: {0:0.3f} секунд.".format(t2 - t1))
-        return return_value
+        if not profiler.enabled:
+            return self.func(*args, **kwargs)
+        start = time.perf_counter_ns()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            profiler.observe(self.name, time.perf_counter_ns() - start)
 
     def __get__(self, instance, owner):
         """Специальный метод, для работы декоратора"""
-        import functools
-        return functools.partial(self.__call__, instance)
+        if instance is None:
+            return self
+        return types.MethodType(self, instance)
 
 
 class Count:
     """Декоратор - счетчик вызовов метода"""
-    func_counter = {}
+    func_counter = profiler.counts
 
     def __init__(self, func):
-        """Инициализирует атрибут func(функция)"""
+        """Инициализирует атрибуты func(функция) и name(полное имя метода)"""
+        functools.update_wrapper(self, func)
         self.func = func
+        self.name = func.__qualname__
 
     def __call__(self, *args, **kwargs):
-        self.func_counter.setdefault(self.func.__name__, 0)
-        self.func_counter[self.func.__name__] += 1
+        if profiler.enabled:
+            profiler.count(self.name)
         return self.func(*args, **kwargs)
 
     def __get__(self, instance, owner):
         """Специальный метод, для работы декоратора"""
-        import functools
-        return functools.partial(self.__call__, instance)
+        if instance is None:
+            return self
+        return types.MethodType(self, instance)
 
     @classmethod
     def get_func_counter(cls):
         return cls.func_counter
 
 
+class RZDAuditLog:
+    """Журнал транзакций: копит записи в буфере и дописывает их в файл пачками"""
+
+    def __init__(self, filename='transaction.txt', buffer_size=1024, flush_interval=1.0, background=False):
+        """Инициализирует атрибуты filename(файл), buffer_size(размер буфера, записей),
+        flush_interval(наибольшая задержка записи, секунд) и background(запись в фоновом потоке)"""
+        # путь фиксируется при создании: смена текущего каталога не переносит журнал
+        self.filename = os.path.abspath(filename)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = collections.deque()  # Записи (время, операция), ещё не попавшие в файл
+        self._lock = threading.Lock()  # Защищает буфер
+        self._io_lock = threading.Lock()  # Упорядочивает запись пачек в файл
+        self._file = None  # Файл открывается при первой записи и остаётся открытым
+        self._last_flush = time.monotonic()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        # при штатном завершении интерпретатора буфер не теряется
+        atexit.register(self.close)
+
+    def write(self, transaction):
+        """Добавляет транзакцию в буфер; файл пишется при заполнении буфера или по истечении интервала"""
+        with self._lock:
+            self._buffer.append((transaction.when, transaction.operation))
+            due = len(self._buffer) >= self.buffer_size or \
+                time.monotonic() - self._last_flush >= self.flush_interval
+        if not due:
+            return
+        if self._thread is None or len(self._buffer) >= 2 * self.buffer_size:
+            # без фонового потока, а также если он не успевает, пишем сами
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self):
+        """Дописывает накопленные записи в файл"""
+        with self._io_lock:
+            with self._lock:
+                items, self._buffer = self._buffer, collections.deque()
+                self._last_flush = time.monotonic()
+            if not items:
+                return
+            if self._file is None:
+                self._file = open(self.filename, 'a')
+            self._file.write(''.join('when {0} : operation {1} \n'.format(when, operation)
+                                     for when, operation in items))
+            self._file.flush()
+
+    def close(self):
+        """Останавливает фоновый поток, сбрасывает буфер и закрывает файл"""
+        if self._thread is not None:
+            self._closed = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
 class RZDTransaction:
     """Класс для хранения транзакций"""
 
+    audit_log = None  # Журнал, в который попадают все транзакции; без set_audit_log создаётся при первой транзакции
+    _audit_log_lock = threading.Lock()
+
     def __init__(self, operation):
-        """Инициализирует атрибуты when(дата) и operation(операция)"""
+        """Инициализирует атрибуты when(дата) и operation(операция) и передаёт транзакцию в журнал"""
         self.when = datetime.today().replace(microsecond=0)
         self.operation = operation
+        self.get_audit_log().write(self)
 
-    def __del__(self):
-        """Деструктор, сохраняет транзакции в файл при удалении объекта"""
-        print("Вызван деструктор класса RZDTransaction")
-        with open('transaction.txt', 'a') as f:
-            f.write('when {0} : operation {1} \n'.format(self.when, self.operation))
+    @classmethod
+    def get_audit_log(cls):
+        """Возвращает журнал транзакций; если журнал не задан, открывает transaction.txt в текущем каталоге"""
+        if cls.audit_log is None:
+            with cls._audit_log_lock:
+                if cls.audit_log is None:
+                    cls.audit_log = RZDAuditLog()
+        return cls.audit_log
+
+    @classmethod
+    def set_audit_log(cls, audit_log):
+        """Подключает журнал транзакций (например, RZDAuditLog с явным путём) или None; прежний журнал закрывается"""
+        with cls._audit_log_lock:
+            previous, cls.audit_log = cls.audit_log, audit_log
+        if previous is not None and previous is not audit_log:
+            previous.close()
+
+
+class TransactionQueue:
+    """Очередь транзакций объекта на deque с ограничением длины"""
+
+    # Политики переполнения: вытеснить самую старую транзакцию, отбросить новую, вызвать исключение
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    RAISE = 'raise'
+    default_maxlen = 10000  # Ограничение длины новых очередей (None - без ограничения)
+    default_overflow = DROP_OLDEST
+
+    __slots__ = ('_items', 'maxlen', 'overflow', 'dropped')
+
+    def __init__(self, items=(), maxlen=None, overflow=None):
+        """Инициализирует атрибуты maxlen(наибольшая длина), overflow(политика переполнения)
+        и dropped(кол-во потерянных транзакций)"""
+        self.maxlen = self.default_maxlen if maxlen is None else maxlen
+        self.overflow = self.default_overflow if overflow is None else overflow
+        self.dropped = 0
+        self._items = collections.deque()
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def append(self, item):
+        """Добавляет транзакцию в конец очереди с учётом политики переполнения"""
+        if self.maxlen is not None and len(self._items) >= self.maxlen:
+            if self.overflow == self.RAISE:
+                raise TransactionQueueOverflowError(self.maxlen)
+            self.dropped += 1
+            if self.overflow == self.DROP_NEWEST:
+                return
+            self._items.popleft()
+        self._items.append(item)
 
+    def popleft(self):
+        """Извлекает транзакцию из начала очереди"""
+        return self._items.popleft()
 
-class WorkerRZD:
+    def drain(self):
+        """Генератор, извлекающий транзакции из начала очереди, пока она не опустеет"""
+        items = self._items
+        while items:
+            yield items.popleft()
+
+
+class EntityRZD:
+    """Базовый класс сущностей ж.д. вокзала: атрибуты хранятся в слотах, а не в словаре экземпляра"""
+
+    __slots__ = ('__queue',)
+    _state_names = {}  # Класс -> имена слотов (с учётом искажения имён), составляющих состояние объекта
+
+    @classmethod
+    def _slot_names(cls):
+        """Возвращает имена слотов класса и его предков в том виде, в каком они хранятся в pickle"""
+        names = EntityRZD._state_names.get(cls)
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                for slot in klass.__dict__.get('__slots__', ()):
+                    if slot.startswith('__') and not slot.endswith('__'):
+                        slot = '_' + klass.__name__.lstrip('_') + slot
+                    names.append(slot)
+            names = EntityRZD._state_names[cls] = tuple(names)
+        return names
+
+    def __getstate__(self):
+        """Возвращает состояние словарём, как у объектов, сохранённых до перехода на слоты"""
+        state = {}
+        for name in self._slot_names():
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        """Восстанавливает состояние из словаря, в том числе из файлов старого формата"""
+        for name, value in state.items():
+            if name.endswith('__queue'):
+                # раньше очередь транзакций была у каждого класса своя, создавалась всегда и была списком
+                if not value:
+                    continue
+                name = '_EntityRZD__queue'
+                if not isinstance(value, TransactionQueue):
+                    value = TransactionQueue(value)
+            setattr(self, name, value)
+
+    # Свойства
+    def queue(self):
+        """Геттер очереди транзакций, создаёт её при первом обращении"""
+        try:
+            return self.__queue
+        except AttributeError:
+            self.__queue = TransactionQueue()
+            return self.__queue
+
+    queue = property(queue)
+
+    def iter_transactions(self):
+        """Генератор, извлекающий транзакции из очереди объекта по одной"""
+        try:
+            queue = self.__queue
+        except AttributeError:
+            return
+        yield from queue.drain()
+
+    @Timer
+    @Count
+    def get_transaction(self):
+        """Удаляет из очереди объекта транзакции и выводит их (в файл они попадают через журнал транзакций)"""
+        for item in self.iter_transactions():
+            logger.info('when %s : operation %s', item.when, item.operation)
+
+
+class WorkerRZD(EntityRZD):
     """Модель работника ж.д. вокзала"""
 
+    __slots__ = ('__surname', '__name', '__patronymic', '__year_of_birth', '__year_of_employment', '__seniority',
+                 '__position', '__gender', '__address', '__city', '__phone', '__worker_id')
+
     def __init__(self, surname, name, patronymic, year_of_birth, year_of_employment,
-                 seniority, position, gender, address, city, phone):
-        """Инициализирует приватные атрибуты"""
+                 seniority, position, gender, address, city, phone, worker_id=None):
+        """Инициализирует приватные атрибуты; worker_id - ключ работника в базе"""
         self.__surname = surname  # Фамилия
         self.__name = name  # Имя
         self.__patronymic = patronymic  # Отчество
@@ -359,20 +3580,37 @@ class WorkerRZD:
         self.__address = address  # Адрес
         self.__city = city  # Город
         self.__phone = phone  # Телефон
-        self.__queue = []  # Очередь транзакций
+        self.__worker_id = worker_id  # Суррогатный ключ, не меняется после назначения
+
+    def __setstate__(self, state):
+        """Восстанавливает состояние; у работников, сохранённых до появления ключей, ключа нет"""
+        super().__setstate__(state)
+        if '_WorkerRZD__worker_id' not in state:
+            self.__worker_id = None
 
     # Свойства
     def name(self, val):
         """Сеттер имени"""
         self.__name = val
 
+    def worker_id(self, val):
+        """Сеттер ключа работника: ключ назначается один раз, иначе вызывает исключение"""
+        if not isinstance(val, int):
+            logger.info("Произошла генерация исключения!")
+            raise InvalidTypeError(val)
+        elif self.__worker_id is not None:
+            logger.info("Произошла генерация исключения!")
+            raise InvalidValueError(val)
+        else:
+            self.__worker_id = val
+
     def seniority(self, val):
         """Сеттер стажа, проверяет валидность значения и устанавливает его, иначе вызывает исключение"""
         if not isinstance(val, int):
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidTypeError(val)
         elif val < 0:
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidValueError(val)
         else:
             self.__seniority = val
@@ -388,7 +3626,7 @@ class WorkerRZD:
     address = property(lambda self: self.__address)
     city = property(lambda self: self.__city)
     phone = property(lambda self: self.__phone)
-    queue = property(lambda self: self.__queue)
+    worker_id = property(lambda self: self.__worker_id, worker_id)
 
     @Timer
     @Count
@@ -396,7 +3634,7 @@ class WorkerRZD:
         """Отображает начало выполнения служебных обязанностей работником"""
         time.sleep(1)  # Для тестов
         action = f'{self.position} {self.name.title()} сейчас работает!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -404,23 +3642,15 @@ class WorkerRZD:
     def end_work(self):
         """Отображает конец выполнения служебных обязанностей работником"""
         action = f'{self.position} {self.name.title()} закончил работу!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
-    @Timer
-    @Count
-    def get_transaction(self):
-        """Удаляет из очереди объекта транзакции, способствует вызову деструктора и записи в файл"""
-        for i in range(len(self.queue)):
-            item = self.queue.pop(0)
-            print('when {0} : operation {1}'.format(item.when, item.operation))
-
     @Timer
     @Count
     def __show_info(self):
         """Приватный метод вывода информации"""
         action = f'Работник {self.name.title()}!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -451,12 +3681,14 @@ class WorkerRZD:
 
     def __del__(self):
         """Деструктор класса WorkerRZD"""
-        print("Вызван деструктор класса WorkerRZD")
+        logger.debug("Вызван деструктор класса WorkerRZD")
 
 
 class TrainDriver(WorkerRZD):
     """Класс потомок работника: машинист"""
 
+    __slots__ = ('duties', 'salary')
+
     def __init__(self, surname, name, patronymic, year_of_birth, year_of_employment,
                  seniority, position, gender, address, city, phone, duties=None, salary=36500):
         """Вызывает конструктор родительского класса и дополняет его, инициализирует атрибуты"""
@@ -471,7 +3703,7 @@ class TrainDriver(WorkerRZD):
         """Определяет обязанности"""
         self.duties = duties
         action = f'Обязанности {self.position}а {self.name.title()}а изменены на "{duties}"!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -479,7 +3711,7 @@ class TrainDriver(WorkerRZD):
     def give_paycheck(self):
         """Выдаёт зарплату"""
         action = f'{self.position} {self.name.title()} получил зарплату!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -488,7 +3720,7 @@ class TrainDriver(WorkerRZD):
         """Показывает информацию о работнике"""
         action = "Работник: {0}\t Должность: {1}\t Стаж: {2}\t Зарплата: {3}\t " \
                  "Обязанности: {4}".format(self.name, self.position, self.seniority, self.salary, self.duties)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -498,13 +3730,15 @@ class TrainDriver(WorkerRZD):
         self.seniority += 1
         self.salary *= 1.2
         action = f"Стаж {self.position}а {self.name.title()}а увеличен, зарплата повышена!"
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
 
 class TrainConductor(WorkerRZD):
     """Класс потомок работника: проводник"""
 
+    __slots__ = ('duties', 'salary')
+
     def __init__(self, surname, name, patronymic, year_of_birth, year_of_employment,
                  seniority, position, gender, address, city, phone, duties=None, salary=25000):
         """Вызывает конструктор родительского класса и дополняет его, инициализирует атрибуты"""
@@ -519,7 +3753,7 @@ class TrainConductor(WorkerRZD):
         """Определяет обязанности"""
         self.duties = duties
         action = f'Обязанности {self.position}а {self.name.title()}а изменены на "{duties}"!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -527,7 +3761,7 @@ class TrainConductor(WorkerRZD):
     def give_paycheck(self):
         """Выдаёт зарплату"""
         action = f'{self.position} {self.name.title()} получил зарплату!'
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -536,7 +3770,7 @@ class TrainConductor(WorkerRZD):
         """Показывает информацию о работнике"""
         action = "Работник: {0}\t Должность: {1}\t Стаж: {2}\t Зарплата: {3}\t " \
                  "Обязанности: {4}".format(self.name, self.position, self.seniority, self.salary, self.duties)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -546,7 +3780,7 @@ class TrainConductor(WorkerRZD):
         self.seniority += 1
         self.salary *= 1.1
         action = f"Стаж {self.position}а {self.name.title()}а увеличен, зарплата повышена!"
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
 
@@ -568,17 +3802,25 @@ class PersistenceWorkerRZD:
 
     def __del__(self):
         """Деструктор класса PersistenceWorkerRZD"""
-        print("Вызван деструктор класса PersistenceWorkerRZD")
+        logger.debug("Вызван деструктор класса PersistenceWorkerRZD")
 
 
-class TrainTimetable:
+class TrainTimetable(EntityRZD):
     """Модель расписания движения поездов"""
 
+    __slots__ = ('__number_of_train', '__train', '__trains', '__date_of_departure', '__time_of_departure',
+                 '__place_of_departure', '__date_of_arrival', '__time_of_arrival', '__place_of_arrival', '__route',
+                 '__ticket_price')
+
     def __init__(self, date_of_departure, time_of_departure, place_of_departure,
                  date_of_arrival, time_of_arrival, place_of_arrival, route, ticket_price,
-                 number, release_year=None, number_of_carriages=None, type_of_train=None):
-        """Инициализирует приватные атрибуты"""
-        self.__train = Train(number, release_year, number_of_carriages, type_of_train)  # Поезд
+                 number, release_year=None, number_of_carriages=None, type_of_train=None, train=None):
+        """Инициализирует приватные атрибуты; train - уже существующий поезд с этим номером"""
+        if train is None:
+            train = Train(number, release_year, number_of_carriages, type_of_train)
+        self.__number_of_train = train.number  # Номер поезда - ключ поезда в базе
+        self.__train = train  # Собственный поезд, если расписание не привязано к таблице поездов базы
+        self.__trains = None  # Таблица поездов базы, по которой номер поезда разрешается в поезд
         self.__date_of_departure = date_of_departure  # Дата отправления
         self.__time_of_departure = time_of_departure  # Время отправления
         self.__place_of_departure = place_of_departure  # Место отправления
@@ -587,21 +3829,57 @@ class TrainTimetable:
         self.__place_of_arrival = place_of_arrival  # Место прибытия
         self.__route = route  # Маршрут (начальный и конечный пункты назначения, основные узловые станции)
         self.__ticket_price = ticket_price  # Стоимость билета
-        self.__queue = []  # Очередь транзакций
+
+    def __getstate__(self):
+        """Сохраняет состояние без ссылки на таблицу поездов базы"""
+        state = super().__getstate__()
+        state.pop('_TrainTimetable__trains', None)
+        return state
+
+    def __setstate__(self, state):
+        """Восстанавливает состояние; расписания старого формата получают номер поезда из своего поезда.
+        Привязка к таблице поездов при откате изменений сохраняется"""
+        super().__setstate__(state)
+        if not hasattr(self, '_TrainTimetable__trains'):
+            self.__trains = None
+        if '_TrainTimetable__number_of_train' not in state:
+            self.__number_of_train = self.__train.number
+
+    def bind_trains(self, trains):
+        """Привязывает расписание к таблице поездов базы; возвращает True, если собственная копия
+        поезда оказалась лишней и была удалена"""
+        self.__trains = trains
+        if self.__train is not None and self.__number_of_train in trains:
+            self.__train = None
+            return True
+        return False
+
+    def keep_train(self):
+        """Сохраняет текущий поезд собственной копией: она остаётся у расписания после удаления поезда из базы"""
+        self.__train = self.train
 
     # Свойства
+    def train(self):
+        """Геттер поезда: общий поезд из базы, иначе собственный"""
+        if self.__trains is not None and self.__number_of_train in self.__trains:
+            return self.__trains[self.__number_of_train]
+        if self.__train is None:
+            self.__train = Train(self.__number_of_train, None, None, None)
+        return self.__train
+
     def ticket_price(self, val):
         """Сеттер цены билета, проверяет валидность значения и устанавливает его, иначе вызывает исключение"""
         if not isinstance(val, int):
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidTypeError(val)
         elif val < 0:
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidValueError(val)
         else:
             self.__ticket_price = val
 
-    train = property(lambda self: self.__train)
+    number_of_train = property(lambda self: self.__number_of_train)
+    train = property(train)
     date_of_departure = property(lambda self: self.__date_of_departure)
     time_of_departure = property(lambda self: self.__time_of_departure)
     place_of_departure = property(lambda self: self.__place_of_departure)
@@ -610,7 +3888,6 @@ class TrainTimetable:
     place_of_arrival = property(lambda self: self.__place_of_arrival)
     route = property(lambda self: self.__route)
     ticket_price = property(lambda self: self.__ticket_price, ticket_price)
-    queue = property(lambda self: self.__queue)
 
     @Timer
     @Count
@@ -620,17 +3897,9 @@ class TrainTimetable:
                  "Стоимость билета: {6} руб.".format(self.train, self.route, self.date_of_departure,
                                                      self.time_of_departure, self.date_of_arrival,
                                                      self.time_of_arrival, self.ticket_price)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
-    @Timer
-    @Count
-    def get_transaction(self):
-        """Удаляет из очереди объекта транзакции, способствует вызову деструктора и записи в файл"""
-        for i in range(len(self.queue)):
-            item = self.queue.pop(0)
-            print('when {0} : operation {1}'.format(item.when, item.operation))
-
     def __add__(self, value):
         """Перегрузка оператора сложения"""
         self.ticket_price += value
@@ -653,7 +3922,7 @@ class TrainTimetable:
 
     def __del__(self):
         """Деструктор класса TrainTimetable"""
-        print("Вызван деструктор класса TrainTimetable")
+        logger.debug("Вызван деструктор класса TrainTimetable")
 
 
 class PersistenceTrainTimetable:
@@ -674,19 +3943,20 @@ class PersistenceTrainTimetable:
 
     def __del__(self):
         """Деструктор класса PersistenceTrainTimetable"""
-        print("Вызван деструктор класса PersistenceTrainTimetable")
+        logger.debug("Вызван деструктор класса PersistenceTrainTimetable")
 
 
-class Train:
+class Train(EntityRZD):
     """Модель поезда"""
 
+    __slots__ = ('__number', '__release_year', '__number_of_carriages', '__type_of_train')
+
     def __init__(self, number, release_year, number_of_carriages, type_of_train):
         """Инициализирует приватные атрибуты"""
         self.__number = number  # Номер
         self.__release_year = release_year  # Год выпуска
         self.__number_of_carriages = number_of_carriages  # Кол-во вагонов
         self.__type_of_train = type_of_train  # Тип поезда (общий, скоростной, высокоскоростной)
-        self.__queue = []  # Очередь транзакций
 
     # Свойства
     def number(self, val):
@@ -696,10 +3966,10 @@ class Train:
     def number_of_carriages(self, val):
         """Сеттер кол-ва вагонов, проверяет валидность значения и устанавливает его, иначе вызывает исключение"""
         if not isinstance(val, int):
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidTypeError(val)
         elif val < 0:
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidValueError(val)
         else:
             self.__number_of_carriages = val
@@ -708,14 +3978,13 @@ class Train:
     release_year = property(lambda self: self.__release_year)
     number_of_carriages = property(lambda self: self.__number_of_carriages, number_of_carriages)
     type_of_train = property(lambda self: self.__type_of_train)
-    queue = property(lambda self: self.__queue)
 
     @Timer
     @Count
     def move(self):
         """Отображает начало движения поезда"""
         action = "{0} поезд номер {1} движется!".format(self.type_of_train, self.number)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
     @Timer
@@ -723,17 +3992,9 @@ class Train:
     def stop(self):
         """Отображает остановку движения поезда"""
         action = "{0} поезд номер {1} стоит!".format(self.type_of_train, self.number)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
-    @Timer
-    @Count
-    def get_transaction(self):
-        """Удаляет из очереди объекта транзакции, способствует вызову деструктора и записи в файл"""
-        for i in range(len(self.queue)):
-            item = self.queue.pop(0)
-            print('when {0} : operation {1}'.format(item.when, item.operation))
-
     def __add__(self, value):
         """Перегрузка оператора сложения"""
         self.number_of_carriages += value
@@ -756,7 +4017,7 @@ class Train:
 
     def __del__(self):
         """Деструктор класса Train"""
-        print("Вызван деструктор класса Train")
+        logger.debug("Вызван деструктор класса Train")
 
 
 class PersistenceTrain:
@@ -777,40 +4038,97 @@ class PersistenceTrain:
 
     def __del__(self):
         """Деструктор класса PersistenceTrain"""
-        print("Вызван деструктор класса PersistenceTrain")
+        logger.debug("Вызван деструктор класса PersistenceTrain")
 
 
-class TrainBrigade:
+class TrainBrigade(EntityRZD):
     """Модель бригады поезда"""
 
+    __slots__ = ('__brigade_number', '__number_of_train', '__train', '__trains', '__rzd_workers', '__brigade_id')
+
     def __init__(self, brigade_number, surname, name, position,
                  number_of_train, release_year=None, number_of_carriages=None, type_of_train=None,
                  patronymic=None, year_of_birth=None, year_of_employment=None,
-                 seniority=None, gender=None, address=None, city=None, phone=None):
-        """Инициализирует приватные атрибуты"""
+                 seniority=None, gender=None, address=None, city=None, phone=None, train=None, brigade_id=None):
+        """Инициализирует приватные атрибуты; train - уже существующий поезд с этим номером,
+        brigade_id - ключ бригады в базе"""
+        self.__brigade_id = brigade_id  # Суррогатный ключ, не меняется после назначения
         self.__brigade_number = brigade_number  # Номер бригады
-        self.__train = Train(number_of_train, release_year, number_of_carriages, type_of_train)  # Поезд
+        if train is None:
+            train = Train(number_of_train, release_year, number_of_carriages, type_of_train)
+        self.__number_of_train = train.number  # Номер поезда - ключ поезда в базе
+        self.__train = train  # Собственный поезд, если бригада не привязана к таблице поездов базы
+        self.__trains = None  # Таблица поездов базы, по которой номер поезда разрешается в поезд
         self.__rzd_workers = [WorkerRZD(surname, name, patronymic, year_of_birth, year_of_employment,
                                         seniority, position, gender, address, city, phone)]  # Работники ж.д. вокзала
         # (машинисты, техники, проводники и обслуживающий персонал)
-        self.__queue = []  # Очередь транзакций
+
+    def __getstate__(self):
+        """Сохраняет состояние без ссылки на таблицу поездов базы"""
+        state = super().__getstate__()
+        state.pop('_TrainBrigade__trains', None)
+        return state
+
+    def __setstate__(self, state):
+        """Восстанавливает состояние; у бригад, сохранённых до появления ключей, ключа нет, а номер поезда
+        бригады старого формата получают из своего поезда. Привязка к таблице поездов при откате сохраняется"""
+        super().__setstate__(state)
+        if not hasattr(self, '_TrainBrigade__trains'):
+            self.__trains = None
+        if '_TrainBrigade__brigade_id' not in state:
+            self.__brigade_id = None
+        if '_TrainBrigade__number_of_train' not in state:
+            self.__number_of_train = self.__train.number
 
     # Свойства
     def brigade_number(self, val):
         """Сеттер номера бригады, проверяет валидность значения и устанавливает его, иначе вызывает исключение"""
         if not isinstance(val, str):
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidTypeError(val)
         elif int(val) < 0:
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidValueError(val)
         else:
             self.__brigade_number = val
 
+    def brigade_id(self, val):
+        """Сеттер ключа бригады: ключ назначается один раз, иначе вызывает исключение"""
+        if not isinstance(val, int):
+            logger.info("Произошла генерация исключения!")
+            raise InvalidTypeError(val)
+        elif self.__brigade_id is not None:
+            logger.info("Произошла генерация исключения!")
+            raise InvalidValueError(val)
+        else:
+            self.__brigade_id = val
+
+    def bind_trains(self, trains):
+        """Привязывает бригаду к таблице поездов базы; возвращает True, если собственная копия
+        поезда оказалась лишней и была удалена"""
+        self.__trains = trains
+        if self.__train is not None and self.__number_of_train in trains:
+            self.__train = None
+            return True
+        return False
+
+    def keep_train(self):
+        """Сохраняет текущий поезд собственной копией: она остаётся у бригады после удаления поезда из базы"""
+        self.__train = self.train
+
+    def train(self):
+        """Геттер поезда: общий поезд из базы, иначе собственный"""
+        if self.__trains is not None and self.__number_of_train in self.__trains:
+            return self.__trains[self.__number_of_train]
+        if self.__train is None:
+            self.__train = Train(self.__number_of_train, None, None, None)
+        return self.__train
+
+    brigade_id = property(lambda self: self.__brigade_id, brigade_id)
     brigade_number = property(lambda self: self.__brigade_number, brigade_number)
-    train = property(lambda self: self.__train)
+    number_of_train = property(lambda self: self.__number_of_train)
+    train = property(train)
     rzd_workers = property(lambda self: self.__rzd_workers)
-    queue = property(lambda self: self.__queue)
 
     @Timer
     @Count
@@ -818,17 +4136,9 @@ class TrainBrigade:
         """Отображает информацию о бригаде поезда"""
         action = "Бригада №{0}, обслуживает поезд {1}. " \
                  "Работники: {2}".format(self.brigade_number, self.train, self.rzd_workers)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
-    @Timer
-    @Count
-    def get_transaction(self):
-        """Удаляет из очереди объекта транзакции, способствует вызову деструктора и записи в файл"""
-        for i in range(len(self.queue)):
-            item = self.queue.pop(0)
-            print('when {0} : operation {1}'.format(item.when, item.operation))
-
     def __add__(self, value):
         """Перегрузка оператора сложения"""
         self.brigade_number += value
@@ -851,7 +4161,7 @@ class TrainBrigade:
 
     def __del__(self):
         """Деструктор класса TrainBrigade"""
-        print("Вызван деструктор класса TrainBrigade")
+        logger.debug("Вызван деструктор класса TrainBrigade")
 
 
 class PersistenceTrainBrigade:
@@ -872,48 +4182,113 @@ class PersistenceTrainBrigade:
 
     def __del__(self):
         """Деструктор класса PersistenceTrainBrigade"""
-        print("Вызван деструктор класса PersistenceTrainBrigade")
+        logger.debug("Вызван деструктор класса PersistenceTrainBrigade")
 
 
-class TicketSalesSheet:
+class TicketSalesSheet(EntityRZD):
     """Модель ведомости продаж билетов"""
 
+    __slots__ = ('__sale_id', '__sale_datetime', '__passenger_fullname', '__passport', '__number_of_train',
+                 '__trip_number', '__timetables', '__number_of_tickets', '__benefits', '__price', '__seats',
+                 '__departure')
+
     def __init__(self, number_of_train, sale_datetime, passenger_fullname, passport, number_of_tickets, benefits, price,
                  date_of_departure=None, time_of_departure=None, place_of_departure=None,
                  date_of_arrival=None, time_of_arrival=None, place_of_arrival=None, route=None, ticket_price=None,
-                 release_year=None, number_of_carriages=None, type_of_train=None):
+                 release_year=None, number_of_carriages=None, type_of_train=None, sale_id=None, seats=None,
+                 departure=None):
         """Инициализирует приватные атрибуты"""
+        self.__sale_id = sale_id  # Номер продажи
         self.__sale_datetime = sale_datetime  # Дата и время продажи
         self.__passenger_fullname = passenger_fullname  # ФИО пассажира
         self.__passport = passport  # Паспортные данные
-        self.__trip_number = TrainTimetable(date_of_departure, time_of_departure, place_of_departure,
-                                            date_of_arrival, time_of_arrival, place_of_arrival, route, ticket_price,
-                                            number_of_train, release_year, number_of_carriages, type_of_train)  # Номер
+        self.__number_of_train = number_of_train  # Номер поезда - ключ расписания рейса в базе
+        self.__trip_number = None  # Собственное расписание рейса, если ведомость не привязана к базе
+        if any(value is not None for value in (date_of_departure, time_of_departure, place_of_departure,
+                                                date_of_arrival, time_of_arrival, place_of_arrival, route,
+                                                ticket_price, release_year, number_of_carriages, type_of_train)):
+            self.__trip_number = TrainTimetable(date_of_departure, time_of_departure, place_of_departure,
+                                                date_of_arrival, time_of_arrival, place_of_arrival, route,
+                                                ticket_price, number_of_train, release_year, number_of_carriages,
+                                                type_of_train)
+        self.__timetables = None  # Таблица расписаний базы, по которой номер поезда разрешается в расписание
         self.__number_of_tickets = number_of_tickets  # Кол-во билетов
         self.__benefits = benefits  # Наличие льгот (пенсионеры, дети-сироты и т.д.)
         self.__price = price  # Стоимость
-        self.__queue = []  # Очередь транзакций
+        self.__seats = None if seats is None else tuple(seats)  # Места (вагон, место) или None, если не назначены
+        self.__departure = departure  # Отправление рейса 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' или None, если оно неизвестно
+
+    def __getstate__(self):
+        """Сохраняет состояние без ссылки на таблицу расписаний базы"""
+        state = super().__getstate__()
+        state.pop('_TicketSalesSheet__timetables', None)
+        return state
+
+    def __setstate__(self, state):
+        """Восстанавливает состояние; ведомости старого формата получают номер поезда из своего расписания"""
+        super().__setstate__(state)
+        self.__timetables = None
+        if '_TicketSalesSheet__sale_id' not in state:
+            # у ведомостей, сохранённых до появления номеров продаж, номера нет
+            self.__sale_id = None
+        if '_TicketSalesSheet__seats' not in state:
+            # места назначаются ведомостям, сохранённым до появления учёта мест, при построении учёта
+            self.__seats = None
+        if '_TicketSalesSheet__departure' not in state:
+            # рейс назначается ведомостям прежнего формата при построении карт мест
+            self.__departure = None
+        if '_TicketSalesSheet__number_of_train' not in state:
+            self.__number_of_train = self.__trip_number.train.number
+
+    def bind_timetables(self, train_timetables):
+        """Привязывает ведомость к таблице расписаний базы; возвращает True, если собственная копия
+        расписания оказалась лишней и была удалена"""
+        self.__timetables = train_timetables
+        if self.__trip_number is not None and self.__number_of_train in train_timetables:
+            self.__trip_number = None
+            return True
+        return False
 
     # Свойства
+    def trip_number(self):
+        """Геттер расписания рейса: общее расписание из базы, иначе собственное"""
+        if self.__timetables is not None and self.__number_of_train in self.__timetables:
+            return self.__timetables[self.__number_of_train]
+        if self.__trip_number is None:
+            self.__trip_number = TrainTimetable(None, None, None, None, None, None, None, None,
+                                                self.__number_of_train)
+        return self.__trip_number
+
     def number_of_tickets(self, val):
         """Сеттер кол-ва билетов, проверяет валидность значения и устанавливает его, иначе вызывает исключение"""
         if not isinstance(val, int):
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidTypeError(val)
         elif val < 0:
-            print("Произошла генерация исключения!")
+            logger.info("Произошла генерация исключения!")
             raise InvalidValueError(val)
         else:
             self.__number_of_tickets = val
 
+    def seats(self, val):
+        """Сеттер мест: последовательность пар (вагон, место) или None"""
+        self.__seats = None if val is None else tuple(val)
+
+    def departure(self, val):
+        """Сеттер отправления рейса"""
+        self.__departure = val
+
+    sale_id = property(lambda self: self.__sale_id)
     sale_datetime = property(lambda self: self.__sale_datetime)
     passenger_fullname = property(lambda self: self.__passenger_fullname)
     passport = property(lambda self: self.__passport)
-    trip_number = property(lambda self: self.__trip_number)
+    number_of_train = property(lambda self: self.__number_of_train)
+    trip_number = property(trip_number)
     number_of_tickets = property(lambda self: self.__number_of_tickets, number_of_tickets)
     benefits = property(lambda self: self.__benefits)
     price = property(lambda self: self.__price)
-    queue = property(lambda self: self.__queue)
+    seats = property(lambda self: self.__seats, seats)
+    departure = property(lambda self: self.__departure, departure)
 
     @Timer
     @Count
@@ -923,17 +4298,9 @@ class TicketSalesSheet:
                  "Номер рейса: {3}\t Кол-во билетов: {4}\t Наличие льгот: {5}\t " \
                  "Стоимость: {6} руб.".format(self.sale_datetime, self.passenger_fullname, self.passport,
                                               self.trip_number, self.number_of_tickets, self.benefits, self.price)
-        print(action)
+        logger.info(action)
         self.queue.append(RZDTransaction(action))
 
-    @Timer
-    @Count
-    def get_transaction(self):
-        """Удаляет из очереди объекта транзакции, способствует вызову деструктора и записи в файл"""
-        for i in range(len(self.queue)):
-            item = self.queue.pop(0)
-            print('when {0} : operation {1}'.format(item.when, item.operation))
-
     def __add__(self, value):
         """Перегрузка оператора сложения"""
         self.number_of_tickets += value
@@ -956,7 +4323,7 @@ class TicketSalesSheet:
 
     def __del__(self):
         """Деструктор класса TicketSalesSheet"""
-        print("Вызван деструктор класса TicketSalesSheet")
+        logger.debug("Вызван деструктор класса TicketSalesSheet")
 
 
 class PersistenceTicketSalesSheet:
@@ -977,7 +4344,412 @@ class PersistenceTicketSalesSheet:
 
     def __del__(self):
         """Деструктор класса PersistenceTicketSalesSheet"""
-        print("Вызван деструктор класса PersistenceTicketSalesSheet")
+        logger.debug("Вызван деструктор класса PersistenceTicketSalesSheet")
+
+
+class SeatMap(EntityRZD):
+    """Модель карты мест рейса: битовая карта проданных мест каждого вагона поезда с заданным отправлением"""
+
+    __slots__ = ('__number_of_train', '__departure', '__maps')
+
+    def __init__(self, number_of_train, departure, maps=()):
+        """Инициализирует приватные атрибуты"""
+        self.__number_of_train = number_of_train  # Номер поезда
+        self.__departure = departure  # Отправление рейса 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' или None, если оно неизвестно
+        self.__maps = tuple(maps)  # Битовые карты вагонов (бит места установлен, если оно продано)
+
+    @staticmethod
+    def key_of(number_of_train, departure):
+        """Возвращает ключ карты мест рейса в таблице seat_maps"""
+        return repr((number_of_train, departure))
+
+    # Свойства
+    def maps(self, val):
+        """Сеттер карт вагонов: карты заменяются целиком, прежний кортеж остаётся в журнале отката"""
+        self.__maps = tuple(val)
+
+    number_of_train = property(lambda self: self.__number_of_train)
+    departure = property(lambda self: self.__departure)
+    maps = property(lambda self: self.__maps, maps)
+    key = property(lambda self: SeatMap.key_of(self.__number_of_train, self.__departure))
+
+    def __repr__(self):
+        """Выдает строковое представление объекта (карты мест рейса)"""
+        return "Карта мест поезда {0} ({1})".format(self.number_of_train, self.departure)
+
+
+class RecordCodec:
+    """Двоичный формат данных базы вместо pickle: сущности записываются по явным схемам с номерами версий.
+    При чтении создаются только известные типы, а сущности старых версий схем переводятся в текущую миграциями"""
+
+    MAGIC = b'RZC1'
+    # Теги значений
+    (NONE, FALSE, TRUE, INT8, INT32, INT64, BIG_INT, FLOAT, SHORT_STR, STR, BYTES, LIST, TUPLE, DICT, DATETIME, DATE,
+     ENTITY, SHORT_REF, REF, PARTITIONED, TIME, DECIMAL, RECORD) = range(23)
+    SHORT = struct.Struct('<BB')  # Тег и байт: короткое число, длина короткой строки или номер ранней ссылки
+    INT32_VALUE = struct.Struct('<Bi')
+    INT64_VALUE = struct.Struct('<Bq')
+    FLOAT_VALUE = struct.Struct('<Bd')
+    SIZED = struct.Struct('<BI')  # Тег и длина строки (байтов), кол-во элементов контейнера или номер ссылки
+    ENTITY_HEADER = struct.Struct('<BBBB')  # Тег, код типа, версия схемы, кол-во полей
+    # Сущность с тегом RECORD записывается заголовком, формой - байтом вида на каждое поле, - блоком полей
+    # фиксированной ширины, разбираемым одним struct по форме, затем байтами новых строк и прочими значениями.
+    # Виды полей: n - None, f/t - False/True, b/i/q - число, s/S - новая строка (длина байтом или 4 байтами),
+    # r/R - ссылка на строку или сущность, v - значение, записанное после строк с тегом
+    RECORD_FIELDS = {'n': '', 'f': '', 't': '', 'b': 'b', 'i': 'i', 'q': 'q', 's': 'B', 'S': 'I', 'r': 'B', 'R': 'I',
+                     'v': ''}
+    WORKER_FIELDS = ('surname', 'name', 'patronymic', 'year_of_birth', 'year_of_employment', 'seniority',
+                     'position', 'gender', 'address', 'city', 'phone')
+    # Схемы сущностей: код типа -> (класс, текущая версия схемы, поля)
+    SCHEMAS = {
+        1: (WorkerRZD, 2, WORKER_FIELDS + ('worker_id',)),
+        2: (TrainDriver, 2, WORKER_FIELDS + ('duties', 'salary', 'worker_id')),
+        3: (TrainConductor, 2, WORKER_FIELDS + ('duties', 'salary', 'worker_id')),
+        4: (Train, 1, ('number', 'release_year', 'number_of_carriages', 'type_of_train')),
+        5: (TrainTimetable, 2, ('number_of_train', 'train', 'date_of_departure', 'time_of_departure',
+                                'place_of_departure', 'date_of_arrival', 'time_of_arrival', 'place_of_arrival', 'route',
+                                'ticket_price')),
+        6: (TrainBrigade, 3, ('brigade_number', 'number_of_train', 'train', 'rzd_workers', 'brigade_id')),
+        7: (TicketSalesSheet, 3, ('sale_id', 'sale_datetime', 'passenger_fullname', 'passport', 'number_of_train',
+                                  'trip_number', 'number_of_tickets', 'benefits', 'price', 'seats', 'departure')),
+        8: (SeatMap, 1, ('number_of_train', 'departure', 'maps')),
+    }
+    # Миграции: (код типа, версия) -> функция, переводящая список значений полей этой версии в следующую.
+    # При изменении полей сущности версия её схемы увеличивается, а сюда добавляется миграция с прежней
+    MIGRATIONS = {
+        # у ведомостей версии 1 мест ещё не было: они назначаются при построении учёта мест
+        (7, 1): lambda values: values + [None],
+        # у ведомостей версии 2 не было рейса: он назначается при построении карт мест
+        (7, 2): lambda values: values + [None],
+        # работники и бригады версии 1 хранились под именем и номером: ключи назначаются при открытии базы
+        (1, 1): lambda values: values + [None],
+        (2, 1): lambda values: values + [None],
+        (3, 1): lambda values: values + [None],
+        (6, 1): lambda values: values + [None],
+        # расписания версии 1 и бригады версии 2 хранили поезд целиком: номер берётся из него,
+        # а собственная копия поезда отбрасывается при привязке к таблице поездов
+        (5, 1): lambda values: [values[0].number] + values,
+        (6, 2): lambda values: values[:1] + [values[1].number] + values[1:],
+    }
+    _entities = {}  # Класс или код типа -> (класс, код типа, версия, функция получения полей, слоты полей, прочие слоты)
+    _functions = None  # Функции записи и чтения значения
+
+    @classmethod
+    def encode(cls, value):
+        """Сериализует значение; повторяющиеся строки и общие объекты записываются один раз, далее - ссылкой"""
+        out = bytearray(cls.MAGIC)
+        cls._codec()[0](value, out, {})
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data):
+        """Восстанавливает значение, записанное encode"""
+        if data[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('unknown record format')
+        value, position = cls._codec()[1](data, len(cls.MAGIC), [])
+        if position != len(data):
+            raise ValueError('unexpected data after record')
+        return value
+
+    @classmethod
+    def _entity(cls, key):
+        """Возвращает схему сущности по её классу или коду типа"""
+        entity = cls._entities.get(key)
+        if entity is None:
+            code = key if key in cls.SCHEMAS else next(
+                (code for code, schema in cls.SCHEMAS.items() if schema[0] is key), None)
+            if code is None:
+                if isinstance(key, int):
+                    raise ValueError('unknown entity type {0}'.format(key))
+                raise TypeError('value of type {0} cannot be encoded'.format(key.__name__))
+            klass, version, fields = cls.SCHEMAS[code]
+            slots = klass._slot_names()
+            names = tuple(next(slot for slot in slots if slot == field or slot.endswith('__' + field))
+                          for field in fields)
+            # слоты вне схемы (ссылка на таблицу расписаний базы) при чтении пусты; очередь создаётся при обращении
+            extra = tuple(slot for slot in slots if slot not in names and not slot.endswith('__queue'))
+            entity = klass, code, version, operator.attrgetter(*names), names, extra
+            cls._entities[klass] = cls._entities[code] = entity
+        return entity
+
+    @classmethod
+    def _codec(cls):
+        """Возвращает функции записи и чтения значения, создавая их при первом вызове"""
+        if cls._functions is None:
+            cls._functions = cls._build_functions()
+        return cls._functions
+
+    @classmethod
+    def _build_functions(cls):
+        (NONE, FALSE, TRUE, INT8, INT32, INT64, BIG_INT, FLOAT, SHORT_STR, STR, BYTES, LIST, TUPLE, DICT, DATETIME,
+         DATE, ENTITY, SHORT_REF, REF, PARTITIONED, TIME, DECIMAL, RECORD) = range(23)
+        short, sized = cls.SHORT.pack, cls.SIZED.pack
+        int32_value, int64_value, float_value = cls.INT32_VALUE.pack, cls.INT64_VALUE.pack, cls.FLOAT_VALUE.pack
+        entity_header, entity_schema = cls.ENTITY_HEADER.pack, cls._entity
+        unpack_byte, unpack_length = struct.Struct('<b').unpack_from, struct.Struct('<I').unpack_from
+        unpack_int32, unpack_int64 = struct.Struct('<i').unpack_from, struct.Struct('<q').unpack_from
+        unpack_entity_header = cls.ENTITY_HEADER.unpack_from
+        migrations, entities = cls.MIGRATIONS, cls._entities
+        record_fields, constants = cls.RECORD_FIELDS, {'n': None, 'f': False, 't': True}
+        layouts = {}  # Заголовок и форма сущности с тегом RECORD -> её разбор (см. record_layout)
+
+        def record_layout(key):
+            """Возвращает разбор сущности с тегом RECORD по её заголовку и форме: класс, слоты вне схемы, struct
+            блока полей, номера в блоке длин новых строк и ссылок, поля блока, поля-константы с их значениями,
+            поля с тегом и (код типа, версия, кол-во полей), если сущность записана прежней версией схемы,
+            иначе None. Поля задаются слотами, а у прежней версии схемы - номерами"""
+            tag, code, version, count = unpack_entity_header(key)
+            kinds = key[cls.ENTITY_HEADER.size:].decode('ascii')
+            klass, code, current, getter, names, extra = entity_schema(code)
+            old = None
+            if version != current or count != len(names):
+                if version >= current:
+                    raise ValueError('unsupported schema version {0} of {1}'.format(version, klass.__name__))
+                # значения полей прежней версии собираются списком и переводятся в текущую миграциями
+                old, names = (code, version, count), range(count)
+            fixed = [index for index, kind in enumerate(kinds) if record_fields[kind]]
+            layout = layouts[key] = (
+                klass, extra, struct.Struct('<' + ''.join(record_fields[kind] for kind in kinds)),
+                tuple(number for number, index in enumerate(fixed) if kinds[index] in 'sS'),
+                tuple(number for number, index in enumerate(fixed) if kinds[index] in 'rR'),
+                tuple(names[index] for index in fixed),
+                tuple((names[index], constants[kind]) for index, kind in enumerate(kinds) if kind in constants),
+                tuple(names[index] for index, kind in enumerate(kinds) if kind == 'v'), old)
+            return layout
+
+        def reference(value, out):
+            out += short(SHORT_REF, value) if value < 256 else sized(REF, value)
+
+        def encode_value(value, out, memo):
+            """Дописывает значение в out; memo - номера ссылок на уже записанные строки и сущности"""
+            kind = type(value)
+            if kind is str:
+                if value in memo:
+                    reference(memo[value], out)
+                    return
+                memo[value] = len(memo)
+                data = value.encode('utf-8')
+                out += short(SHORT_STR, len(data)) if len(data) < 256 else sized(STR, len(data))
+                out += data
+            elif kind is int and -(1 << 63) <= value < (1 << 63):
+                if -128 <= value < 128:
+                    out += short(INT8, value & 0xFF)
+                elif -(1 << 31) <= value < (1 << 31):
+                    out += int32_value(INT32, value)
+                else:
+                    out += int64_value(INT64, value)
+            elif value is None:
+                out.append(NONE)
+            elif kind is bool:
+                out.append(TRUE if value else FALSE)
+            elif kind is float:
+                out += float_value(FLOAT, value)
+            elif kind is dict:
+                out += sized(DICT, len(value))
+                for key, item in value.items():
+                    encode_value(key, out, memo)
+                    encode_value(item, out, memo)
+            elif kind is list or kind is tuple:
+                out += sized(LIST if kind is list else TUPLE, len(value))
+                for item in value:
+                    encode_value(item, out, memo)
+            elif kind is int or kind is datetime or kind is date or kind is bytes or kind is time_of_day or \
+                    kind is Decimal:
+                if kind is int:
+                    tag, data = BIG_INT, value.to_bytes(value.bit_length() // 8 + 1, 'little', signed=True)
+                elif kind is bytes:
+                    tag, data = BYTES, value
+                elif kind is Decimal:
+                    # десятичное число записывается строкой: двоичное float исказило бы копейки
+                    tag, data = DECIMAL, str(value).encode('ascii')
+                else:
+                    tag = DATETIME if kind is datetime else DATE if kind is date else TIME
+                    data = value.isoformat().encode('ascii')
+                out += sized(tag, len(data))
+                out += data
+            elif kind is PartitionedTable:
+                out.append(PARTITIONED)
+                encode_value(value.__getstate__(), out, memo)
+            else:
+                klass, code, version, getter, names, extra = entity_schema(kind)
+                if id(value) in memo:
+                    reference(memo[id(value)], out)
+                    return
+                memo[id(value)] = len(memo)
+                try:
+                    values = getter(value)
+                except AttributeError:
+                    # объект из файла старого формата может не иметь части атрибутов
+                    values = [getattr(value, name, None) for name in names]
+                # простые поля записываются в блок фиксированной ширины, новые строки - за ним, прочие значения -
+                # после строк: при чтении ссылки нумеруются в том же порядке
+                shape, fields, strings, tagged = bytearray(), [], bytearray(), []
+                for item in values:
+                    kind = type(item)
+                    if kind is str:
+                        index = memo.get(item)
+                        if index is None:
+                            memo[item] = len(memo)
+                            data = item.encode('utf-8')
+                            shape.append(115 if len(data) < 256 else 83)  # s, S
+                            fields.append(len(data))
+                            strings += data
+                        else:
+                            shape.append(114 if index < 256 else 82)  # r, R
+                            fields.append(index)
+                    elif kind is int and -(1 << 63) <= item < (1 << 63):
+                        shape.append(98 if -128 <= item < 128 else 105 if -(1 << 31) <= item < (1 << 31) else 113)
+                        fields.append(item)
+                    elif item is None:
+                        shape.append(110)  # n
+                    elif kind is bool:
+                        shape.append(116 if item else 102)  # t, f
+                    else:
+                        shape.append(118)  # v
+                        tagged.append(item)
+                key = entity_header(RECORD, code, version, len(shape)) + shape
+                layout = layouts.get(key) or record_layout(key)
+                out += key
+                out += layout[2].pack(*fields)
+                out += strings
+                for item in tagged:
+                    encode_value(item, out, memo)
+
+        def decode_value(data, position, references):
+            """Читает значение с позиции; возвращает его и позицию следующего значения.
+            references - строки и сущности в порядке их первой записи"""
+            tag = data[position]
+            if tag == SHORT_STR or tag == STR:
+                if tag == SHORT_STR:
+                    start = position + 2
+                    end = start + data[position + 1]
+                else:
+                    start = position + 5
+                    end = start + unpack_length(data, position + 1)[0]
+                value = str(data[start:end], 'utf-8')
+                references.append(value)
+                return value, end
+            if tag == SHORT_REF:
+                return references[data[position + 1]], position + 2
+            if tag == INT8:
+                return unpack_byte(data, position + 1)[0], position + 2
+            if tag == INT32:
+                return unpack_int32(data, position + 1)[0], position + 5
+            if tag == INT64:
+                return unpack_int64(data, position + 1)[0], position + 9
+            if tag == NONE:
+                return None, position + 1
+            if tag == RECORD:
+                end = position + 4 + data[position + 3]
+                key = bytes(data[position:end])
+                klass, extra, fields, strings, refs, names, constants, tagged, old = \
+                    layouts.get(key) or record_layout(key)
+                obj = klass.__new__(klass)
+                # ссылки нумеруются в порядке записи: сущность, новые строки её блока, затем значения с тегом
+                references.append(obj)
+                values = list(fields.unpack_from(data, end))
+                position = end + fields.size
+                for index in strings:
+                    end = position + values[index]
+                    values[index] = value = str(data[position:end], 'utf-8')
+                    references.append(value)
+                    position = end
+                for index in refs:
+                    values[index] = references[values[index]]
+                if old is None:
+                    for name, value in zip(names, values):
+                        setattr(obj, name, value)
+                    for name, value in constants:
+                        setattr(obj, name, value)
+                    for name in tagged:
+                        value, position = decode_value(data, position, references)
+                        setattr(obj, name, value)
+                else:
+                    code, version, count = old
+                    fixed, values = values, [None] * count
+                    for index, value in zip(names, fixed):
+                        values[index] = value
+                    for index, value in constants:
+                        values[index] = value
+                    for index in tagged:
+                        values[index], position = decode_value(data, position, references)
+                    klass, code, current, getter, names, extra = entity_schema(code)
+                    while version < current:
+                        values = migrations[(code, version)](values)
+                        version += 1
+                    for name, value in zip(names, values):
+                        setattr(obj, name, value)
+                for name in extra:
+                    setattr(obj, name, None)
+                return obj, position
+            if tag == ENTITY:
+                tag, code, version, count = unpack_entity_header(data, position)
+                klass, code, current, getter, names, extra = entities.get(code) or entity_schema(code)
+                obj = klass.__new__(klass)
+                # ссылки нумеруются в порядке начала записи сущностей, как при сериализации
+                references.append(obj)
+                position += 4
+                if version == current and count == len(names):
+                    for name in names:
+                        value, position = decode_value(data, position, references)
+                        setattr(obj, name, value)
+                else:
+                    if version >= current:
+                        raise ValueError('unsupported schema version {0} of {1}'.format(version, klass.__name__))
+                    values = []
+                    for _ in range(count):
+                        value, position = decode_value(data, position, references)
+                        values.append(value)
+                    while version < current:
+                        values = migrations[(code, version)](values)
+                        version += 1
+                    for name, value in zip(names, values):
+                        setattr(obj, name, value)
+                for name in extra:
+                    setattr(obj, name, None)
+                return obj, position
+            if tag == REF:
+                return references[unpack_length(data, position + 1)[0]], position + 5
+            if tag == FALSE or tag == TRUE:
+                return tag == TRUE, position + 1
+            if tag == FLOAT:
+                return cls.FLOAT_VALUE.unpack_from(data, position)[1], position + 9
+            if tag == PARTITIONED:
+                state, position = decode_value(data, position + 1, references)
+                table = PartitionedTable.__new__(PartitionedTable)
+                table.__setstate__(state)
+                return table, position
+            count = unpack_length(data, position + 1)[0]
+            position += 5
+            if tag == DICT:
+                result = {}
+                for _ in range(count):
+                    key, position = decode_value(data, position, references)
+                    result[key], position = decode_value(data, position, references)
+                return result, position
+            if tag == LIST or tag == TUPLE:
+                result = []
+                for _ in range(count):
+                    item, position = decode_value(data, position, references)
+                    result.append(item)
+                return (result if tag == LIST else tuple(result)), position
+            raw = bytes(data[position:position + count])
+            position += count
+            if tag == BYTES:
+                return raw, position
+            if tag == BIG_INT:
+                return int.from_bytes(raw, 'little', signed=True), position
+            if tag == DATETIME:
+                return datetime.fromisoformat(raw.decode('ascii')), position
+            if tag == DATE:
+                return date.fromisoformat(raw.decode('ascii')), position
+            if tag == TIME:
+                return time_of_day.fromisoformat(raw.decode('ascii')), position
+            if tag == DECIMAL:
+                return Decimal(raw.decode('ascii')), position
+            raise ValueError('unknown value tag {0}'.format(tag))
+
+        return encode_value, decode_value
 
 
 class InvalidTypeError(Exception):
@@ -992,6 +4764,42 @@ class InvalidTypeError(Exception):
         return "Значение '{0}' должно быть числом!".format(self.value)
 
 
+class DatabaseCorruptedError(Exception):
+    """Собственный класс исключения (повреждённый файл базы)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "Файл базы '{0}' повреждён!".format(self.value)
+
+
+class TransactionQueueOverflowError(Exception):
+    """Собственный класс исключения (переполнение очереди транзакций)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "Очередь транзакций переполнена: не более {0} записей!".format(self.value)
+
+
+class ConflictError(Exception):
+    """Собственный класс исключения (запись изменена другим процессом)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "Запись '{0}' изменена другим процессом, повторите операцию!".format(self.value)
+
+
 class InvalidValueError(Exception):
     """Собственный класс исключения (неверное значение)"""
 
@@ -1002,3 +4810,40 @@ class InvalidValueError(Exception):
     def __str__(self):
         """Возвращает строковое представление ошибки"""
         return "Значение '{0}' должно быть положительным числом!".format(self.value)
+
+
+class ServiceError(Exception):
+    """Собственный класс исключения (служба базы недоступна)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "Служба базы не выполнила запрос '{0}'!".format(self.value)
+
+
+class SeatsUnavailableError(Exception):
+    """Собственный класс исключения (недостаточно свободных мест)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "На поезд '{0}' недостаточно свободных мест!".format(self.value)
+
+
+class LegacyFormatError(Exception):
+    """Собственный класс исключения (данные в формате pickle прежних версий)"""
+
+    def __init__(self, value):
+        """Инициализирует атрибут"""
+        self.value = value
+
+    def __str__(self):
+        """Возвращает строковое представление ошибки"""
+        return "Данные '{0}' сохранены прежней версией: откройте базу с legacy=True для их перевода!".format(
+            self.value)
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Individual_RZD import RZDAuditLog, RZDTransaction, RzdDatabase  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Тест работает в своём каталоге и пишет журнал транзакций в него"""
+    monkeypatch.chdir(tmp_path)
+    RZDTransaction.set_audit_log(RZDAuditLog(str(tmp_path / 'transaction.txt')))
+    yield tmp_path
+    RZDTransaction.set_audit_log(None)
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'rzd.pkl')
+
+
+@pytest.fixture
+def open_db(filename):
+    """Открывает базу в каталоге теста; все открытые базы закрываются после теста"""
+    opened = []
+
+    def factory(**kwargs):
+        db = RzdDatabase(kwargs.pop('filename', filename), **kwargs)
+        opened.append(db)
+        return db
+
+    yield factory
+    for db in opened:
+        db.close()
+
+
+def add_timetable(db, number, departure='2023-05-01 10:00', arrival='2023-05-01 14:00',
+                  place_of_departure='Москва', place_of_arrival='Тверь', carriages=2):
+    """Добавляет расписание рейса с поездом; время задаётся строками 'ГГГГ-ММ-ДД ЧЧ:ММ'"""
+    day_of_departure, time_of_departure = departure.split()
+    day_of_arrival, time_of_arrival = arrival.split()
+    return db.add_train_timetable(day_of_departure, time_of_departure, place_of_departure,
+                                  day_of_arrival, time_of_arrival, place_of_arrival,
+                                  '{0} - {1}'.format(place_of_departure, place_of_arrival), 1500,
+                                  number, 2010, carriages, 'общий')[0]
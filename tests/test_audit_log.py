@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import time
+
+from Individual_RZD import RZDAuditLog, RZDTransaction, Train
+
+
+def lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.readlines()
+
+
+def test_import_does_not_open_audit_log(tmp_path):
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    code = 'import Individual_RZD; print(Individual_RZD.RZDTransaction.audit_log)'
+    output = subprocess.run([sys.executable, '-c', code], cwd=str(tmp_path), capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': os.path.abspath(src)}, check=True).stdout
+    assert output.strip() == 'None'
+    assert not os.path.exists(tmp_path / 'transaction.txt')
+
+
+def test_transactions_are_written_in_batches(tmp_path):
+    path = str(tmp_path / 'logs' / 'audit.txt')
+    os.makedirs(os.path.dirname(path))
+    audit_log = RZDAuditLog(path, buffer_size=2, flush_interval=3600)
+    RZDTransaction.set_audit_log(audit_log)
+    train = Train(1, 2010, 2, 'общий')
+    train.move()
+    assert lines(path) == []
+    train.move()
+    assert len(lines(path)) == 2
+    train.stop()
+    RZDTransaction.set_audit_log(None)
+    # прежний журнал закрывается, записи из буфера не теряются
+    assert len(lines(path)) == 3 and 'operation' in lines(path)[2]
+    assert not os.path.exists(tmp_path / 'transaction.txt')
+
+
+def test_default_log_is_opened_on_first_transaction(tmp_path):
+    RZDTransaction.set_audit_log(None)
+    Train(1, 2010, 2, 'общий').move()
+    assert RZDTransaction.audit_log.filename == str(tmp_path / 'transaction.txt')
+    RZDTransaction.audit_log.flush()
+    assert len(lines(tmp_path / 'transaction.txt')) == 1
+
+
+def test_background_thread_flushes_by_interval(tmp_path):
+    path = str(tmp_path / 'audit.txt')
+    RZDTransaction.set_audit_log(RZDAuditLog(path, flush_interval=0.05, background=True))
+    train = Train(1, 2010, 2, 'общий')
+    train.move()
+    time.sleep(0.1)
+    train.move()
+    deadline = time.monotonic() + 5
+    while len(lines(path)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(lines(path)) == 2
@@ -0,0 +1,122 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+
+from Individual_RZD import PartitionedTable, RecordCodec, TicketSalesSheet, Train, TrainTimetable, WorkerRZD
+
+
+def test_round_trip_of_values():
+    value = {'none': None, 'flags': [True, False], 'small': -5, 'int32': 1 << 20, 'int64': 1 << 40,
+             'big': 1 << 70, 'float': 1.5, 'text': 'Москва' * 100, 'bytes': b'\x00\x01',
+             'tuple': (1, 'a'), 'moment': datetime(2023, 5, 1, 10, 30), 'day': date(2023, 5, 1),
+             'time': time(10, 30, 15), 'price': Decimal('1500.45')}
+    assert RecordCodec.decode(RecordCodec.encode(value)) == value
+
+
+def test_shared_objects_stay_shared():
+    train = Train(7, 2010, 12, 'общий')
+    timetables = [TrainTimetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь', 'Москва - Тверь',
+                                 1500, 7, train=train) for _ in range(2)]
+    first, second = RecordCodec.decode(RecordCodec.encode(timetables))
+    assert first.train is second.train
+    assert first.train.number_of_carriages == 12
+
+
+def test_entities_and_partitioned_table():
+    sheet = TicketSalesSheet(7, '2023-05-01 10:00:00', 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 3000,
+                             sale_id=1, seats=[(1, 1), (1, 2)])
+    table = PartitionedTable({1: sheet})
+    restored = RecordCodec.decode(RecordCodec.encode(table))
+    assert isinstance(restored, PartitionedTable)
+    assert restored[1].seats == ((1, 1), (1, 2))
+    assert restored[1].passenger_fullname == 'Петров Пётр Петрович'
+
+
+def encode_with_schema(value, code, schema, monkeypatch):
+    """Сериализует значение так, как его записала бы версия с другой схемой сущности"""
+    monkeypatch.setitem(RecordCodec.SCHEMAS, code, schema)
+    monkeypatch.setattr(RecordCodec, '_entities', {})
+    monkeypatch.setattr(RecordCodec, '_functions', None)
+    data = RecordCodec.encode(value)
+    monkeypatch.undo()
+    RecordCodec._entities.clear()
+    RecordCodec._functions = None
+    return data
+
+
+def test_old_schema_version_is_migrated(monkeypatch):
+    worker = WorkerRZD('Иванов', 'Иван', 'Иванович', 1980, 2005, 18, 'проводник', 'м', 'ул. Ленина', 'Москва', '+7')
+    data = encode_with_schema(worker, 1, (WorkerRZD, 1, RecordCodec.WORKER_FIELDS), monkeypatch)
+    restored = RecordCodec.decode(data)
+    assert restored.name == 'Иван' and restored.worker_id is None
+
+
+def test_newer_schema_version_is_rejected(monkeypatch):
+    data = encode_with_schema(Train(7, 2010, 12, 'общий'), 4,
+                              (Train, 2, ('number', 'release_year', 'number_of_carriages', 'type_of_train')),
+                              monkeypatch)
+    with pytest.raises(ValueError):
+        RecordCodec.decode(data)
+
+
+def test_unknown_data_is_rejected():
+    with pytest.raises(ValueError):
+        RecordCodec.decode(b'not a record')
+    with pytest.raises(TypeError):
+        RecordCodec.encode(object())
+
+
+def test_value_that_cannot_be_saved_does_not_break_later_saves(open_db):
+    db = open_db()
+    worker = db.add_worker('Иванов', 'Иван', 'Иванович', 1980, 2005, 18, 'проводник', 'м', 'ул. Ленина', 'Москва',
+                           '+7')
+    with pytest.raises(TypeError):
+        db.change_worker_qt(None, object(), worker_id=worker.worker_id)
+    assert db.get_worker_by_id(worker.worker_id).name == 'Иван'
+    db.change_worker_qt(None, 'Пётр', worker_id=worker.worker_id)
+    db.close()
+    assert open_db().get_worker_by_id(worker.worker_id).name == 'Пётр'
+
+
+def test_time_and_decimal_values_are_saved(open_db):
+    db = open_db()
+    worker = db.add_worker('Иванов', 'Иван', 'Иванович', 1980, 2005, 18, 'проводник', 'м', 'ул. Ленина', 'Москва',
+                           '+7')
+    db.change_worker_qt(None, time(8, 30), worker_id=worker.worker_id)
+    db.change_worker_qt(None, Decimal('0.10'), worker_id=worker.worker_id)
+    db.close()
+    assert open_db().get_worker_by_id(worker.worker_id).name == Decimal('0.10')
+
+
+def test_timetable_with_whole_train_is_migrated(monkeypatch):
+    timetable = TrainTimetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь', 'Москва - Тверь',
+                               1500, 7, 2010, 12, 'общий')
+    fields = RecordCodec.SCHEMAS[5][2][1:]
+    data = encode_with_schema(timetable, 5, (TrainTimetable, 1, fields), monkeypatch)
+    restored = RecordCodec.decode(data)
+    assert restored.number_of_train == 7 and restored.train.number_of_carriages == 12
+
+
+def test_entity_fields_of_every_kind():
+    strings = ['строка {0}'.format(i) for i in range(300)]
+    sheet = TicketSalesSheet(1 << 40, '2023-05-01 10:00:00', 'Петров' * 60, strings[299], -2, True, 3000,
+                             sale_id=1 << 70, seats=[(1, 1)], departure=strings[0])
+    restored = RecordCodec.decode(RecordCodec.encode([strings, sheet, sheet]))
+    assert restored[1] is restored[2]
+    restored = restored[1]
+    assert (restored.number_of_train, restored.sale_id, restored.number_of_tickets) == (1 << 40, 1 << 70, -2)
+    assert restored.passenger_fullname == 'Петров' * 60 and restored.benefits is True
+    assert (restored.passport, restored.departure) == ('строка 299', 'строка 0')
+    assert restored.seats == ((1, 1),) and restored.price == 3000
+
+
+def test_entities_of_earlier_format_are_read():
+    data = bytearray(RecordCodec.MAGIC)
+    data += RecordCodec.ENTITY_HEADER.pack(RecordCodec.ENTITY, 4, 1, 4)
+    data += RecordCodec.SHORT.pack(RecordCodec.INT8, 7)
+    data += RecordCodec.INT32_VALUE.pack(RecordCodec.INT32, 2010)
+    data += RecordCodec.SHORT.pack(RecordCodec.INT8, 12)
+    data += RecordCodec.SHORT.pack(RecordCodec.SHORT_STR, len('общий'.encode())) + 'общий'.encode()
+    train = RecordCodec.decode(bytes(data))
+    assert (train.number, train.release_year, train.number_of_carriages, train.type_of_train) == (7, 2010, 12, 'общий')
@@ -0,0 +1,67 @@
+import time
+from datetime import date, datetime
+
+import pytest
+
+import Individual_RZD
+from conftest import add_timetable
+from Individual_RZD import SalesColumns, TicketSalesSheet
+
+DAY_NS = 24 * 3600 * 10 ** 9
+START_NS = int(datetime(2024, 3, 1, 12).timestamp()) * 10 ** 9
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def columns_backend(request, monkeypatch):
+    """Агрегаты считаются через numpy, если он установлен, и без него"""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(Individual_RZD, 'numpy', None)
+
+
+def sell(db, number, day, tickets, price, benefits, monkeypatch):
+    monkeypatch.setattr(time, 'time_ns', lambda: START_NS + day * DAY_NS)
+    return db.add_ticket_sales_sheet(number, 'Петров Пётр Петрович', '4510 000001', tickets, benefits, price)[0]
+
+
+def test_aggregates_follow_sales(open_db, columns_backend, monkeypatch):
+    db = open_db(columnar=True)
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    first = sell(db, 1, 0, 2, 3000, 'нет', monkeypatch)
+    sell(db, 2, 0, 1, 1500, 'пенсионер', monkeypatch)
+    last = sell(db, 1, 1, 3, 4500, 'нет', monkeypatch)
+    columns = db.sales_columns
+    assert columns.revenue_by_train() == {1: 7500.0, 2: 1500.0}
+    assert columns.tickets_by_day() == {date(2024, 3, 1): 3, date(2024, 3, 2): 3}
+    assert columns.benefits_share() == pytest.approx(1 / 3)
+    db.change_number_of_tickets_qt(last.sale_id, 1)
+    db.delete_ticket_sales_sheet(first.sale_id)
+    assert columns.tickets_by_day() == {date(2024, 3, 1): 1, date(2024, 3, 2): 1}
+    assert columns.revenue_by_train() == {1: 4500.0, 2: 1500.0}
+    assert columns.benefits_share() == 0.5
+
+
+def test_columns_are_built_from_existing_sales(open_db, monkeypatch):
+    db = open_db()
+    add_timetable(db, 1)
+    sell(db, 1, 0, 2, 3000, 'нет', monkeypatch)
+    assert db.sales_columns is None
+    assert db.enable_sales_columns().revenue_by_train() == {1: 3000.0}
+    db.close()
+    assert len(open_db(columnar=True).sales_columns) == 1
+
+
+def test_discard_moves_the_last_row():
+    columns = SalesColumns()
+    for key in range(3):
+        columns.add(key, TicketSalesSheet(key, '2024-03-01 12:00:00', 'Петров Пётр Петрович', '4510 000001',
+                                          key + 1, 'да' if key else 'нет', 'не число'))
+    columns.discard(0)
+    columns.discard(0)
+    assert columns.keys == [2, 1] and list(columns.tickets) == [3, 2]
+    assert columns.row_by_key == {2: 0, 1: 1}
+    # стоимость, которую нельзя привести к числу, учитывается нулём
+    assert columns.revenue_by_train() == {} and columns.benefits_share() == 1.0
+    assert SalesColumns().benefits_share() == 0.0
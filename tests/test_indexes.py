@@ -0,0 +1,71 @@
+import operator
+
+import pytest
+
+from conftest import add_timetable
+from Individual_RZD import HashIndex, SortedIndex
+
+
+def add_worker(db, name, city='Москва'):
+    return db.add_worker('Иванов', name, 'Иванович', 1980, 2005, 18, 'проводник', 'м', 'ул. Ленина', city, '+7')
+
+
+def test_find_by_indexed_attributes(open_db):
+    db = open_db()
+    ivan, petr = add_worker(db, 'Иван'), add_worker(db, 'Пётр', city='Тверь')
+    namesake = add_worker(db, 'Иван', city='Тверь')
+    assert db.find("workers", name='Иван') == [ivan, namesake]
+    assert db.find("workers", name='Иван', city='Тверь') == [namesake]
+    assert db.find("workers", city='Тверь') == [petr, namesake]
+    assert db.find("workers", name='Сергей') == []
+    assert len(db.find("workers")) == 3
+    with pytest.raises(ValueError):
+        db.find("workers", surname='Иванов')
+
+
+def test_indexes_follow_changes(open_db):
+    db = open_db()
+    add_timetable(db, 1, place_of_departure='Москва')
+    worker = add_worker(db, 'Иван')
+    # индексы строятся при первом запросе, затем меняются вместе с записями
+    assert db.find("workers", name='Иван') == [worker]
+    db.change_worker_qt('Иван', 'Пётр')
+    assert db.find("workers", name='Иван') == []
+    assert db.find("workers", name='Пётр') == [worker]
+    db.delete_worker('Пётр')
+    assert db.find("workers", name='Пётр') == []
+    timetable = add_timetable(db, 2, place_of_departure='Тверь')
+    assert db.find("train_timetables", place_of_departure='Тверь') == [timetable]
+    db.delete_train_timetable(2)
+    assert db.find("train_timetables", place_of_departure='Тверь') == []
+    db.close()
+    db = open_db()
+    assert [t.train.number for t in db.find("train_timetables", place_of_departure='Москва')] == [1]
+
+
+def test_hash_index():
+    index = HashIndex(operator.itemgetter('city'))
+    index.add(1, {'city': 'Москва'})
+    index.add(2, {'city': 'Тверь'})
+    index.add(3, {'city': 'Москва'})
+    assert list(index.lookup('Москва')) == [1, 3]
+    index.discard(1)
+    index.discard(1)
+    assert list(index.lookup('Москва')) == [3]
+    index.discard(3)
+    assert 'Москва' not in index.keys_by_value
+    index.clear()
+    assert list(index.lookup('Тверь')) == []
+
+
+def test_sorted_index():
+    index = SortedIndex(operator.itemgetter('day'))
+    for key, day in ((1, 5), (2, 3), (3, None), (4, 5), (5, 1)):
+        index.add(key, {'day': day})
+    # записи без значения не индексируются, равные значения - в порядке добавления
+    assert list(index.range()) == [5, 2, 1, 4]
+    assert list(index.range(3, 5)) == [2]
+    assert list(index.lookup(5)) == [1, 4]
+    index.discard(1)
+    index.discard(3)
+    assert list(index.range(5)) == [4]
@@ -0,0 +1,56 @@
+import os
+
+from conftest import add_timetable
+
+
+def test_journal_replays_changes_after_reopen(open_db):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 3000)[0]
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(1).place_of_arrival == 'Тверь'
+    assert db.get_ticket_sales_sheet_by_id(sale.sale_id).number_of_tickets == 2
+
+
+def test_torn_journal_tail_is_dropped(open_db):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    db.close()
+    journal = db.journal_filename
+    size = os.path.getsize(journal)
+    # сбой посреди дозаписи: от последней записи осталась только часть
+    with open(journal, 'r+b') as f:
+        f.truncate(size - 3)
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_timetable_by_number(2) is None
+    # недописанный хвост отрезан, новые записи идут за целыми
+    add_timetable(db, 3)
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(3) is not None
+
+
+def test_corrupted_journal_record_stops_replay(open_db):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    size = os.path.getsize(db.journal_filename)
+    add_timetable(db, 2)
+    db.close()
+    with open(db.journal_filename, 'r+b') as f:
+        f.seek(size + db.JOURNAL_RECORD_HEADER.size + 1)
+        f.write(b'\xff')
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_timetable_by_number(2) is None
+
+
+def test_save_replaces_journal_with_snapshot(open_db):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    db.save_database()
+    assert os.path.getsize(db.journal_filename) == 0
+    db.close()
+    assert open_db(journal=True).get_train_timetable_by_number(1) is not None
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from Individual_RZD import parse_datetime
+from conftest import add_timetable
+
+
+def arrival(journey):
+    return parse_datetime(journey[-1].date_of_arrival, journey[-1].time_of_arrival)
+
+
+def test_direct_and_connecting_journeys(open_db):
+    db = open_db()
+    add_timetable(db, 1, '2023-05-01 08:00', '2023-05-01 12:00', 'Москва', 'Бологое')
+    add_timetable(db, 2, '2023-05-01 12:30', '2023-05-01 15:00', 'Бологое', 'Санкт-Петербург')
+    add_timetable(db, 3, '2023-05-01 09:00', '2023-05-01 17:00', 'Москва', 'Санкт-Петербург')
+    journey = db.plan_journey('Москва', 'Санкт-Петербург', '2023-05-01 07:00')
+    assert [timetable.train.number for timetable in journey] == [1, 2]
+    assert arrival(journey) == datetime(2023, 5, 1, 15, 0)
+
+
+def test_transfer_time_is_respected(open_db):
+    db = open_db()
+    add_timetable(db, 1, '2023-05-01 08:00', '2023-05-01 12:00', 'Москва', 'Бологое')
+    add_timetable(db, 2, '2023-05-01 12:30', '2023-05-01 15:00', 'Бологое', 'Санкт-Петербург')
+    add_timetable(db, 3, '2023-05-01 09:00', '2023-05-01 17:00', 'Москва', 'Санкт-Петербург')
+    journey = db.plan_journey('Москва', 'Санкт-Петербург', '2023-05-01 07:00', transfer_minutes=45)
+    assert [timetable.train.number for timetable in journey] == [3]
+
+
+def test_unreachable_or_late(open_db):
+    db = open_db()
+    add_timetable(db, 1, '2023-05-01 08:00', '2023-05-01 12:00', 'Москва', 'Бологое')
+    assert db.plan_journey('Бологое', 'Москва') is None
+    assert db.plan_journey('Москва', 'Бологое', '2023-05-01 09:00') is None
+    assert db.plan_journey('Москва', 'Бологое', arrive_by='2023-05-01 11:00') is None
+
+
+def test_deleted_timetable_is_not_used(open_db):
+    db = open_db()
+    add_timetable(db, 1, '2023-05-01 08:00', '2023-05-01 12:00', 'Москва', 'Бологое')
+    add_timetable(db, 2, '2023-05-01 10:00', '2023-05-01 13:00', 'Москва', 'Бологое')
+    assert db.plan_journey('Москва', 'Бологое')[0].train.number == 1
+    db.delete_train_timetable(1)
+    assert db.plan_journey('Москва', 'Бологое')[0].train.number == 2
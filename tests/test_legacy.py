@@ -0,0 +1,145 @@
+import os
+import pickle
+import time
+import zlib
+from datetime import datetime
+
+import pytest
+
+from Individual_RZD import LegacyFormatError, RecordCodec, SaleIdGenerator, SqliteStorage, migrate_to_sqlite
+from conftest import add_timetable
+
+
+def make_legacy_database(open_db, **mode):
+    """Создаёт базу и возвращает её таблицы, как их сохраняли прежние версии через pickle"""
+    db = open_db(**mode)
+    add_timetable(db, 1)
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 3000)[0]
+    tables = {table: dict(db.database[table].items()) if table == 'ticket_sales_sheets' else db.database[table]
+              for table in db.TABLES}
+    db.close()
+    return tables, sale.sale_id
+
+
+def assert_migrated(db, sale_id):
+    assert db.get_train_timetable_by_number(1).place_of_arrival == 'Тверь'
+    assert db.get_ticket_sales_sheet_by_id(sale_id).number_of_tickets == 2
+
+
+def test_headerless_pickle_snapshot_needs_legacy(open_db, filename):
+    tables, sale_id = make_legacy_database(open_db)
+    os.remove(filename + '.prev')
+    with open(filename, 'wb') as f:
+        pickle.dump(tables, f)
+    with pytest.raises(LegacyFormatError):
+        open_db()
+    assert_migrated(open_db(legacy=True), sale_id)
+    # после перевода база открывается без pickle
+    with open(filename, 'rb') as f:
+        assert f.read()[:4] == b'RZD1'
+    assert_migrated(open_db(), sale_id)
+
+
+def test_pickle_journal_needs_legacy(open_db, filename):
+    db = open_db(journal=True)
+    db.save_database()
+    tables, sale_id = make_legacy_database(open_db, journal=True)
+    payload = pickle.dumps([(table, key, True, value) for table in ('train_timetables', 'trains')
+                            for key, value in tables[table].items()])
+    with open(db.journal_filename, 'wb') as f:
+        f.write(db.JOURNAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+    with pytest.raises(LegacyFormatError):
+        open_db(journal=True)
+    db = open_db(journal=True, legacy=True)
+    assert db.get_train_timetable_by_number(1) is not None
+    assert os.path.getsize(db.journal_filename) == 0
+    db.close()
+    assert open_db(journal=True).get_train_timetable_by_number(1) is not None
+
+
+def test_pickle_segments_and_archive_are_migrated(open_db, filename):
+    db = open_db(segmented=True)
+    add_timetable(db, 1)
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 3000)[0]
+    day = db.database['ticket_sales_sheets'].days()[0]
+    db.archive_sales(day)
+    db.add_ticket_sales_sheet(1, 'Иванов Иван Иванович', '4510 000002', 1, 'нет', 1500)
+    db.close()
+    # перезаписываем каждый файл базы и архива так, как его сохраняла прежняя версия
+    for root, dirs, names in os.walk(os.path.dirname(filename)):
+        for name in names:
+            path = os.path.join(root, name)
+            if not name.endswith(db.SEGMENT_SUFFIX):
+                continue
+            data = pickle.dumps(db._read_file(path)[0])
+            if '.archive' in root:
+                db._write_file(path, zlib.compress(data), db.ARCHIVE_MAGIC)
+            else:
+                db._write_file(path, data)
+            if os.path.exists(path + '.prev'):
+                os.remove(path + '.prev')
+    with pytest.raises(LegacyFormatError):
+        list(open_db(segmented=True).database['ticket_sales_sheets'].values())
+    open_db(segmented=True, legacy=True).close()
+    db = open_db(segmented=True)
+    assert len(list(db.database['ticket_sales_sheets'].values())) == 1
+    assert db.archived_sales(day)[sale.sale_id].number_of_tickets == 2
+
+
+def test_pickle_rows_in_sqlite_are_migrated(open_db, tmp_path):
+    target = str(tmp_path / 'rzd.sqlite')
+    db = open_db(storage=SqliteStorage(target))
+    add_timetable(db, 1)
+    db.close()
+    storage = SqliteStorage(target)
+    rows = storage.execute('SELECT key, value FROM "train_timetables"').fetchall()
+    with storage.connection:
+        for key, value in rows:
+            storage.execute('UPDATE "train_timetables" SET value = ? WHERE key = ?',
+                            (pickle.dumps(RecordCodec.decode(value)), key))
+    storage.close()
+    with pytest.raises(LegacyFormatError):
+        open_db(storage=SqliteStorage(target)).get_train_timetable_by_number(1)
+    open_db(storage=SqliteStorage(target), legacy=True).close()
+    assert open_db(storage=SqliteStorage(target)).get_train_timetable_by_number(1).place_of_arrival == 'Тверь'
+
+
+def test_migrate_to_sqlite_from_legacy_files(open_db, filename, tmp_path):
+    tables, sale_id = make_legacy_database(open_db)
+    os.remove(filename + '.prev')
+    with open(filename, 'wb') as f:
+        pickle.dump(tables, f)
+    target = str(tmp_path / 'rzd.sqlite')
+    with pytest.raises(LegacyFormatError):
+        migrate_to_sqlite(filename, target)
+    assert migrate_to_sqlite(filename, target, legacy=True) > 0
+    assert_migrated(open_db(storage=SqliteStorage(target)), sale_id)
+
+
+def test_sale_ids_fit_signed_64_bits_and_old_ids_still_decode():
+    generator = SaleIdGenerator(5)
+    # номер прежнего формата: миллисекунды от 1970 года, касса и 12 бит счётчика
+    moment = datetime(2023, 5, 1, 10, 0, 0, 123000)
+    legacy_id = (int(moment.timestamp() * 1000) << 22) | (3 << 12) | 7
+    assert SaleIdGenerator.timestamp(legacy_id) == moment
+    generator.observe(legacy_id)
+    sale_id = generator.next_id()
+    assert sale_id < 1 << 62
+    assert abs(SaleIdGenerator.timestamp(sale_id) - datetime.now()).total_seconds() < 5
+    # часы 2090 года: номер всё ещё меньше 2**62
+    assert (int(datetime(2090, 1, 1).timestamp() * 1000) - SaleIdGenerator.EPOCH_MS) << 21 < 1 << 62
+    assert generator.next_id() > sale_id
+
+
+def test_new_sales_follow_old_format_ids(open_db, monkeypatch):
+    db = open_db()
+    add_timetable(db, 1)
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 3000)[0]
+    legacy_id = (time.time_ns() // 1000000 << 22) | 1
+    db.database['ticket_sales_sheets'][legacy_id] = db.database['ticket_sales_sheets'].pop(sale.sale_id)
+    db.save_database()
+    db.close()
+    db = open_db()
+    assert db.get_ticket_sales_sheet_by_id(legacy_id) is not None
+    sale_id = db.add_ticket_sales_sheet(1, 'Иванов Иван Иванович', '4510 000002', 1, 'нет', 3000)[0].sale_id
+    assert sale_id < 1 << 62 and SaleIdGenerator.timestamp(sale_id).date() == SaleIdGenerator.timestamp(legacy_id).date()
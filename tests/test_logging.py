@@ -0,0 +1,39 @@
+import io
+import logging
+
+import pytest
+
+import Individual_RZD
+from Individual_RZD import InvalidTypeError, set_verbose
+
+
+def make_invalid_change(open_db):
+    db = open_db()
+    timetable = db.add_train_timetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь',
+                                       'Москва - Тверь', 1500, 1, 2010, 2, 'общий')[0]
+    with pytest.raises(InvalidTypeError):
+        timetable.ticket_price = 'дорого'
+
+
+def messages(caplog):
+    return [record for record in caplog.records if record.name == Individual_RZD.logger.name]
+
+
+def test_messages_are_quiet_under_info_root_logging(open_db, caplog):
+    caplog.set_level(logging.INFO)
+    make_invalid_change(open_db)
+    assert messages(caplog) == []
+
+
+def test_set_verbose_prints_messages_and_turns_them_off(open_db, caplog):
+    caplog.set_level(logging.INFO)
+    stream = io.StringIO()
+    set_verbose(stream=stream)
+    try:
+        make_invalid_change(open_db)
+    finally:
+        set_verbose(False)
+    assert 'Произошла генерация исключения!' in stream.getvalue()
+    caplog.clear()
+    make_invalid_change(open_db)
+    assert messages(caplog) == [] and Individual_RZD.logger.level == logging.WARNING
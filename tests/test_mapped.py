@@ -0,0 +1,44 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+
+from Individual_RZD import DatabaseCorruptedError, MappedDatabase
+from conftest import add_timetable
+
+
+def test_mapped_values_keep_their_types(open_db):
+    db = open_db()
+    add_timetable(db, 1, departure='2023-05-01 10:00')
+    db.add_train_timetable(date(2023, 5, 2), time(10, 30, 15, 250), 'Москва', datetime(2023, 5, 2, 14, 0, 0, 5),
+                           '14:00', 'Тверь', 'Москва - Тверь', Decimal('1500.50'), 2, 2010, 2, 'общий')
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 2, True, 3000)[0]
+    mapped = MappedDatabase(db.export_mapped())
+    try:
+        stored = mapped.get_train_timetable_by_number(2)
+        assert stored.date_of_departure == date(2023, 5, 2) and type(stored.date_of_departure) is date
+        assert stored.time_of_departure == time(10, 30, 15, 250)
+        assert stored.date_of_arrival == datetime(2023, 5, 2, 14, 0, 0, 5)
+        assert stored.ticket_price == Decimal('1500.50') and isinstance(stored.ticket_price, Decimal)
+        assert mapped.get_train_timetable_by_number(1).date_of_departure == '2023-05-01'
+        assert mapped.get_ticket_sales_sheet_by_id(sale.sale_id).benefits is True
+    finally:
+        mapped.close()
+
+
+def test_version_1_snapshots_still_open(open_db, monkeypatch):
+    db = open_db()
+    add_timetable(db, 1)
+    monkeypatch.setattr(MappedDatabase, 'VERSION', 1)
+    filename = db.export_mapped()
+    monkeypatch.undo()
+    mapped = MappedDatabase(filename)
+    try:
+        assert mapped.get_train_timetable_by_number(1).place_of_departure == 'Москва'
+    finally:
+        mapped.close()
+    monkeypatch.setattr(MappedDatabase, 'VERSION', 3)
+    filename = db.export_mapped()
+    monkeypatch.undo()
+    with pytest.raises(DatabaseCorruptedError):
+        MappedDatabase(filename)
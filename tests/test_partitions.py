@@ -0,0 +1,65 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from conftest import add_timetable
+
+DAY_NS = 24 * 3600 * 10 ** 9
+START_NS = int(datetime(2024, 3, 1, 12).timestamp()) * 10 ** 9
+MODES = [{}, {'journal': True}, {'segmented': True}]
+
+
+def sell_days(db, monkeypatch, days=4):
+    """Продаёт по билету в каждый из дней, начиная с 2024-03-01"""
+    add_timetable(db, 1)
+    for day in range(days):
+        monkeypatch.setattr(time, 'time_ns', lambda: START_NS + day * DAY_NS)
+        db.add_ticket_sales_sheet(1, 'Пассажир {0}'.format(day), '4510 000001', 1, 'нет', 1500)
+
+
+def sale_days(db):
+    return [sheet.sale_datetime[:10] for sheet in db.sales_between()]
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_drop_sales(open_db, monkeypatch, mode):
+    db = open_db(**mode)
+    sell_days(db, monkeypatch)
+    assert len(db.find("ticket_sales_sheets", number_of_train=1)) == 4
+    db.drop_sales('2024-03-02')
+    assert sale_days(db) == ['2024-03-01', '2024-03-03', '2024-03-04']
+    # индексы продаж перестраиваются после удаления дня
+    assert len(db.find("ticket_sales_sheets", number_of_train=1)) == 3
+    db.close()
+    db = open_db(**mode)
+    assert sale_days(db) == ['2024-03-01', '2024-03-03', '2024-03-04']
+    db.drop_sales_before(datetime(2024, 3, 4, 8))
+    db.close()
+    assert sale_days(open_db(**mode)) == ['2024-03-04']
+
+
+def test_sales_cannot_be_dropped_inside_a_transaction(open_db, monkeypatch):
+    db = open_db()
+    sell_days(db, monkeypatch, days=1)
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.drop_sales('2024-03-01')
+    assert sale_days(db) == ['2024-03-01']
+    with pytest.raises(ValueError):
+        db.drop_sales('не дата')
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_archive_sales_before(open_db, monkeypatch, mode):
+    db = open_db(**mode)
+    sell_days(db, monkeypatch)
+    db.archive_sales_before('2024-03-03')
+    assert sale_days(db) == ['2024-03-03', '2024-03-04']
+    assert db.archived_days() == ['2024-03-01', '2024-03-02']
+    archived = [sheet.passenger_fullname for sheet in db.archived_sales_between('2024-03-01 13:00')]
+    assert archived == ['Пассажир 1']
+    # архивная ведомость привязана к расписанию базы
+    sheet, = db.archived_sales('2024-03-01').values()
+    assert sheet.trip_number is db.get_train_timetable_by_number(1)
+    assert db.archived_sales('2024-03-05') == {}
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import Individual_RZD
+from Individual_RZD import Count, Profiler, Timer
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    """Общий сборщик статистики декораторов, очищенный перед тестом и после него"""
+    monkeypatch.setattr(Individual_RZD.profiler, 'enabled', True)
+    Individual_RZD.profiler.reset()
+    yield Individual_RZD.profiler
+    Individual_RZD.profiler.reset()
+
+
+class Service:
+    @Timer
+    @Count
+    def work(self, value):
+        if value is None:
+            raise ValueError(value)
+        return value * 2
+
+
+def test_percentiles_are_upper_bounds_of_buckets():
+    stats = Profiler()
+    for elapsed_ns in [1000] * 90 + [1 << 20] * 9 + [1 << 30]:
+        stats.observe('work', elapsed_ns)
+    stats.count('work')
+    snapshot = stats.snapshot()['work']
+    assert snapshot == {'calls': 1, 'timed_calls': 100, 'p50': 1024 / 1e9, 'p95': (1 << 21) / 1e9,
+                        'p99': (1 << 21) / 1e9}
+    stats.observe('work', 1 << 30)
+    assert stats.snapshot()['work']['p99'] == (1 << 31) / 1e9
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_export_writes_the_snapshot(tmp_path):
+    stats = Profiler()
+    stats.count('work')
+    stats.export(str(tmp_path / 'profile.json'))
+    with open(tmp_path / 'profile.json', encoding='utf-8') as f:
+        assert json.load(f) == {'work': {'calls': 1}}
+
+
+def test_decorators_collect_calls_and_durations(profiler):
+    service = Service()
+    assert service.work(2) == 4
+    with pytest.raises(ValueError):
+        service.work(None)
+    name = 'Service.work'
+    assert Count.get_func_counter()[name] == 2
+    # длительность учитывается и у вызова, завершившегося исключением
+    assert profiler.snapshot()[name]['timed_calls'] == 2
+    assert Service.work.__name__ == 'work'
+
+
+def test_disabled_profiler_collects_nothing(profiler):
+    profiler.enabled = False
+    assert Service().work(3) == 6
+    assert profiler.snapshot() == {}
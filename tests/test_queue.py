@@ -0,0 +1,52 @@
+import pytest
+
+from Individual_RZD import Train, TrainTimetable, TransactionQueue, TransactionQueueOverflowError
+
+
+def test_drop_oldest_keeps_the_latest_transactions():
+    queue = TransactionQueue(range(5), maxlen=3)
+    assert list(queue) == [2, 3, 4] and queue.dropped == 2
+
+
+def test_drop_newest_keeps_the_earliest_transactions():
+    queue = TransactionQueue(range(5), maxlen=3, overflow=TransactionQueue.DROP_NEWEST)
+    assert list(queue) == [0, 1, 2] and queue.dropped == 2
+
+
+def test_raise_on_overflow():
+    queue = TransactionQueue(range(3), maxlen=3, overflow=TransactionQueue.RAISE)
+    with pytest.raises(TransactionQueueOverflowError, match='не более 3'):
+        queue.append(3)
+    assert list(queue) == [0, 1, 2] and queue.dropped == 0
+
+
+def test_defaults_apply_to_new_queues(monkeypatch):
+    monkeypatch.setattr(TransactionQueue, 'default_maxlen', 2)
+    monkeypatch.setattr(TransactionQueue, 'default_overflow', TransactionQueue.DROP_NEWEST)
+    queue = Train(7, 2010, 12, 'общий').queue
+    for item in range(3):
+        queue.append(item)
+    assert (queue.maxlen, list(queue)) == (2, [0, 1])
+    assert len(TransactionQueue(range(10), maxlen=None)) == 2
+
+
+def test_iter_transactions_drains_lazily():
+    timetable = TrainTimetable('2023-05-01', '10:00', 'Москва', '2023-05-01', '14:00', 'Тверь', 'Москва - Тверь',
+                               1500, 7)
+    # очередь создаётся только при первой транзакции
+    assert list(timetable.iter_transactions()) == []
+    for _ in range(3):
+        timetable.show_timetable()
+    transactions = timetable.iter_transactions()
+    assert next(transactions).operation.startswith('Расписание:')
+    assert len(timetable.queue) == 2
+    assert len(list(transactions)) == 2 and len(timetable.queue) == 0
+
+
+def test_list_queue_of_old_objects_is_converted():
+    train = Train(7, 2010, 12, 'общий')
+    state = train.__getstate__()
+    state['_Train__queue'] = ['старая транзакция']
+    train.__setstate__(state)
+    assert isinstance(train.queue, TransactionQueue)
+    assert list(train.iter_transactions()) == ['старая транзакция']
@@ -0,0 +1,54 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from conftest import add_timetable
+from Individual_RZD import SqliteStorage
+
+HOUR_NS = 3600 * 10 ** 9
+START_NS = int(datetime(2024, 3, 1, 12).timestamp()) * 10 ** 9
+
+
+@pytest.fixture(params=['snapshot', 'indexed', 'segmented', 'sqlite'])
+def sold_db(request, open_db, tmp_path, monkeypatch):
+    """База с продажами каждые 10 часов, начиная с 2024-03-01 12:00, в разных режимах хранения"""
+    options = {}
+    if request.param == 'segmented':
+        options['segmented'] = True
+    elif request.param == 'sqlite':
+        options['storage'] = SqliteStorage(str(tmp_path / 'rzd.sqlite'))
+    db = open_db(**options)
+    add_timetable(db, 1)
+    for hours in range(0, 50, 10):
+        monkeypatch.setattr(time, 'time_ns', lambda: START_NS + hours * HOUR_NS)
+        db.add_ticket_sales_sheet(1, 'Пассажир {0}'.format(hours), '4510 000001', 1, 'нет', 1500)
+    if request.param == 'indexed':
+        # индексы ведомостей построены запросом: выборка идёт по упорядоченному индексу
+        db.find("ticket_sales_sheets", number_of_train=1)
+    return db
+
+
+def names(sales):
+    return [sheet.passenger_fullname.split()[1] for sheet in sales]
+
+
+def test_sales_between(sold_db):
+    assert names(sold_db.sales_between()) == ['0', '10', '20', '30', '40']
+    assert names(sold_db.sales_between('2024-03-01 22:00', '2024-03-03')) == ['10', '20', '30']
+    assert names(sold_db.sales_between(stop=datetime(2024, 3, 1, 22))) == ['0']
+    assert names(sold_db.sales_between('2024-03-03 04:00')) == ['40']
+    assert names(sold_db.sales_between('2024-04-01')) == []
+
+
+def test_departures_between(open_db):
+    db = open_db()
+    add_timetable(db, 1, departure='2023-05-02 10:00', arrival='2023-05-02 14:00')
+    add_timetable(db, 2, departure='2023-05-01 08:00', arrival='2023-05-01 12:00', place_of_departure='Тверь')
+    add_timetable(db, 3, departure='2023-05-01 20:00', arrival='2023-05-02 01:00')
+    numbers = [timetable.train.number for timetable in db.departures_between('2023-05-01', '2023-05-02 10:00')]
+    assert numbers == [2, 3]
+    numbers = [timetable.train.number for timetable in db.departures_between(place_of_departure='Москва')]
+    assert numbers == [3, 1]
+    db.delete_train_timetable(3)
+    assert [timetable.train.number for timetable in db.departures_between()] == [2, 1]
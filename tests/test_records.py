@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import add_timetable
+
+
+def add_worker(db, name='Иван'):
+    return db.add_worker('Иванов', name, 'Иванович', 1980, 2005, 18, 'проводник', 'м', 'ул. Ленина', 'Москва', '+7')
+
+
+def test_namesakes_get_separate_keys(open_db):
+    db = open_db()
+    first, second = add_worker(db), add_worker(db)
+    assert first.worker_id != second.worker_id
+    assert db.get_worker_by_name('Иван') is first
+    db.delete_worker(name='Иван')
+    assert db.get_worker_by_name('Иван') is second
+    db.delete_worker(worker_id=second.worker_id)
+    assert db.get_worker_by_name('Иван') is None
+    with pytest.raises(KeyError):
+        db.delete_worker('Иван')
+
+
+def test_rename_keeps_the_key(open_db):
+    db = open_db()
+    worker = add_worker(db)
+    db.change_worker_qt('Иван', 'Пётр')
+    assert db.get_worker_by_id(worker.worker_id).name == 'Пётр'
+    assert db.get_worker_by_name('Пётр') is worker and db.get_worker_by_name('Иван') is None
+    db.close()
+    db = open_db()
+    assert db.get_worker_by_name('Пётр').worker_id == worker.worker_id
+    # ключи новых записей продолжают выданные до перезапуска
+    assert add_worker(db).worker_id > worker.worker_id
+
+
+def test_brigade_number_is_not_mistaken_for_a_key(open_db):
+    db = open_db()
+    add_timetable(db, 1)
+    brigade = db.add_train_brigade(7, 'Иванов', 'Иван', 'машинист', 1)[0]
+    # номер другой бригады совпадает с ключом первой
+    other = db.add_train_brigade(brigade.brigade_id, 'Петров', 'Пётр', 'машинист', 1)[0]
+    db.change_brigade_number_qt(brigade.brigade_id, '8')
+    assert brigade.brigade_number == 7 and other.brigade_number == '8'
+    db.change_brigade_number_qt(None, '9', brigade_id=brigade.brigade_id)
+    assert brigade.brigade_number == '9'
+    db.delete_train_brigade(9)
+    assert db.get_train_brigade_by_id(brigade.brigade_id) is None
+    db.delete_train_brigade(brigade_id=other.brigade_id)
+    assert db.get_train_brigade_by_number(8) is None
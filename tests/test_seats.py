@@ -0,0 +1,201 @@
+import time
+
+import pytest
+
+from Individual_RZD import ConflictError, RzdDatabase, SeatsUnavailableError, SqliteStorage
+from conftest import add_timetable
+
+DAY_NS = 24 * 3600 * 10 ** 9
+
+
+def sell(db, number_of_tickets, number=1, **kwargs):
+    return db.add_ticket_sales_sheet(number, 'Петров Пётр Петрович', '4510 000001', number_of_tickets, 'нет', 1500,
+                                     **kwargs)[0]
+
+
+def test_sales_cannot_exceed_capacity(open_db):
+    db = open_db()
+    add_timetable(db, 1, carriages=1)
+    sheet = sell(db, 80)
+    assert len(sheet.seats) == 80 and db.available_seats(1) == 1
+    with pytest.raises(SeatsUnavailableError):
+        sell(db, 2)
+    db.change_number_of_tickets_qt(sheet.sale_id, 79)
+    sell(db, 2)
+    assert db.available_seats(1) == 0
+    db.delete_ticket_sales_sheet(sheet.sale_id)
+    assert db.available_seats(1) == 79
+
+
+def test_held_seats_become_sold(open_db):
+    db = open_db()
+    add_timetable(db, 1, carriages=2)
+    seats = db.hold_seats(1, 2, carriage=2)
+    assert seats == ((2, 1), (2, 2))
+    assert db.available_seats(1) == 160
+    sheet = sell(db, 2, seats=seats)
+    assert sheet.seats == seats and db.available_seats(1) == 160
+    with pytest.raises(SeatsUnavailableError):
+        sell(db, 2, seats=seats)
+
+
+def test_failed_sale_keeps_hold(open_db, monkeypatch):
+    db = open_db()
+    add_timetable(db, 1, carriages=1)
+    seats = db.hold_seats(1, 2)
+    original = db._write_payloads
+    monkeypatch.setattr(db, '_write_payloads', lambda payloads: (_ for _ in ()).throw(OSError('disk full')))
+    with pytest.raises(OSError):
+        sell(db, 2, seats=seats)
+    monkeypatch.setattr(db, '_write_payloads', original)
+    assert db.available_seats(1) == 79
+    assert sell(db, 2, seats=seats).seats == seats
+    assert db.available_seats(1) == 79
+
+
+def test_departures_have_separate_seat_maps(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1, departure='2023-05-01 10:00', carriages=1)
+    sell(db, 81)
+    with pytest.raises(SeatsUnavailableError):
+        sell(db, 1)
+    # следующий рейс того же поезда продаётся на свои места
+    sheet = sell(db, 81, departure='2023-05-02 10:00')
+    assert sheet.departure == '2023-05-02 10:00:00'
+    db.delete_train_timetable(1)
+    add_timetable(db, 1, departure='2023-05-03 10:00', carriages=1)
+    assert db.available_seats(1) == 81
+    assert db.available_seats(1, departure='2023-05-01 10:00') == 0
+    db.close()
+    assert open_db().available_seats(1, departure='2023-05-02 10:00') == 0
+
+
+def test_departed_runs_do_not_block_removing_carriages(open_db):
+    db = open_db()
+    add_timetable(db, 1, departure='2023-05-01 10:00', carriages=2)
+    sell(db, 100)
+    db.change_number_of_carriages_qt(1, 1)
+    sell(db, 10, departure='2999-01-01 10:00')
+    db.hold_seats(1, 60, departure='2999-01-01 10:00')
+    with pytest.raises(ValueError):
+        db.change_number_of_carriages_qt(1, 0)
+
+
+def test_shared_processes_cannot_oversell(open_db):
+    first = open_db(shared=True, node=1)
+    add_timetable(first, 1, carriages=1)
+    second = open_db(shared=True, node=2)
+    sell(first, 80)
+    # вторая касса продаёт по устаревшей карте мест: продажа откатывается
+    with pytest.raises(ConflictError):
+        sell(second, 2)
+    with pytest.raises(SeatsUnavailableError):
+        sell(second, 2)
+    sell(second, 1)
+    first.refresh()
+    assert first.available_seats(1) == 0
+    sales = first.find('ticket_sales_sheets', number_of_train=1)
+    assert sum(sheet.number_of_tickets for sheet in sales) == 81
+
+
+def test_sale_loads_only_its_seat_map_in_segmented_mode(open_db, monkeypatch):
+    now = time.time_ns()
+    db = open_db(segmented=True)
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    for day in range(5):
+        monkeypatch.setattr(time, 'time_ns', lambda: now + day * DAY_NS)
+        sell(db, 1, number=1 + day % 2)
+    # сегментная база пишет изменения в журнал: после сохранения он пуст и при открытии ничего не читает
+    db.save_database()
+    db.close()
+    db = open_db(segmented=True)
+    sales = db.database['ticket_sales_sheets']
+    unloaded = set(sales.unloaded)
+    assert len(unloaded) >= 4
+    monkeypatch.setattr(time, 'time_ns', lambda: now + 10 * DAY_NS)
+    sell(db, 1, number=2)
+    # разделы прошлых дней остаются непрочитанными
+    assert sales.unloaded == unloaded
+    assert db.available_seats(1) == 162 - 3 and db.available_seats(2) == 162 - 3
+
+
+def test_sale_reads_one_seat_map_from_sqlite(open_db, tmp_path, monkeypatch):
+    target = str(tmp_path / 'rzd.sqlite')
+    db = open_db(storage=SqliteStorage(target))
+    add_timetable(db, 1)
+    for _ in range(20):
+        sell(db, 1)
+    db.close()
+    db = open_db(storage=SqliteStorage(target))
+    loads = []
+    original = RzdDatabase._loads
+    monkeypatch.setattr(RzdDatabase, '_loads', staticmethod(lambda *args: loads.append(args) or original(*args)))
+    sell(db, 1)
+    assert len(loads) <= 3
+    assert db.available_seats(1) == 162 - 21
+
+
+def test_seat_maps_are_built_for_old_databases(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1, carriages=1)
+    first, second = sell(db, 2), sell(db, 3)
+    # ведомости базы прежнего формата: без рейса и таблицы карт мест
+    for sheet in (first, second):
+        sheet.departure = None
+    second.seats = None
+    del db.database['seat_maps']
+    db.save_database()
+    db.close()
+    db = open_db()
+    assert db.available_seats(1) == 76
+    sheets = [db.get_ticket_sales_sheet_by_id(sheet.sale_id) for sheet in (first, second)]
+    assert sheets[0].seats == first.seats and len(sheets[1].seats) == 3
+    assert {sheet.departure for sheet in sheets} == {'2023-05-01 10:00:00'}
+    db.close()
+    assert open_db().available_seats(1) == 76
+
+
+def test_train_without_capacity_writes_no_seat_map(open_db):
+    db = open_db()
+    db.add_ticket_sales_sheet(77, 'Петров Пётр Петрович', '4510 000001', 2, 'нет', 1500)
+    assert db.available_seats(77) is None
+    assert len(db.database['seat_maps']) == 0
+
+
+def test_shared_sales_of_different_seats_do_not_conflict(open_db):
+    first = open_db(shared=True)
+    add_timetable(first, 1, carriages=2)
+    second = open_db(shared=True)
+    sell(first, 3)
+    # вторая касса не видит продажу первой, но продаёт места другого вагона
+    seats = second.hold_seats(1, 2, carriage=2)
+    assert sell(second, 2, seats=seats).seats == seats
+    assert second.available_seats(1) == 162 - 5
+    first.refresh()
+    assert first.available_seats(1) == 162 - 5
+    sell(first, 1)
+    # карта мест уже есть у обеих касс: изменения второй переносятся на версию первой
+    seats = second.hold_seats(1, 1, carriage=2)
+    sell(second, 1, seats=seats)
+    assert second.available_seats(1) == 162 - 7
+    second.close()
+    first.close()
+    assert open_db(shared=True).available_seats(1) == 162 - 7
+
+
+def test_failed_rebased_sale_keeps_other_process_seats(open_db, monkeypatch):
+    first = open_db(shared=True)
+    add_timetable(first, 1, carriages=2)
+    second = open_db(shared=True)
+    sell(first, 3)
+    seats = second.hold_seats(1, 2, carriage=2)
+    original = second._append_journal
+    monkeypatch.setattr(second, '_append_journal', lambda changes: (_ for _ in ()).throw(OSError('disk full')))
+    with pytest.raises(OSError):
+        sell(second, 2, seats=seats)
+    monkeypatch.setattr(second, '_append_journal', original)
+    # откат вернул карту мест к версии первой кассы, бронь осталась за второй
+    assert second.available_seats(1) == 162 - 5
+    sell(second, 2, seats=seats)
+    assert second.available_seats(1) == 162 - 5
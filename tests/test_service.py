@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from Individual_RZD import RzdService, SqliteStorage
+from conftest import add_timetable
+
+
+async def sell_with_retries(service, count):
+    """Продаёт билеты, как кассы, которые повторяют продажу после ошибки записи"""
+
+    async def sell(number):
+        while True:
+            try:
+                return await service.add_ticket_sales_sheet(1, 'Пассажир %d' % number, '4510 00000%d' % number,
+                                                            1, 'нет', 1500)
+            except OSError:
+                continue
+
+    return await asyncio.gather(*[sell(number) for number in range(count)])
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'journal', 'sqlite'])
+def test_failed_batch_is_rolled_back_before_retry(open_db, monkeypatch, tmp_path, mode):
+    options = {'journal': mode == 'journal'}
+    if mode == 'sqlite':
+        options['storage'] = SqliteStorage(str(tmp_path / 'rzd.sqlite'))
+    db = open_db(**options)
+    add_timetable(db, 1)
+    target, name = (db.storage, 'write') if mode == 'sqlite' else \
+        (db, '_append_journal' if mode == 'journal' else '_write_payloads')
+    original = getattr(target, name)
+    failures = []
+
+    def failing(*args, **kwargs):
+        if not failures:
+            failures.append(args)
+            raise OSError('disk full')
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, failing)
+
+    async def main():
+        async with RzdService(db, window=0.01) as service:
+            return await sell_with_retries(service, 3)
+
+    sales = asyncio.run(main())
+    assert failures
+    assert len(sales) == 3
+    assert len(db.find('ticket_sales_sheets', number_of_train=1)) == 3
+    db.close()
+    if mode == 'sqlite':
+        options['storage'] = SqliteStorage(str(tmp_path / 'rzd.sqlite'))
+    db = open_db(**options)
+    assert len(db.find('ticket_sales_sheets', number_of_train=1)) == 3
+
+
+def test_error_of_one_change_does_not_fail_batch(open_db):
+    db = open_db()
+    add_timetable(db, 1)
+
+    async def main():
+        async with RzdService(db, window=0.01) as service:
+            return await asyncio.gather(service.change_ticket_price_qt(1, 2000),
+                                        service.change_ticket_price_qt(99, 1),
+                                        return_exceptions=True)
+
+    changed, failed = asyncio.run(main())
+    assert isinstance(failed, ValueError)
+    assert db.get_train_timetable_by_number(1).ticket_price == 2000
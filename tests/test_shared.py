@@ -0,0 +1,44 @@
+import pytest
+
+from Individual_RZD import ConflictError
+from conftest import add_timetable
+
+
+def test_changes_of_other_process_are_visible_after_refresh(open_db):
+    first = open_db(shared=True, node=1)
+    second = open_db(shared=True, node=2)
+    add_timetable(first, 1)
+    assert second.get_train_timetable_by_number(1) is None
+    second.refresh()
+    assert second.get_train_timetable_by_number(1) is not None
+
+
+def test_conflicting_change_is_rolled_back(open_db):
+    first = open_db(shared=True, node=1)
+    second = open_db(shared=True, node=2)
+    add_timetable(first, 1)
+    second.refresh()
+    first.change_ticket_price_qt(1, 2000)
+    with pytest.raises(ConflictError):
+        second.change_ticket_price_qt(1, 3000)
+    # изменение другого процесса применено, своё откачено
+    assert second.get_train_timetable_by_number(1).ticket_price == 2000
+    second.change_ticket_price_qt(1, 3000)
+    first.refresh()
+    assert first.get_train_timetable_by_number(1).ticket_price == 3000
+
+
+def test_processes_get_distinct_nodes(open_db, filename):
+    first = open_db(shared=True)
+    second = open_db(shared=True)
+    assert (first.node, second.node) == (0, 1)
+    with pytest.raises(ValueError):
+        open_db(shared=True, node=1)
+    add_timetable(first, 1)
+    add_timetable(first, 2)
+    second.refresh()
+    sale_id = first.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 1, 'нет', 1500)[0].sale_id
+    assert second.add_ticket_sales_sheet(2, 'Иванов Иван Иванович', '4510 000002', 1, 'нет', 1500)[0].sale_id != sale_id
+    # номер закрытой базы освобождается
+    first.close()
+    assert open_db(shared=True).node == 0
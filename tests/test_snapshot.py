@@ -0,0 +1,155 @@
+import logging
+import os
+
+import pytest
+
+from Individual_RZD import DatabaseCorruptedError, RecordCodec, Train
+from conftest import add_timetable
+
+
+def flip_last_byte(filename):
+    with open(filename, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xff]))
+
+
+def test_snapshot_keeps_previous_generation(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    assert os.path.exists(filename + '.prev')
+
+
+def test_corrupted_snapshot_is_an_error(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    db.close()
+    flip_last_byte(filename)
+    with pytest.raises(DatabaseCorruptedError):
+        open_db()
+
+
+def test_recover_reads_previous_generation_with_warning(open_db, filename, caplog):
+    db = open_db()
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    db.close()
+    flip_last_byte(filename)
+    with caplog.at_level(logging.WARNING):
+        db = open_db(recover=True)
+    assert 'предыдущее поколение' in caplog.text
+    # в предыдущем поколении нет только последнего изменения
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_timetable_by_number(2) is None
+
+
+def test_recover_does_not_replay_journal_on_previous_generation(open_db, filename, caplog):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    db.save_database()
+    add_timetable(db, 2)
+    db.save_database()
+    # журнал записан поверх последнего снимка
+    add_timetable(db, 3)
+    db.close()
+    flip_last_byte(filename)
+    with pytest.raises(DatabaseCorruptedError):
+        open_db(journal=True)
+    with caplog.at_level(logging.WARNING):
+        db = open_db(journal=True, recover=True)
+    assert 'не применён' in caplog.text
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_timetable_by_number(2) is None and db.get_train_timetable_by_number(3) is None
+    journal = os.path.splitext(filename)[0] + '.journal'
+    assert os.path.getsize(journal + '.unapplied') > 0
+    add_timetable(db, 4)
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(4) is not None
+
+
+def test_recover_checks_segments_touched_by_journal(open_db, filename):
+    db = open_db(journal=True, segmented=True)
+    add_timetable(db, 1)
+    db.save_database()
+    add_timetable(db, 2)
+    db.save_database()
+    add_timetable(db, 3)
+    db.close()
+    flip_last_byte(os.path.join(os.path.splitext(filename)[0] + '.d', 'train_timetables' + db.SEGMENT_SUFFIX))
+    db = open_db(journal=True, segmented=True, recover=True)
+    assert db.get_train_timetable_by_number(1) is not None and db.get_train_timetable_by_number(3) is None
+
+
+def test_both_generations_corrupted(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    db.close()
+    for generation in (filename, filename + '.prev'):
+        flip_last_byte(generation)
+    with pytest.raises(DatabaseCorruptedError):
+        open_db()
+
+
+def test_interrupted_write_leaves_previous_file(open_db, filename):
+    db = open_db()
+    add_timetable(db, 1)
+    db.close()
+    # временный файл недописанной перезаписи не читается
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(b'RZD1garbage')
+    assert open_db().get_train_timetable_by_number(1) is not None
+
+
+def test_segmented_database_reopens(open_db):
+    db = open_db(segmented=True)
+    add_timetable(db, 1)
+    sale = db.add_ticket_sales_sheet(1, 'Петров Пётр Петрович', '4510 000001', 1, 'нет', 1500)[0]
+    db.close()
+    db = open_db(segmented=True)
+    assert db.get_ticket_sales_sheet_by_id(sale.sale_id).passenger_fullname == 'Петров Пётр Петрович'
+
+
+def test_unreadable_snapshot_is_not_replaced_by_previous_generation(open_db, filename, monkeypatch):
+    db = open_db()
+    add_timetable(db, 1)
+    add_timetable(db, 2)
+    db.close()
+    # снимок записан версией с более новой схемой поезда: контрольная сумма верна, но прочитать его нельзя
+    monkeypatch.setitem(RecordCodec.SCHEMAS, 4, (Train, 0, RecordCodec.SCHEMAS[4][2]))
+    monkeypatch.setattr(RecordCodec, '_entities', {})
+    monkeypatch.setattr(RecordCodec, '_functions', None)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    with pytest.raises(ValueError):
+        open_db()
+    with open(filename, 'rb') as f:
+        assert f.read() == data
+
+
+
+def test_segmented_changes_survive_crash_between_segments(open_db, filename, monkeypatch):
+    db = open_db(segmented=True)
+    db.save_database()
+    original, written = db._write_file, []
+
+    def crash_after_first(name, data, *args):
+        # сбой после записи первого из изменённых сегментов
+        if written:
+            raise OSError('power loss')
+        written.append(name)
+        return original(name, data, *args)
+
+    monkeypatch.setattr(db, '_write_file', crash_after_first)
+    # расписание и новый поезд лежат в разных сегментах
+    add_timetable(db, 1)
+    with pytest.raises(OSError):
+        db.save_database()
+    monkeypatch.undo()
+    db = open_db(segmented=True)
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_by_number(1) is db.get_train_timetable_by_number(1).train
@@ -0,0 +1,17 @@
+import pytest
+
+from Individual_RZD import SqliteStorage, StorageBackend
+
+
+def test_storage_backend_requires_its_methods(tmp_path):
+    class PartialStorage(StorageBackend):
+        def tables(self, names):
+            return {}
+
+    with pytest.raises(TypeError):
+        StorageBackend()
+    with pytest.raises(TypeError):
+        PartialStorage()
+    storage = SqliteStorage(str(tmp_path / 'rzd.sqlite'))
+    assert isinstance(storage, StorageBackend)
+    storage.close()
@@ -0,0 +1,58 @@
+from conftest import add_timetable
+from Individual_RZD import RecordCodec, SqliteStorage
+
+
+def add_brigade(db, number_of_train):
+    return db.add_train_brigade('1', 'Иванов', 'Иван', 'проводник', number_of_train)[0]
+
+
+def test_timetable_and_brigades_share_one_train(open_db):
+    db = open_db()
+    timetable = add_timetable(db, 7)
+    brigade = add_brigade(db, 7)
+    assert timetable.train is brigade.train is db.get_train_by_number(7)
+    db.change_number_of_carriages_qt(7, 9)
+    assert timetable.train.number_of_carriages == brigade.train.number_of_carriages == 9
+    db.close()
+    db = open_db()
+    brigade = db.find("train_brigades", number_of_train=7)[0]
+    assert db.get_train_timetable_by_number(7).train is brigade.train is db.get_train_by_number(7)
+
+
+def test_evicted_train_is_read_again_by_number(open_db, tmp_path):
+    db = open_db(storage=SqliteStorage(str(tmp_path / 'rzd.sqlite'), cache_size=1))
+    for number in (7, 8, 9):
+        add_timetable(db, number)
+    timetable = db.get_train_timetable_by_number(7)
+    # поезд 7 вытесняется из кэша чтением других поездов и затем читается заново
+    db.get_train_by_number(8), db.get_train_by_number(9)
+    db.change_number_of_carriages_qt(7, 9)
+    assert timetable.train.number_of_carriages == 9
+
+
+def test_records_store_only_the_number_of_train(open_db, tmp_path):
+    storage = SqliteStorage(str(tmp_path / 'rzd.sqlite'))
+    db = open_db(storage=storage)
+    add_timetable(db, 7)
+    brigade = add_brigade(db, 7)
+    for table, key in (("train_timetables", 7), ("train_brigades", brigade.brigade_id)):
+        data = storage.execute('SELECT value FROM "{0}" WHERE key = ?'.format(table), (key,)).fetchone()[0]
+        record = RecordCodec.decode(data)
+        assert record.number_of_train == 7
+        assert record.__getstate__()['_{0}__train'.format(type(record).__name__)] is None
+
+
+def test_deleted_train_stays_with_its_timetable(open_db):
+    db = open_db()
+    timetable = add_timetable(db, 7, carriages=5)
+    brigade = add_brigade(db, 7)
+    db.delete_train(7)
+    assert db.get_train_by_number(7) is None
+    assert timetable.train.number_of_carriages == brigade.train.number_of_carriages == 5
+    db.close()
+    db = open_db()
+    assert db.get_train_timetable_by_number(7).train.number_of_carriages == 5
+    # новый поезд с тем же номером становится поездом оставшихся расписания и бригад
+    train = db.add_train(7, 2020, 3, 'купе')
+    assert db.get_train_timetable_by_number(7).train is train
+    assert db.find("train_brigades", number_of_train=7)[0].train is train
@@ -0,0 +1,117 @@
+import pytest
+
+from conftest import add_timetable
+
+
+def test_exception_rolls_back_transaction(open_db):
+    db = open_db()
+    add_timetable(db, 1)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.change_ticket_price_qt(1, 2000)
+            add_timetable(db, 2)
+            raise RuntimeError
+    assert db.get_train_timetable_by_number(1).ticket_price == 1500
+    assert db.get_train_timetable_by_number(2) is None
+    assert db.find('train_timetables', place_of_departure='Москва') == [db.get_train_timetable_by_number(1)]
+
+
+def test_nested_transaction_rolls_back_to_savepoint(open_db):
+    db = open_db(journal=True)
+    with db.transaction():
+        add_timetable(db, 1)
+        with pytest.raises(ValueError):
+            with db.transaction():
+                add_timetable(db, 2)
+                raise ValueError
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(1) is not None
+    assert db.get_train_timetable_by_number(2) is None
+
+
+def test_transaction_is_saved_once(open_db):
+    db = open_db(journal=True)
+    with db.batch():
+        for number in range(5):
+            add_timetable(db, number)
+    records = db._read_journal(db.journal_filename)[0]
+    assert len(records) == 1
+
+
+def fail_once(monkeypatch, target, name):
+    """Подменяет метод так, что первый его вызов завершается ошибкой записи"""
+    original = getattr(target, name)
+    calls = []
+
+    def failing(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OSError('disk full')
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, failing)
+    return calls
+
+
+@pytest.mark.parametrize('name, mode', [('_write_payloads', {}), ('_append_journal', {'segmented': True})])
+def test_failed_save_rolls_back_memory(open_db, monkeypatch, name, mode):
+    db = open_db(**mode)
+    add_timetable(db, 1)
+    fail_once(monkeypatch, db, name)
+    with pytest.raises(OSError):
+        db.change_ticket_price_qt(1, 2000)
+    assert db.get_train_timetable_by_number(1).ticket_price == 1500
+    # следующее сохранение не должно унести откаченное изменение на диск
+    add_timetable(db, 2)
+    db.close()
+    db = open_db(**mode)
+    assert db.get_train_timetable_by_number(1).ticket_price == 1500
+    assert db.get_train_timetable_by_number(2) is not None
+
+
+def test_failed_transaction_commit_rolls_back_whole_transaction(open_db, monkeypatch):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    fail_once(monkeypatch, db, '_append_journal')
+    with pytest.raises(OSError):
+        with db.transaction():
+            db.change_ticket_price_qt(1, 2000)
+            with db.transaction():
+                add_timetable(db, 2)
+    assert db.get_train_timetable_by_number(1).ticket_price == 1500
+    assert db.get_train_timetable_by_number(2) is None
+    assert not db._dirty
+    add_timetable(db, 3)
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(1).ticket_price == 1500
+    assert db.get_train_timetable_by_number(2) is None
+    assert db.get_train_timetable_by_number(3) is not None
+
+
+def test_torn_journal_write_is_cut_off(open_db, monkeypatch):
+    db = open_db(journal=True)
+    add_timetable(db, 1)
+    journal = db._journal_file
+    write = journal.write
+
+    class TornFile:
+        """Файл журнала, у которого обрывается запись после половины данных"""
+
+        def __getattr__(self, name):
+            return getattr(journal, name)
+
+        def write(self, data):
+            write(data[:len(data) // 2])
+            raise OSError('disk full')
+
+    db._journal_file = TornFile()
+    with pytest.raises(OSError):
+        add_timetable(db, 2)
+    db._journal_file = journal
+    add_timetable(db, 3)
+    db.close()
+    db = open_db(journal=True)
+    assert db.get_train_timetable_by_number(2) is None
+    assert db.get_train_timetable_by_number(3) is not None